@@ -0,0 +1,118 @@
+# app/cache.py
+# In-process, per-user cache for the read endpoints the Mini App polls on every screen switch.
+# Entries are the finished JSON bytes plus a strong ETag, so a hit skips SQLite *and* pydantic,
+# and a client that already has the body gets a bodyless 304. Any write for a user drops all
+# of that user's entries (app.events.user_data_changed).
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import json
+
+
+MAX_ENTRIES = 10_000
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def to_json(data: Any) -> bytes:
+    # same output as fastapi's JSONResponse
+    return json.dumps(
+        jsonable_encoder(data),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class ReadCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[int, Hashable], Tuple[bytes, str]]" = OrderedDict()
+        self._keys_by_user: Dict[int, set] = {}
+        self._generations: Dict[int, int] = {}  # same trick as the heatmap tiles: no caching across a write
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, user_id: int, key: Hashable) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None:
+                self._entries.move_to_end((user_id, key))
+            return entry
+
+    def generation(self, user_id: int) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, user_id: int, key: Hashable, body: bytes, etag: str, generation: int):
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            self._drop((user_id, key))
+            self._entries[(user_id, key)] = (body, etag)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._drop((user_id, key))
+
+    def clear(self):
+        with self._lock:
+            for user_id in self._keys_by_user:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._bytes = 0
+
+    # needs self._lock held
+    def _drop(self, full_key):
+        entry = self._entries.pop(full_key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry[0])
+        user_id, key = full_key
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+    # Serves `key` for `user_id` from the cache (awaiting `build` for the JSON body on a miss),
+    # answering 304 when the client's If-None-Match already has it
+    async def respond(self, request: Request, user_id: int, key: Hashable, build: Callable[[], Awaitable[bytes]]) -> Response:
+        entry = self.get(user_id, key)
+        if entry is None:
+            generation = self.generation(user_id)
+            body = await build()
+            entry = (body, make_etag(body))
+            self.put(user_id, key, *entry, generation)
+
+        body, etag = entry
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+read_cache = ReadCache()
@@ -1,25 +1,121 @@
-from sqlalchemy import create_engine
+import os
+
+from functools import partial
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 
-# SQLite URL (local)
-SQLALCHEMY_DATABASE_URL = "sqlite:///./habits.db"
+# SQLite URL (local), HABITS_DATABASE_URL points it somewhere else (benchmarks, scratch copies...)
+SQLALCHEMY_DATABASE_URL = os.getenv("HABITS_DATABASE_URL", "sqlite:///./habits.db")
+
+# connection tuning, all per connection
+READ_POOL_SIZE = int(os.getenv("HABITS_DB_READ_POOL", "8"))
+CACHE_KIB = int(os.getenv("HABITS_DB_CACHE_KIB", "8192"))
+MMAP_BYTES = int(os.getenv("HABITS_DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+BUSY_TIMEOUT_MS = int(os.getenv("HABITS_DB_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # WAL is stored in the file, so once the writer has set it every reader gets it too
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+    cursor.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+# SQLite leaves foreign keys off unless every connection asks, and the ON DELETE CASCADEs on the
+# models are what deletes a habit's rows
+def _foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url and url.rstrip("/") != "sqlite:"
+
+
+# Engine (basically a db connection). For a SQLite file that's a WAL database with a pool of
+# `pool_size` connections, `read_only` ones refuse to write (PRAGMA query_only)
+def make_engine(url: str, pool_size: int = 5, read_only: bool = False) -> Engine:
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_size=pool_size, max_overflow=0)
+    if not _is_sqlite_file(url):
+        # in-memory databases only exist on their one connection, nothing to tune or split
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", _foreign_keys)
+        return engine
+
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=30,
+    )
+    event.listen(engine, "connect", partial(_sqlite_pragmas, read_only=read_only))
+    event.listen(engine, "connect", _foreign_keys)
+    return engine
 
-# Engine (basically a db connection)
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
 
-# SessionLocal is an instance used to talk to the DB
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+# HABITS_SHARDS > 1 spreads the users over that many SQLite files, each with its own writer (see
+# app/shards.py for who lives where). Shard 0 is HABITS_DATABASE_URL, shard i the same file with
+# ".i" before the extension (habits.db -> habits.1.db, ...)
+SHARD_COUNT = int(os.getenv("HABITS_SHARDS", "1"))
+
+
+def shard_url(url: str, index: int) -> str:
+    if index == 0:
+        return url
+    if not _is_sqlite_file(url):
+        raise ValueError(f"HABITS_SHARDS needs a SQLite file, not {url}")
+    stem, dot, suffix = url.rpartition(".")
+    return f"{stem}.{index}.{suffix}" if dot and "/" not in suffix else f"{url}.{index}"
+
+
+# One database file. SQLite takes one writer at a time anyway, so writes share a single connection
+# (waiting on the pool instead of on SQLITE_BUSY), and reads get their own read-only pool that WAL
+# lets run alongside it
+class Shard:
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        self.engine = make_engine(url, pool_size=1)
+        if _is_sqlite_file(url):
+            self.read_engine = make_engine(url, pool_size=READ_POOL_SIZE, read_only=True)
+        else:
+            self.read_engine = self.engine
+
+        # SessionLocal is an instance used to talk to the DB (writes, and anything outside a request),
+        # ReadSessionLocal is for reads only
+        self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False, info={"shard": index})
+        self.ReadSessionLocal = sessionmaker(
+            bind=self.read_engine,
+            expire_on_commit=False,
+            info={"shard": index, "read_only": self.read_engine is not self.engine},
+        )
+
+
+shards = [Shard(index, shard_url(SQLALCHEMY_DATABASE_URL, index)) for index in range(SHARD_COUNT)]
 
 # Base is the class for models to inherit from
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+def is_read_only(db) -> bool:
+    return db.info.get("read_only", False)
+
+
+def shard_of_session(db) -> int:
+    return db.info.get("shard", 0)
+
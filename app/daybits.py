@@ -0,0 +1,261 @@
+# app/daybits.py
+# Compact completion history: one habit_year_bits row per habit per year, holding a packed bitmap
+# of the days that have something logged (46 bytes) and, once any day has a value, the day totals
+# as an int32 array. A multi-year habit is a handful of small rows instead of a row per day, and
+# streaks / heatmap / progress work on whole numpy arrays of it instead of walking rows.
+#
+# It's derived from habit_completions (one row per habit per day, its value is the day's total) and
+# written by the completion write paths (set_day / clear_day, rebuild for bulk changes) in the
+# same transaction, and goes with the habit (ON DELETE CASCADE). Bit i of a year is day-of-year i + 1.
+# Whether a day *counts* (target reached, limit kept) isn't stored, it depends on the habit's
+# current type/target, so it's derived from the totals when reading (qualifying()).
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import models
+from app.schemas import HabitType
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import sys
+
+from datetime import date
+
+
+Bits = models.HabitYearBits
+Completion = models.HabitCompletion
+
+DAYS = 366
+BATCH = 5000  # rows per insert when rebuilding
+
+
+def _index(day: date) -> int:
+    return day.timetuple().tm_yday - 1
+
+
+def _unpack(logged: bytes) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(logged, dtype=np.uint8), count=DAYS, bitorder="little").astype(bool)
+
+
+def _pack(logged: np.ndarray) -> bytes:
+    return np.packbits(logged, bitorder="little").tobytes()
+
+
+def _values(totals: Optional[bytes]) -> np.ndarray:
+    if totals is None:
+        return np.zeros(DAYS, dtype=np.int32)
+    return np.frombuffer(totals, dtype="<i4").copy()
+
+
+def _row(habit_id: int, user_id: int, year: int, logged: np.ndarray, values: np.ndarray) -> dict:
+    return {
+        "habit_id": habit_id,
+        "user_id": user_id,
+        "year": year,
+        "logged": _pack(logged),
+        "totals": values.astype("<i4").tobytes() if values.any() else None,
+    }
+
+
+# `db` is a Session or a Connection, both execute() the same
+def _write_day(db, habit_id: int, user_id: int, day: date, total_value: Optional[int]):
+    current = db.execute(select(Bits.logged, Bits.totals).where(
+        Bits.habit_id == habit_id,
+        Bits.year == day.year
+    )).first()
+    if current is None and total_value is None:
+        return
+
+    logged = _unpack(current.logged) if current is not None else np.zeros(DAYS, dtype=bool)
+    values = _values(current.totals if current is not None else None)
+    logged[_index(day)] = total_value is not None
+    values[_index(day)] = total_value or 0
+    if not logged.any():
+        db.execute(delete(Bits).where(Bits.habit_id == habit_id, Bits.year == day.year))
+        return
+
+    row = _row(habit_id, user_id, day.year, logged, values)
+    db.execute(sqlite_insert(Bits).values(**row).on_conflict_do_update(
+        index_elements=[Bits.habit_id, Bits.year],
+        set_={"logged": row["logged"], "totals": row["totals"]},
+    ))
+
+
+# Called by the completion write paths before they commit, with the day's row as it is now
+# (set_day), or after it went away (clear_day)
+def set_day(db, habit_id: int, user_id: int, day: date, total_value: int):
+    _write_day(db, habit_id, user_id, day, total_value)
+
+
+def clear_day(db, habit_id: int, user_id: int, day: date):
+    _write_day(db, habit_id, user_id, day, None)
+
+
+# (row count, summed value) for one day, (0, 0) if nothing was logged. Single days come from
+# habit_completions itself (its unique (habit, user, day) index), the bitmaps are for ranges
+def day_totals(db, habit_id: int, user_id: int, day: date) -> Tuple[int, int]:
+    row = db.execute(select(Completion.value).where(
+        Completion.habit_id == habit_id,
+        Completion.user_id == user_id,
+        Completion.local_day == day
+    )).first()
+    return (1, row.value or 0) if row else (0, 0)
+
+
+# every completion as (habit_id, user_id, day, total), of one user or everyone
+def _days_query(user_id: Optional[int] = None):
+    query = select(Completion.habit_id, Completion.user_id, Completion.local_day, func.coalesce(Completion.value, 0))
+    if user_id is not None:
+        query = query.where(Completion.user_id == user_id)
+    return query
+
+
+# rebuilds the bitmaps (of one user, or everyone) from habit_completions
+def rebuild(db, user_id: Optional[int] = None) -> int:
+    wipe = delete(Bits)
+    if user_id is not None:
+        wipe = wipe.where(Bits.user_id == user_id)
+    db.execute(wipe)
+
+    rows, written = [], 0
+    key, logged, values = None, None, None
+    query = _days_query(user_id).order_by(Completion.habit_id, Completion.local_day)
+    result = db.execute(query.execution_options(yield_per=BATCH))
+    for habit_id, uid, day, total_value in result:
+        if key != (habit_id, uid, day.year):
+            if key is not None:
+                rows.append(_row(*key, logged, values))
+            key = (habit_id, uid, day.year)
+            logged, values = np.zeros(DAYS, dtype=bool), np.zeros(DAYS, dtype=np.int32)
+        logged[_index(day)] = True
+        values[_index(day)] = total_value
+        if len(rows) >= BATCH:
+            db.execute(insert(Bits), rows)
+            written += len(rows)
+            rows = []
+    if key is not None:
+        rows.append(_row(*key, logged, values))
+    if rows:
+        db.execute(insert(Bits), rows)
+        written += len(rows)
+    return written
+
+
+# (logged, totals) as (habits x days) matrices over [start, end], rows in `habit_ids` order
+def load(db, habit_ids: List[int], start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    days = (end - start).days + 1
+    logged = np.zeros((len(habit_ids), days), dtype=bool)
+    values = np.zeros((len(habit_ids), days), dtype=np.int32)
+    if not habit_ids:
+        return logged, values
+
+    row_of = {habit_id: row for row, habit_id in enumerate(habit_ids)}
+    result = db.execute(select(Bits.habit_id, Bits.year, Bits.logged, Bits.totals).where(
+        Bits.habit_id.in_(habit_ids),
+        Bits.year >= start.year,
+        Bits.year <= end.year
+    ))
+    for habit_id, year, year_logged, year_totals in result:
+        lo, hi = max(start, date(year, 1, 1)), min(end, date(year, 12, 31))
+        a, b = _index(lo), _index(hi) + 1
+        at = (lo - start).days
+        logged[row_of[habit_id], at:at + b - a] = _unpack(year_logged)[a:b]
+        if year_totals is not None:
+            values[row_of[habit_id], at:at + b - a] = np.frombuffer(year_totals, dtype="<i4")[a:b]
+    return logged, values
+
+
+# a habit's whole history: (first day, logged, totals), first day is Jan 1st of its first year.
+# None if nothing was ever logged
+def habit_history(db, habit_id: int) -> Optional[Tuple[date, np.ndarray, np.ndarray]]:
+    years = db.execute(select(Bits.year).where(Bits.habit_id == habit_id).order_by(Bits.year)).scalars().all()
+    if not years:
+        return None
+    first, last = date(years[0], 1, 1), date(years[-1], 12, 31)
+    logged, values = load(db, [habit_id], first, last)
+    return first, logged[0], values[0]
+
+
+# which of these habits have something logged on `day` (one query, one bit each)
+def logged_on(db, habit_ids: Iterable[int], day: date) -> set:
+    habit_ids = list(habit_ids)
+    if not habit_ids:
+        return set()
+    logged, _ = load(db, habit_ids, day, day)
+    return {habit_id for habit_id, bit in zip(habit_ids, logged[:, 0]) if bit}
+
+
+# does each day count, for the habit as it is now (streaks.day_qualifies, vectorized)
+def qualifying(habit: models.Habit, logged: np.ndarray, values: np.ndarray) -> np.ndarray:
+    if habit.type == HabitType.COUNTABLE:
+        return logged & (values >= (habit.target or 1))
+    if habit.type == HabitType.LIMIT:
+        return logged & (values < (habit.target or 0))
+    return logged
+
+
+# list of (habit_id, year, problem) where the bitmaps and habit_completions disagree
+def verify(db, user_id: Optional[int] = None) -> list:
+    expected: Dict[tuple, Dict[int, int]] = {}
+    for habit_id, _, day, total_value in db.execute(_days_query(user_id)):
+        expected.setdefault((habit_id, day.year), {})[_index(day)] = total_value
+
+    stored = {}
+    query = select(Bits.habit_id, Bits.year, Bits.logged, Bits.totals)
+    if user_id is not None:
+        query = query.where(Bits.user_id == user_id)
+    for habit_id, year, logged, totals in db.execute(query):
+        days = _unpack(logged)
+        values = _values(totals)
+        stored[(habit_id, year)] = {int(i): int(values[i]) for i in np.flatnonzero(days)}
+
+    return [
+        (habit_id, year, f"stored {len(stored.get((habit_id, year), {}))} day(s), expected {len(expected.get((habit_id, year), {}))}")
+        for habit_id, year in sorted(expected.keys() | stored.keys())
+        if stored.get((habit_id, year), {}) != expected.get((habit_id, year), {})
+    ]
+
+
+# for databases that have completions but never had the bitmaps built: fill them once at startup
+def ensure_backfilled(db):
+    has_bits = db.execute(select(Bits.habit_id).limit(1)).first()
+    has_completions = db.execute(select(Completion.id).limit(1)).first()
+    if has_completions and not has_bits:
+        rebuild(db)
+        db.commit()
+
+
+# python -m app.daybits backfill|verify [--user-id N]
+def main(argv=None) -> int:
+    from app.database import shards
+    from app.migrations import migrate
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the year bitmaps from habit_completions")
+    parser.add_argument("command", choices=["backfill", "verify"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for shard in shards:
+        migrate(shard.engine)
+        db = shard.SessionLocal()
+        try:
+            if args.command == "backfill":
+                rows = rebuild(db, args.user_id)
+                db.commit()
+                print(f"backfilled {rows} year bitmaps")
+                continue
+
+            problems = verify(db, args.user_id)
+            for habit_id, year, problem in problems:
+                print(f"habit {habit_id} {year} bitmap: {problem}")
+            print(f"verified year bitmaps, {len(problems)} mismatch(es)")
+            failed = failed or bool(problems)
+        finally:
+            db.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# app/db_async.py
+# The async face of the database. Route handlers are `async def` and hand their (sync) SQLAlchemy
+# work to bounded executors of the current shard (app.shards): reads to as many threads as there
+# are read connections, writes to one thread for the one writer connection. The event loop never blocks on SQLite, cache hits
+# never leave it, and how much runs at once is set by the connection pools instead of the
+# threadpool every sync route used to share.
+from sqlalchemy.orm import Session
+
+from typing import Any, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import time
+
+from app import metrics, profiling, shards
+from app.cache import to_json
+from app.database import READ_POOL_SIZE
+
+
+T = TypeVar("T")
+
+# per shard: the reads get as many threads as there are read connections (an in-memory database
+# has the single engine, so one), the writes one thread for the one writer connection
+_read_executors = [
+    ThreadPoolExecutor(
+        max_workers=READ_POOL_SIZE if shard.read_engine is not shard.engine else 1,
+        thread_name_prefix=f"db-read-{shard.index}",
+    )
+    for shard in shards.shards
+]
+_write_executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-write-{shard.index}") for shard in shards.shards]
+
+
+async def _run(executor: ThreadPoolExecutor, factory, fn: Callable[..., T], args, kwargs) -> T:
+    submitted = time.perf_counter()
+
+    def call():
+        metrics.add_queue_wait(time.perf_counter() - submitted)
+        with factory() as db, profiling.thread_profile():
+            return fn(db, *args, **kwargs)
+
+    # copy the context so the metrics hooks (and app.profiling) still know which request this is
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, call)
+
+
+# fn(db, *args, **kwargs) on a read-only session of the current shard (app.shards)
+async def run_read(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    shard = shards.current()
+    return await _run(_read_executors[shard.index], shard.ReadSessionLocal, fn, args, kwargs)
+
+
+# fn(db, *args, **kwargs) on the current shard's writer session, fn commits
+async def run_write(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    shard = shards.current()
+    return await _run(_write_executors[shard.index], shard.SessionLocal, fn, args, kwargs)
+
+
+# run_read, serialized to JSON bytes on the worker too (for app.cache)
+async def read_json(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bytes:
+    def build(db: Session, *args, **kwargs) -> bytes:
+        return to_json(fn(db, *args, **kwargs))
+    return await run_read(build, *args, **kwargs)
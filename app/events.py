@@ -0,0 +1,17 @@
+# app/events.py
+# Everything that keeps derived per-user state in memory hears about writes through here.
+# Call it *after* the commit, with the day that changed if it was a completion write and the
+# habits the write touched (None: not about single habits, e.g. a timezone change).
+from app import heatmap
+from app.cache import read_cache
+from app.live import hub
+
+from typing import Iterable, Optional
+
+from datetime import date
+
+
+def user_data_changed(user_id: int, day: Optional[date] = None, habit_ids: Optional[Iterable[int]] = None):
+    heatmap.invalidate(user_id, day)
+    read_cache.invalidate_user(user_id)
+    hub.changed(user_id, habit_ids)  # the user's open today screens (app.live)
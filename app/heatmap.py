@@ -0,0 +1,129 @@
+# app/heatmap.py
+# Expected-vs-completed grid for the heatmap. Every month is a (habits x days) numpy matrix,
+# finished months get cached as read-only tiles (per user), so a request only recomputes
+# the current month. Completion/habit writes drop the tiles they touch (see invalidate()).
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import daybits, models
+from app.localtime import local_today
+from app.recurrence import compile_rule
+
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+
+from datetime import date, timedelta
+from calendar import monthrange
+
+
+MAX_TILES = 20_000  # a tile is two small int arrays, so this is a few MB at most
+
+_tiles: "OrderedDict[Tuple[int, int, int], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_generations: Dict[int, int] = {}  # bumped on every invalidate, so a tile computed before a write never gets cached after it
+_lock = Lock()
+
+
+def _month_bounds(year: int, month: int) -> Tuple[date, date]:
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def _months(start: date, end: date) -> List[Tuple[int, int]]:
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+# completed / total per day for [start, end], computed from scratch
+def _compute(db: Session, user_id: int, habits: List[models.Habit], start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    days = (end - start).days + 1
+    expected = np.zeros((len(habits), days), dtype=bool)
+    if not habits:
+        return np.zeros(days, dtype=np.int64), expected.sum(axis=0)
+
+    for row, habit in enumerate(habits):
+        due = [(day - start).days for day in compile_rule(habit).due_days(start, end)]
+        expected[row, due] = True
+
+    done, _ = daybits.load(db, [habit.id for habit in habits], start, end)
+    return done.sum(axis=0), expected.sum(axis=0)
+
+
+def _get_tile(user_id: int, year: int, month: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    with _lock:
+        tile = _tiles.get((user_id, year, month))
+        if tile is not None:
+            _tiles.move_to_end((user_id, year, month))
+        return tile
+
+
+def _put_tile(user_id: int, year: int, month: int, completed: np.ndarray, total: np.ndarray, generation: int):
+    completed.setflags(write=False)
+    total.setflags(write=False)
+    with _lock:
+        if _generations.get(user_id, 0) != generation:
+            return
+        _tiles[(user_id, year, month)] = (completed, total)
+        while len(_tiles) > MAX_TILES:
+            _tiles.popitem(last=False)
+
+
+# day given: that month's tile is stale (completion write). No day: all of the user's tiles are (habit write)
+def invalidate(user_id: int, day: Optional[date] = None):
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        if day is not None:
+            _tiles.pop((user_id, day.year, day.month), None)
+            return
+        for key in [key for key in _tiles if key[0] == user_id]:
+            del _tiles[key]
+
+
+def build_heatmap(db: Session, user_id: int, start: date, end: date) -> Dict[str, list]:
+    today = local_today(db, user_id)
+    with _lock:
+        generation = _generations.get(user_id, 0)
+
+    habits = db.query(models.Habit).filter(
+        models.Habit.user_id == user_id,
+        models.Habit.tracked == True,
+        models.Habit.deleted_at.is_(None)
+    ).all()
+
+    months = _months(start, end)
+    tiles = {}
+    to_compute = []
+    for year, month in months:
+        month_start, month_end = _month_bounds(year, month)
+        tile = _get_tile(user_id, year, month) if month_end < today else None
+        if tile is None:
+            to_compute.append((year, month))
+        else:
+            tiles[(year, month)] = tile
+
+    # one pass (and one query) over every month that wasn't cached
+    if to_compute:
+        compute_start = _month_bounds(*to_compute[0])[0]
+        compute_end = _month_bounds(*to_compute[-1])[1]
+        completed, total = _compute(db, user_id, habits, compute_start, compute_end)
+        for year, month in to_compute:
+            month_start, month_end = _month_bounds(year, month)
+            lo, hi = (month_start - compute_start).days, (month_end - compute_start).days + 1
+            tile = (completed[lo:hi].copy(), total[lo:hi].copy())
+            if month_end < today:
+                _put_tile(user_id, year, month, *tile, generation)
+            tiles[(year, month)] = tile
+
+    completed = np.concatenate([tiles[month][0] for month in months])
+    total = np.concatenate([tiles[month][1] for month in months])
+    lo = (start - _month_bounds(*months[0])[0]).days
+    hi = lo + (end - start).days + 1
+
+    return {
+        "days": [(start + timedelta(days=offset)).isoformat() for offset in range(hi - lo)],
+        "completed": completed[lo:hi].tolist(),
+        "total": total[lo:hi].tolist(),
+    }
@@ -0,0 +1,166 @@
+# app/history.py
+# Completion history: keyset pages for the app, and a streamed export of everything for the user.
+# Pages (and export batches) are cut on (completed_at, id), so deep pages cost the same as the first one.
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.db_async import run_read
+
+from typing import AsyncIterator, List, Optional, Tuple
+import base64
+import csv
+import io
+import json
+
+from datetime import date, datetime
+
+
+EXPORT_BATCH = 1000
+EXPORT_COLUMNS = ["id", "habit_id", "habit_name", "day", "completed_at", "value"]
+
+Completion = models.HabitCompletion
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(completed_at: datetime, completion_id: int) -> str:
+    raw = f"{completed_at.isoformat()}|{completion_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        completed_at, completion_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(completed_at), int(completion_id)
+    except ValueError as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def completions_page(
+    db: Session,
+    user_id: int,
+    habit_id: int,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    newest_first: bool = True,
+) -> Tuple[List[models.HabitCompletion], Optional[str]]:
+    # a deleted habit's completions stay around until app.purge gets to them, they aren't history anymore
+    query = db.query(Completion).join(
+        models.Habit, models.Habit.id == Completion.habit_id
+    ).filter(
+        Completion.habit_id == habit_id,
+        Completion.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
+    )
+    if since is not None:
+        query = query.filter(Completion.local_day >= since)
+    if until is not None:
+        query = query.filter(Completion.local_day <= until)
+
+    if cursor is not None:
+        completed_at, completion_id = decode_cursor(cursor)
+        if newest_first:
+            query = query.filter(or_(
+                Completion.completed_at < completed_at,
+                and_(Completion.completed_at == completed_at, Completion.id < completion_id)
+            ))
+        else:
+            query = query.filter(or_(
+                Completion.completed_at > completed_at,
+                and_(Completion.completed_at == completed_at, Completion.id > completion_id)
+            ))
+
+    if newest_first:
+        query = query.order_by(Completion.completed_at.desc(), Completion.id.desc())
+    else:
+        query = query.order_by(Completion.completed_at, Completion.id)
+
+    # one extra row tells us whether there's a next page
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].completed_at, items[-1].id)
+    return items, next_cursor
+
+
+# One export batch: the next EXPORT_BATCH rows after `after` (completed_at, id), already encoded,
+# so the event loop only passes bytes along. Each batch is its own short read on the db executor,
+# nothing holds a connection while the client is slow to read
+def _export_batch(db: Session, user_id: int, after: Optional[Tuple[datetime, int]], encode) -> Tuple[bytes, Optional[Tuple[datetime, int]]]:
+    query = select(
+        Completion.id,
+        Completion.habit_id,
+        models.Habit.name,
+        Completion.local_day,
+        Completion.completed_at,
+        Completion.value,
+    ).join(
+        models.Habit, models.Habit.id == Completion.habit_id
+    ).where(
+        Completion.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
+    )
+    if after is not None:
+        completed_at, completion_id = after
+        query = query.where(or_(
+            Completion.completed_at > completed_at,
+            and_(Completion.completed_at == completed_at, Completion.id > completion_id)
+        ))
+
+    rows = db.execute(query.order_by(Completion.completed_at, Completion.id).limit(EXPORT_BATCH)).all()
+    next_after = (rows[-1].completed_at, rows[-1].id) if len(rows) == EXPORT_BATCH else None
+    return encode(rows), next_after
+
+
+async def _export(user_id: int, encode) -> AsyncIterator[bytes]:
+    after = None
+    while True:
+        chunk, after = await run_read(_export_batch, user_id, after, encode)
+        if chunk:
+            yield chunk
+        if after is None:
+            return
+
+
+def _jsonable(row: tuple) -> dict:
+    completion_id, habit_id, habit_name, day, completed_at, value = row
+    return {
+        "id": completion_id,
+        "habit_id": habit_id,
+        "habit_name": habit_name,
+        "day": day.isoformat() if day else None,
+        "completed_at": completed_at.isoformat() if completed_at else None,
+        "value": value,
+    }
+
+
+def _ndjson_lines(rows: List[tuple]) -> bytes:
+    return "".join(json.dumps(_jsonable(row), ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def _csv_lines(rows: List[tuple]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        item = _jsonable(row)
+        writer.writerow([item[column] for column in EXPORT_COLUMNS])
+    return buffer.getvalue().encode("utf-8")
+
+
+def export_ndjson(user_id: int) -> AsyncIterator[bytes]:
+    return _export(user_id, _ndjson_lines)
+
+
+async def export_csv(user_id: int) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    async for chunk in _export(user_id, _csv_lines):
+        yield chunk
@@ -0,0 +1,169 @@
+# app/live.py
+# Live updates for the today screen. Users have the Mini App open on phone and desktop at the same
+# time, each one holds a WebSocket (/api/live, app/routes/live.py) and gets the summary rows of the
+# habits a write touched, so a tap on one device shows up on the others without polling.
+#
+# Writes already report through app.events.user_data_changed, which tells the hub here (after the
+# commit). Users without a connection cost a dict lookup. For the others one refresh per user runs
+# at a time, reading the touched habits' rows once for all of the user's connections, and changes
+# that come in meanwhile go into its next round, so rows always go out in write order.
+#
+# Backpressure is per connection: what a connection hasn't sent yet is kept per habit, a newer row
+# replacing the older one, so a slow client gets fewer (fresher) messages instead of a growing queue.
+# Past MAX_PENDING habits, or after a change that isn't about single habits (timezone), it gets a
+# single {"type": "resync"} (refetch everything) instead, and a send that takes longer than
+# SEND_TIMEOUT closes the connection. An idle connection is its receive loop and a Subscriber, a
+# sending task only exists while the connection has something to send.
+from fastapi import WebSocket
+from fastapi.encoders import jsonable_encoder
+
+from app.db_async import run_read
+from app.logger import logger
+from app.shards import use_user
+from app.summary import build_today_rows
+
+from typing import Dict, Iterable, List, Optional, Set
+import asyncio
+import json
+import os
+
+
+MAX_PENDING = int(os.getenv("HABITS_LIVE_MAX_PENDING", "64"))  # unsent habits per connection before it's a resync
+SEND_TIMEOUT = float(os.getenv("HABITS_LIVE_SEND_TIMEOUT", "10"))  # seconds, a client slower than that is dropped
+CLOSE_TIMEOUT = 1.0
+
+
+class Subscriber:
+    __slots__ = ("websocket", "user_id", "day", "pending", "resync", "sender")
+
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.day: Optional[str] = None
+        self.pending: Optional[Dict[int, Optional[dict]]] = None  # habit_id -> row, None = off today's list
+        self.resync = False
+        self.sender: Optional[asyncio.Task] = None
+
+    def add(self, day: str, rows: List[dict], removed: List[int]):
+        if self.resync:
+            return  # the resync covers it
+        if self.pending is None:
+            self.pending = {}
+        self.day = day
+        for row in rows:
+            self.pending[row["id"]] = row
+        for habit_id in removed:
+            self.pending[habit_id] = None
+        if len(self.pending) > MAX_PENDING:
+            self.add_resync()
+
+    def add_resync(self):
+        self.resync, self.pending = True, None
+
+    # what's pending as one message (and nothing pending anymore)
+    def take(self) -> Optional[dict]:
+        if self.resync:
+            self.resync = False
+            return {"type": "resync"}
+        if not self.pending:
+            return None
+        pending, self.pending = self.pending, None
+        return {
+            "type": "today",
+            "day": self.day,
+            "habits": [row for row in pending.values() if row is not None],
+            "removed": [habit_id for habit_id, row in pending.items() if row is None],
+        }
+
+
+class Hub:
+    # only ever touched from the event loop
+    def __init__(self):
+        self._users: Dict[int, Set[Subscriber]] = {}
+        self._changed: Dict[int, Optional[Set[int]]] = {}  # habits changed since the user's last refresh, None = everything
+        self._refreshing: Dict[int, asyncio.Task] = {}
+        self.connections = 0
+        self.dropped = 0  # connections closed for being too slow
+
+    def watching(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def subscribe(self, websocket: WebSocket, user_id: int) -> Subscriber:
+        subscriber = Subscriber(websocket, user_id)
+        self._users.setdefault(user_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._users.get(subscriber.user_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._users[subscriber.user_id]
+        self.connections -= 1
+        if subscriber.sender is not None and subscriber.sender is not asyncio.current_task():
+            subscriber.sender.cancel()
+
+    # habit_ids None: something that isn't about single habits changed, the clients refetch
+    def changed(self, user_id: int, habit_ids: Optional[Iterable[int]] = None):
+        if user_id not in self._users:
+            return
+        if habit_ids is None:
+            self._changed[user_id] = None
+        elif user_id not in self._changed:
+            self._changed[user_id] = set(habit_ids)
+        elif self._changed[user_id] is not None:
+            self._changed[user_id].update(habit_ids)
+
+        if user_id not in self._refreshing:
+            self._refreshing[user_id] = asyncio.get_running_loop().create_task(self._refresh(user_id))
+
+    async def _refresh(self, user_id: int):
+        use_user(user_id)  # this task's own context
+        try:
+            while user_id in self._changed and user_id in self._users:
+                habit_ids = self._changed.pop(user_id)
+                update = None
+                if habit_ids is not None:
+                    try:
+                        day, rows, removed = await run_read(lambda db: build_today_rows(user_id, sorted(habit_ids), db))
+                        update = day.isoformat(), jsonable_encoder(rows), removed  # encoded once for every connection
+                    except Exception:
+                        logger.exception("live update for user %s failed, sending a resync", user_id)
+
+                for subscriber in list(self._users.get(user_id, ())):
+                    if update is None:
+                        subscriber.add_resync()
+                    else:
+                        subscriber.add(*update)
+                    if subscriber.sender is None:
+                        subscriber.sender = asyncio.get_running_loop().create_task(self._send(subscriber))
+        finally:
+            del self._refreshing[user_id]
+            if user_id not in self._users:
+                self._changed.pop(user_id, None)
+
+    async def _send(self, subscriber: Subscriber):
+        try:
+            while (message := subscriber.take()) is not None:
+                text = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+                await asyncio.wait_for(subscriber.websocket.send_text(text), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            logger.warning("live connection of user %s too slow, closing it", subscriber.user_id)
+            await self._close(subscriber)
+        except Exception:
+            await self._close(subscriber)  # gone already
+        finally:
+            subscriber.sender = None
+
+    async def _close(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber)
+        try:
+            await asyncio.wait_for(subscriber.websocket.close(code=1013), CLOSE_TIMEOUT)  # 1013: try again later
+        except Exception:
+            pass
+
+
+hub = Hub()
@@ -0,0 +1,212 @@
+# app/localtime.py
+# Days are the user's days. Every completion stores local_day (completed_at's date in the user's
+# timezone, from user_settings) when it's written, so "today" and day lookups are plain equality
+# matches on the (habit_id, user_id, local_day) index instead of date(completed_at) in UTC.
+# Users without a setting are on UTC, which is what every day was before.
+#
+# Zones are cached per process for the read paths, for ZONE_TTL: a timezone change made by another
+# worker shows up after that at the latest (this one's own changes right away, remember()). Writes
+# don't go by the cache, they read user_settings on the writer (write_zone), so a stored local_day
+# is never in a zone that was already changed.
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import models
+from app.db_async import run_read
+from app.daybits import rebuild
+from app.streaks import rebuild_streak
+
+from typing import Dict, List, Optional, Tuple
+from threading import Lock
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import os
+import time
+
+from datetime import date, datetime, timezone, tzinfo
+
+
+UTC = ZoneInfo("UTC")
+ZONE_TTL = float(os.getenv("HABITS_ZONE_TTL", "30"))  # seconds a cached zone is good for on the read paths
+
+# user_id -> (zone, when it was read from user_settings), one small entry per user
+_zones: Dict[int, Tuple[tzinfo, float]] = {}
+_zones_lock = Lock()
+
+
+class UnknownTimezone(ValueError):
+    pass
+
+
+def parse_zone(name: str) -> tzinfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise UnknownTimezone(name)
+
+
+def _stored_zone(db: Session, user_id: int) -> tzinfo:
+    name = db.query(models.UserSettings.timezone).filter(models.UserSettings.user_id == user_id).scalar()
+    return ZoneInfo(name) if name else UTC
+
+
+# only if nothing newer is there: a read that started before a timezone change mustn't put the old zone back
+def _keep(user_id: int, zone: tzinfo, read_at: float):
+    with _zones_lock:
+        current = _zones.get(user_id)
+        if current is None or current[1] <= read_at:
+            _zones[user_id] = (zone, read_at)
+
+
+# for reads: the cached zone, or user_settings once it's older than ZONE_TTL
+def user_zone(db: Session, user_id: int) -> tzinfo:
+    zone = cached_zone(user_id)
+    if zone is None:
+        read_at = time.monotonic()
+        zone = _stored_zone(db, user_id)
+        _keep(user_id, zone, read_at)
+    return zone
+
+
+# for writes (on the writer): always user_settings, one primary key lookup
+def write_zone(db: Session, user_id: int) -> tzinfo:
+    read_at = time.monotonic()
+    zone = _stored_zone(db, user_id)
+    _keep(user_id, zone, read_at)
+    return zone
+
+
+# after the commit that changed it, on the writer
+def remember(user_id: int, zone: tzinfo):
+    _keep(user_id, zone, time.monotonic())
+
+
+# the zone if it's cached and fresh, for the event loop (cache keys) without a db round trip
+def cached_zone(user_id: int) -> Optional[tzinfo]:
+    entry = _zones.get(user_id)
+    if entry is None or time.monotonic() - entry[1] >= ZONE_TTL:
+        return None
+    return entry[0]
+
+
+def today_in(zone: tzinfo) -> date:
+    return datetime.now(zone).date()
+
+
+def local_today(db: Session, user_id: int) -> date:
+    return today_in(user_zone(db, user_id))
+
+
+# same, from the event loop (cache keys): only the first one per user costs a read
+async def user_today(user_id: int) -> date:
+    zone = cached_zone(user_id)
+    if zone is None:
+        zone = await run_read(user_zone, user_id)
+    return today_in(zone)
+
+
+# a completed_at from a client, as it has to be stored: in UTC. SQLite's DateTime keeps the wall
+# clock and drops the offset, so "23:30+05:30" would come back as 23:30 UTC. Naive datetimes are
+# UTC already, like the stored ones
+def as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+# the user's day for a moment (None = now)
+def local_day(moment: Optional[datetime], zone: tzinfo) -> date:
+    if moment is None:
+        return today_in(zone)
+    return as_utc(moment).astimezone(zone).date()
+
+
+# how completed_at is stored (SQLAlchemy's SQLite DateTime, UTC)
+STORED = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _offset(zone: tzinfo, moment: int) -> int:
+    return int(datetime.fromtimestamp(moment, zone).utcoffset().total_seconds())
+
+
+# the zone's UTC offsets over [first, last] (epoch seconds) as [(from, offset seconds)], the first
+# one from `first`. Offsets change a couple of times a year at most: a step per day, and where one
+# changed, bisection down to the second it did
+def _offsets(zone: tzinfo, first: int, last: int) -> List[Tuple[int, int]]:
+    spans = [(first, _offset(zone, first))]
+    at = first
+    while at < last:
+        step = min(at + 86400, last)
+        if _offset(zone, step) == spans[-1][1]:
+            at = step
+            continue
+        lo, hi = at, step
+        while hi - lo > 1:
+            middle = (lo + hi) // 2
+            lo, hi = (middle, hi) if _offset(zone, middle) == spans[-1][1] else (lo, middle)
+        spans.append((hi, _offset(zone, hi)))
+        at = hi
+    return spans
+
+
+# local_day of completed_at in `zone`, as SQL: the UTC time plus whichever offset was in effect then
+def _local_day_sql(zone: tzinfo, first: datetime, last: datetime) -> Tuple[str, dict]:
+    spans = _offsets(zone, int(first.replace(tzinfo=timezone.utc).timestamp()), int(last.replace(tzinfo=timezone.utc).timestamp()) + 1)
+    params = {f"offset_{i}": f"{offset:+d} seconds" for i, (_, offset) in enumerate(spans)}
+    if len(spans) == 1:
+        return "date(completed_at, :offset_0)", params
+
+    whens = []
+    for i, (since, _) in enumerate(spans[1:], start=1):
+        params[f"until_{i}"] = datetime.fromtimestamp(since, timezone.utc).strftime(STORED)
+        whens.append(f"WHEN completed_at < :until_{i} THEN date(completed_at, :offset_{i - 1})")
+    return f"CASE {' '.join(whens)} ELSE date(completed_at, :offset_{len(spans) - 1}) END", params
+
+
+# Moves the user to `zone` and re-buckets their history into its days, set-based in SQLite: every
+# row's new day is computed into a temp table, rows that now land on the same day get merged into
+# the oldest one (values summed), and the rows whose day or value changed are deleted and inserted
+# back (same ids) with the new one. Updating local_day in place would trip over the unique
+# (habit, user, day) key when rows swap days, SQLite checks it row by row. Then the year bitmaps
+# and streaks are rebuilt. Doesn't commit
+def set_timezone(db: Session, user_id: int, zone: tzinfo) -> int:
+    settings = db.get(models.UserSettings, user_id)
+    if settings is None:
+        settings = models.UserSettings(user_id=user_id)
+        db.add(settings)
+    settings.timezone = str(zone)
+
+    first, last = db.execute(text(
+        "SELECT min(completed_at), max(completed_at) FROM habit_completions WHERE user_id = :user_id"
+    ), {"user_id": user_id}).one()
+    moved = 0
+    if first is not None:
+        day_sql, params = _local_day_sql(zone, datetime.fromisoformat(first), datetime.fromisoformat(last))
+        params["user_id"] = user_id
+        db.execute(text(f"""
+            CREATE TEMP TABLE rebucket AS
+            SELECT id, habit_id, completed_at, local_day AS old_day, new_day,
+                   row_number() OVER ordered AS position,
+                   count(*) OVER same_day AS size,
+                   CASE WHEN count(value) OVER same_day THEN sum(value) OVER same_day END AS value
+            FROM (SELECT *, {day_sql} AS new_day FROM habit_completions WHERE user_id = :user_id)
+            WINDOW same_day AS (PARTITION BY habit_id, new_day),
+                   ordered AS (PARTITION BY habit_id, new_day ORDER BY completed_at, id)
+        """), params)
+        moved = db.execute(text("SELECT count(*) FROM temp.rebucket WHERE position = 1 AND new_day != old_day")).scalar()
+        db.execute(text(
+            "DELETE FROM habit_completions WHERE id IN "
+            "(SELECT id FROM temp.rebucket WHERE position > 1 OR size > 1 OR new_day != old_day)"
+        ))
+        db.execute(text("""
+            INSERT INTO habit_completions (id, user_id, habit_id, completed_at, local_day, value)
+            SELECT id, :user_id, habit_id, completed_at, new_day, value FROM temp.rebucket
+            WHERE position = 1 AND (size > 1 OR new_day != old_day)
+        """), {"user_id": user_id})
+        db.execute(text("DROP TABLE temp.rebucket"))
+
+    rebuild(db, user_id)
+    for habit in db.query(models.Habit).filter(models.Habit.user_id == user_id, models.Habit.deleted_at.is_(None)):
+        rebuild_streak(db, habit)
+    return moved
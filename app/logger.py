@@ -1,21 +1,111 @@
-# app/logger.py 
+# app/logger.py
 # Yeah i know its not important, but i like it
+#
+# Records go onto a queue and a background QueueListener does the formatting and the disk/terminal
+# writes, so a request only pays for an enqueue. Everything is configured from the environment:
+#   HABITS_LOG_LEVEL    level for the "habit-tracker" loggers (INFO), DEBUG records are dropped
+#                       before any message formatting happens
+#   HABITS_LOG_FILE     size-rotated JSON lines file (debug.log), HABITS_LOG_MAX_BYTES / HABITS_LOG_BACKUPS
+#   HABITS_LOG_SAMPLE   per-logger sampling for DEBUG records, e.g. "habit-tracker.schedule=0.01,habit-tracker.sql=0.1"
+# Use %-style args (logger.debug("habit %s", habit.id)), not f-strings, or the formatting isn't lazy.
 import logging
+import logging.handlers
+
+from typing import Dict
+import atexit
+import json
+import os
+import queue
+import random
+
+from datetime import datetime, timezone
+
+
+# one JSON object per line; anything passed as extra={...} ends up as its own key
+class JsonFormatter(logging.Formatter):
+    _RESERVED = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# the stock QueueHandler.prepare formats the message (and traceback) on the caller's thread so the record
+# can be pickled; the queue never leaves the process, so the record goes on as is and the listener formats it.
+# Args are read when the listener gets to the record, so don't log an object and then change it
+class RawQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
-logger = logging.getLogger("habit-tracker")
-logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler("debug.log")
-file_handler.setLevel(logging.DEBUG)
+# keeps roughly `rate` of the DEBUG records of a logger (and its children), everything else passes
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
 
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
-file_handler.setFormatter(formatter)
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, prefix = 1.0, name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
 
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
 
-if not logger.hasHandlers():
-    logger.addHandler(file_handler)
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = part.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+logger = logging.getLogger("habit-tracker")
+logger.setLevel(os.getenv("HABITS_LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+
+file_handler = logging.handlers.RotatingFileHandler(
+    os.getenv("HABITS_LOG_FILE", "debug.log"),
+    maxBytes=int(os.getenv("HABITS_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backupCount=int(os.getenv("HABITS_LOG_BACKUPS", "5")),
+    encoding="utf-8",
+    delay=True,
+)
+file_handler.setFormatter(JsonFormatter())
 
 stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.DEBUG)
-stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
\ No newline at end of file
+stream_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+queue_handler = RawQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter(_parse_rates(os.getenv("HABITS_LOG_SAMPLE", ""))))
+
+listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+
+# the module can be imported more than once under different names (python -m app.x), one queue is enough
+if not logger.handlers:
+    logger.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
@@ -1,15 +1,47 @@
+import os
+
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
-from app import models
-from app.database import engine
-from app.routes import habits, completions
+from app import models, reminders, shards
+from app.database import shards as databases
+from app.metrics import MetricsMiddleware, instrument
+from app.migrations import migrate
+from app.profiling import ProfilingMiddleware
+from app.purge import purger
+from app.daybits import ensure_backfilled
+from app.routes import habits, completions, live, metrics, profiles, settings
 from app.api.routes import api_router
+from app.write_buffer import tap_buffer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema first: versioned migrations + missing indexes (app/migrations.py), then the year
+    # bitmaps for databases that never had them built, on every shard (app/shards.py)
+    for shard in databases:
+        migrate(shard.engine)
+        with shard.SessionLocal() as db:
+            ensure_backfilled(db)
+    shards.load_directory()
+
+    tap_buffer.start()
+    purger.start()  # habits deleted with a long history, in chunks (app/purge.py)
+    await reminders.start()  # only with HABITS_BOT_TOKEN set
+    yield
+    await reminders.stop()
+    await purger.stop()
+    # buffered taps (write-behind mode) are written before we go
+    await tap_buffer.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Setup CORS
 app.add_middleware(
@@ -20,10 +52,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# bootstrap/summary payloads compress really well, and the webview is usually on mobile data
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# opt-in request profiles (app/profiling.py), inside the metrics so it gets the request's SQL
+app.add_middleware(ProfilingMiddleware)
+
+# per-route request/SQL metrics at /metrics, outermost so it times everything
+app.add_middleware(MetricsMiddleware)
+for shard in databases:
+    instrument(shard.engine, shard.SessionLocal, models.Base if shard.index == 0 else None)
+    if shard.read_engine is not shard.engine:
+        instrument(shard.read_engine, shard.ReadSessionLocal)
+
 # API routes
 app.include_router(api_router)
 app.include_router(completions.router)
 app.include_router(habits.router)
+app.include_router(live.router)
+app.include_router(metrics.router)
+app.include_router(profiles.router)
+app.include_router(settings.router)
 
 templates = Jinja2Templates(directory="templates")
 
@@ -34,13 +83,11 @@ async def serve_frontend(request: Request):
         "API_BASE": "/api" 
     })
 
-# DB tables
-models.Base.metadata.create_all(bind=engine)
-
 # index.html at "/"
 @app.get("/", include_in_schema=False)
 async def serve_frontend():
     return FileResponse("static/index.html")
 
-# static files under /static
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# static files under /static (if there are any, the benchmarks import this app from anywhere)
+if os.path.isdir("static"):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -0,0 +1,259 @@
+# app/metrics.py
+# Per-route request metrics, served at /metrics in Prometheus text format.
+# MetricsMiddleware times every request and labels it with the route template ("/api/habits/{habit_id}",
+# not the raw path), and the engine/session hooks in instrument() charge SQL statements, statement
+# time, loaded ORM rows and connection checkout wait to whatever request is running (a contextvar,
+# which app.db_async carries into its worker threads). HABITS_SLOW_REQUEST_MS turns on a slow-request
+# log with the statements the request ran.
+from sqlalchemy import event
+
+from typing import Dict, List, Optional, Tuple
+from contextvars import ContextVar
+from threading import Lock
+import os
+import time
+
+from app.logger import logger
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_MS = float(os.getenv("HABITS_SLOW_REQUEST_MS", "0"))  # 0 = off
+SLOW_LOG_STATEMENTS = 20
+
+_START_KEY = "metrics_statement_start"
+_CHECKOUT_KEY = "metrics_checkout_start"
+
+
+# what one request did, filled in by the engine/session hooks
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "rows", "checkout_seconds", "queue_seconds", "log")
+
+    def __init__(self, keep_statements: bool):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.checkout_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.log: Optional[List[Tuple[float, str]]] = [] if keep_statements else None
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class RouteMetrics:
+    __slots__ = ("requests", "buckets", "seconds", "statements", "sql_seconds", "rows", "checkout_seconds", "queue_seconds")
+
+    def __init__(self):
+        self.requests: Dict[int, int] = {}  # by status code
+        self.buckets = [0] * len(BUCKETS)
+        self.seconds = 0.0
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.checkout_seconds = 0.0
+        self.queue_seconds = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = Lock()
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.requests[status] = metrics.requests.get(status, 0) + 1
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    metrics.buckets[index] += 1
+            metrics.seconds += seconds
+            metrics.statements += stats.statements
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.rows += stats.rows
+            metrics.checkout_seconds += stats.checkout_seconds
+            metrics.queue_seconds += stats.queue_seconds
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+
+            def family(name: str, kind: str, help_text: str):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            family("habits_http_requests_total", "counter", "Requests by route template and status code.")
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.requests.items()):
+                    lines.append(f'habits_http_requests_total{{{_labels(method, route)},status="{status}"}} {count}')
+
+            family("habits_http_request_duration_seconds", "histogram", "Request latency by route template.")
+            for (method, route), metrics in routes:
+                labels = _labels(method, route)
+                for bound, count in zip(BUCKETS, metrics.buckets):
+                    lines.append(f'habits_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                total = sum(metrics.requests.values())
+                lines.append(f'habits_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+                lines.append(f"habits_http_request_duration_seconds_sum{{{labels}}} {metrics.seconds:.6f}")
+                lines.append(f"habits_http_request_duration_seconds_count{{{labels}}} {total}")
+
+            for name, attr, help_text in (
+                ("habits_db_statements_total", "statements", "SQL statements executed."),
+                ("habits_db_statement_seconds_total", "sql_seconds", "Time spent executing SQL statements."),
+                ("habits_db_rows_loaded_total", "rows", "ORM rows loaded into objects."),
+                ("habits_db_checkout_wait_seconds_total", "checkout_seconds", "Time spent waiting for a pooled connection."),
+                ("habits_db_queue_wait_seconds_total", "queue_seconds", "Time spent queued for a database worker thread."),
+            ):
+                family(name, "counter", help_text)
+                for (method, route), metrics in routes:
+                    value = getattr(metrics, attr)
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f"{name}{{{_labels(method, route)}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(method: str, route: str) -> str:
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    # plain ASGI instead of BaseHTTPMiddleware, so streamed responses are timed to the last chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(keep_statements=SLOW_REQUEST_MS > 0)
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # fastapi leaves the matched route in the scope, unmatched paths all share one label
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            registry.observe(scope["method"], template, status, elapsed, stats)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow(scope["method"], template, status, elapsed, stats)
+
+
+def _log_slow(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    slowest = sorted(stats.log or (), reverse=True)[:SLOW_LOG_STATEMENTS]
+    statements = "".join(f"\n  {seconds * 1000:8.2f}ms  {' '.join(sql.split())}" for seconds, sql in slowest)
+    logger.warning(
+        "slow request %s %s -> %s in %.1fms (%d statements, %.1fms sql, %d rows, %.1fms checkout, %.1fms queued)%s",
+        method, route, status, elapsed * 1000, stats.statements, stats.sql_seconds * 1000,
+        stats.rows, stats.checkout_seconds * 1000, stats.queue_seconds * 1000, statements,
+    )
+
+
+# app.db_async reports how long a job sat in its executor queue
+def add_queue_wait(seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.queue_seconds += seconds
+
+
+# the running request's statement log ([(seconds, sql)], in order) from here on, for app.profiling
+def keep_statements() -> Optional[List[Tuple[float, str]]]:
+    stats = _current.get()
+    if stats is None:
+        return None
+    if stats.log is None:
+        stats.log = []
+    return stats.log
+
+
+# engine / session hooks
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get(_START_KEY)
+    if stats is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats.statements += 1
+    stats.sql_seconds += elapsed
+    if stats.log is not None:
+        stats.log.append((elapsed, statement))
+
+
+# a failed statement never reaches after_cursor_execute
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    starts = connection.info.get(_START_KEY) if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _on_load(target, context):
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += 1
+
+
+# The session only checks out a connection when its first statement (or flush) needs one, so the
+# wait is the time from there until after_begin, when it has one
+def _mark_checkout(session):
+    if _current.get() is not None and not session.in_transaction():
+        session.info[_CHECKOUT_KEY] = time.perf_counter()
+
+
+def _do_orm_execute(orm_execute_state):
+    _mark_checkout(orm_execute_state.session)
+
+
+def _before_flush(session, flush_context, instances):
+    _mark_checkout(session)
+
+
+def _after_begin(session, transaction, connection):
+    started = session.info.pop(_CHECKOUT_KEY, None)
+    stats = _current.get()
+    if started is not None and stats is not None:
+        stats.checkout_seconds += time.perf_counter() - started
+
+
+def _after_transaction_end(session, transaction):
+    session.info.pop(_CHECKOUT_KEY, None)
+
+
+def instrument(engine, session_factory, base=None):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    if base is not None:
+        event.listen(base, "load", _on_load, propagate=True)
+    event.listen(session_factory, "do_orm_execute", _do_orm_execute)
+    event.listen(session_factory, "before_flush", _before_flush)
+    event.listen(session_factory, "after_begin", _after_begin)
+    event.listen(session_factory, "after_transaction_end", _after_transaction_end)
@@ -0,0 +1,214 @@
+# app/migrations.py
+# Schema versions for habits.db. create_all only creates missing tables, it never touches existing
+# ones, so column/constraint changes go into MIGRATIONS, applied in order at startup (migrate()).
+# The version is SQLite's PRAGMA user_version: the number of MIGRATIONS the file has had.
+# A brand new database gets the current schema from create_all and starts at the latest version.
+# The steps written before versioning existed are idempotent, files from back then start at 0.
+#
+# Indexes are reconciled separately: every index declared on the models is created if the file
+# doesn't have it, and our own (ix_*) ones that aren't declared anymore are dropped, so adding or
+# removing an index is just declaring it (or not) in app/models.py.
+#
+#   python -m app.migrations status|upgrade
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app import daybits, models
+from app.logger import logger
+
+import argparse
+import sys
+
+
+def _columns(conn: Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+# habit_completions.day + one row per (habit, user, day); same-day duplicates get merged into the oldest row
+def add_completion_day(conn: Connection) -> bool:
+    columns = _columns(conn, "habit_completions")
+    if "day" in columns or "local_day" in columns:
+        return False
+
+    conn.execute(text("ALTER TABLE habit_completions ADD COLUMN day DATE"))
+    conn.execute(text("UPDATE habit_completions SET day = date(completed_at)"))
+    conn.execute(text("""
+        UPDATE habit_completions SET value = (
+            SELECT sum(other.value) FROM habit_completions AS other
+            WHERE other.habit_id = habit_completions.habit_id
+              AND other.user_id = habit_completions.user_id
+              AND other.day = habit_completions.day
+        )
+        WHERE id IN (
+            SELECT min(id) FROM habit_completions
+            GROUP BY habit_id, user_id, day HAVING count(*) > 1
+        )
+    """))
+    conn.execute(text("""
+        DELETE FROM habit_completions WHERE id NOT IN (
+            SELECT min(id) FROM habit_completions GROUP BY habit_id, user_id, day
+        )
+    """))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_habit_completions_habit_user_day "
+        "ON habit_completions (habit_id, user_id, day)"
+    ))
+    # merged days have different row counts now (the rollup is gone by the end of MIGRATIONS anyway)
+    if "habit_daily_totals" in _tables(conn):
+        conn.execute(text("DELETE FROM habit_daily_totals"))
+    conn.execute(text("DELETE FROM habit_streaks"))
+    return True
+
+
+# habits.weekdays for custom repeats. Streaks are now chained by the habit's real schedule
+# (previous due day instead of "today minus a week"), so the stored ones get rebuilt lazily
+def add_habit_weekdays(conn: Connection) -> bool:
+    if "weekdays" in _columns(conn, "habits"):
+        return False
+
+    conn.execute(text("ALTER TABLE habits ADD COLUMN weekdays INTEGER"))
+    conn.execute(text("DELETE FROM habit_streaks"))
+    return True
+
+
+# habits.reminder_time (app.reminders)
+def add_habit_reminder_time(conn: Connection) -> bool:
+    if "reminder_time" in _columns(conn, "habits"):
+        return False
+
+    conn.execute(text("ALTER TABLE habits ADD COLUMN reminder_time TIME"))
+    return True
+
+
+# habit_completions.day -> local_day, it's the user's day now (app.localtime). Nobody has a timezone
+# yet, so the existing UTC days are already right; the unique index follows the rename
+def rename_completion_local_day(conn: Connection) -> bool:
+    columns = _columns(conn, "habit_completions")
+    if "local_day" in columns:
+        return False
+
+    conn.execute(text("ALTER TABLE habit_completions RENAME COLUMN day TO local_day"))
+    return True
+
+
+# habit_year_bits (app.daybits), packed from habit_completions
+def fill_habit_year_bits(conn: Connection) -> bool:
+    if conn.execute(text("SELECT 1 FROM habit_year_bits LIMIT 1")).first():
+        return False
+
+    daybits.rebuild(conn)
+    return True
+
+
+# habits.deleted_at, tombstones for app.purge
+def add_habit_deleted_at(conn: Connection) -> bool:
+    if "deleted_at" in _columns(conn, "habits"):
+        return False
+
+    conn.execute(text("ALTER TABLE habits ADD COLUMN deleted_at DATETIME"))
+    return True
+
+
+# habit_daily_totals is gone: completions are one row per habit per day, so it was a copy of
+# habit_completions, and the day lookups use that table's (habit, user, day) key instead
+def drop_habit_daily_totals(conn: Connection) -> bool:
+    if "habit_daily_totals" not in _tables(conn):
+        return False
+
+    conn.execute(text("DROP TABLE habit_daily_totals"))
+    return True
+
+
+# in order, never reorder or remove one: a file's version is how many of these it has had
+MIGRATIONS = [
+    add_completion_day,
+    add_habit_weekdays,
+    add_habit_reminder_time,
+    rename_completion_local_day,
+    fill_habit_year_bits,
+    add_habit_deleted_at,
+    drop_habit_daily_totals,
+]
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def _tables(conn: Connection) -> set:
+    return {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+def _indexes(conn: Connection) -> set:
+    return {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+
+
+# declared on the models but missing from the file
+def missing_indexes(conn: Connection) -> list:
+    existing = _indexes(conn)
+    return [
+        index
+        for table in models.Base.metadata.sorted_tables
+        for index in sorted(table.indexes, key=lambda index: index.name)
+        if index.name not in existing
+    ]
+
+
+# ix_* indexes on our tables that the models don't declare (anymore). Constraint indexes
+# (sqlite_autoindex_*, uq_*) belong to their table definitions and are left alone
+def stale_indexes(conn: Connection) -> list:
+    declared = {index.name for table in models.Base.metadata.sorted_tables for index in table.indexes}
+    rows = conn.execute(text("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix\\_%' ESCAPE '\\'"))
+    return sorted(name for name, table in rows if table in models.Base.metadata.tables and name not in declared)
+
+
+def migrate(engine: Engine):
+    with engine.begin() as conn:
+        fresh = not (_tables(conn) & set(models.Base.metadata.tables))
+        models.Base.metadata.create_all(bind=conn)
+
+        version = len(MIGRATIONS) if fresh else schema_version(conn)
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            if step(conn):  # False: the file already had it (from before versioning)
+                logger.info("applied schema migration %d (%s)", number, step.__name__)
+
+        for name in stale_indexes(conn):
+            conn.execute(text(f'DROP INDEX "{name}"'))
+            logger.info("dropped index %s", name)
+        for index in missing_indexes(conn):
+            index.create(bind=conn)
+            logger.info("created index %s", index.name)
+
+        conn.execute(text(f"PRAGMA user_version = {len(MIGRATIONS)}"))
+
+
+def main(argv=None) -> int:
+    from app.database import shards
+
+    parser = argparse.ArgumentParser(description="Show or apply pending schema migrations and indexes")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    args = parser.parse_args(argv)
+
+    behind = False
+    for shard in shards:
+        if args.command == "upgrade":
+            migrate(shard.engine)
+
+        with shard.engine.connect() as conn:
+            version = schema_version(conn)
+            pending = [step.__name__ for step in MIGRATIONS[version:]]
+            missing = [index.name for index in missing_indexes(conn)]
+            stale = stale_indexes(conn)
+        print(f"{shard.url}: schema version {version} of {len(MIGRATIONS)}")
+        for name in pending:
+            print(f"  pending migration: {name}")
+        for name in missing:
+            print(f"  missing index: {name}")
+        for name in stale:
+            print(f"  stale index: {name}")
+        behind = behind or bool(pending or missing or stale)
+    return 1 if behind else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
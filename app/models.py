@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Time, Index, LargeBinary, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from sqlalchemy import Enum as SQLAlchemyEnum
 from app.schemas import RepeatType, HabitType
@@ -11,23 +11,92 @@ from app.database import Base
 class Habit(Base):
     __tablename__ = "habits"
 
-    id            = Column(Integer, primary_key=True, index=True)
+    id            = Column(Integer, primary_key=True)
     user_id       = Column(Integer, index=True)
-    name          = Column(String, index=True)
+    name          = Column(String)
     tracked       = Column(Boolean, default=True)
     repeat_type   = Column(SQLAlchemyEnum(RepeatType), default=RepeatType.DAILY)
     start_date    = Column(Date, default=date.today)
     type          = Column(SQLAlchemyEnum(HabitType), default=HabitType.BINARY)
     target        = Column(Integer, nullable=True)
-    completions   = relationship("HabitCompletion", back_populates="habit", cascade="all, delete")
+    weekdays      = Column(Integer, nullable=True)  # custom repeat only: bitmask, bit 0 = monday ... bit 6 = sunday
+    reminder_time = Column(Time, nullable=True)  # when to send the telegram reminder on due days (user's local time), NULL = none
+    deleted_at    = Column(DateTime(timezone=True), nullable=True)  # tombstone: deleted, rows still being purged (app.purge)
+    # the rows hanging off a habit are deleted by SQLite (ON DELETE CASCADE), never loaded for it
+    completions   = relationship("HabitCompletion", back_populates="habit", cascade="all, delete", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_habits_deleted_at", "deleted_at", sqlite_where=text("deleted_at IS NOT NULL")),
+    )
 
 
 class HabitCompletion(Base):
     __tablename__ = "habit_completions"
 
-    id            = Column(Integer, primary_key=True, index=True)
-    user_id       = Column(Integer, index=True)
+    id            = Column(Integer, primary_key=True)
+    user_id       = Column(Integer)
     habit_id      = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"))
     completed_at  = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    local_day     = Column(Date, nullable=False)  # completed_at's date in the user's timezone (app.localtime), set on write
     value         = Column(Integer, nullable=True)
-    habit         = relationship("Habit", back_populates="completions")
\ No newline at end of file
+    habit         = relationship("Habit", back_populates="completions")
+
+    # one row per habit per day, so writes can be a single INSERT ... ON CONFLICT (and day lookups
+    # are index searches). The other two serve the listings in (completed_at, id) order without a
+    # sort: a habit's completions / history pages, and the user's export / timezone re-bucketing
+    __table_args__ = (
+        UniqueConstraint("habit_id", "user_id", "local_day", name="uq_habit_completions_habit_user_day"),
+        Index("ix_habit_completions_habit_completed", "habit_id", "user_id", "completed_at", "id"),
+        Index("ix_habit_completions_user_completed", "user_id", "completed_at", "id"),
+    )
+
+
+# Streak state kept up to date on every completion write, so reading a streak is O(1).
+# current_streak is the run ending at last_period (the latest day that has completions, 0 if it
+# didn't count). prev_* is the same thing for the completion day before it, so the latest day can
+# be edited (+/- taps) without rescanning history. prev_streak = NULL means "unknown, rebuild".
+class HabitStreak(Base):
+    __tablename__ = "habit_streaks"
+
+    habit_id       = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), primary_key=True)
+    user_id        = Column(Integer, index=True)
+    current_streak = Column(Integer, default=0, nullable=False)
+    last_period    = Column(Date, nullable=True)
+    prev_streak    = Column(Integer, default=0, nullable=True)
+    prev_period    = Column(Date, nullable=True)
+    longest_streak = Column(Integer, default=0, nullable=False)
+
+
+# The per-day history of habit_completions, packed: one row per habit per year (app.daybits), for
+# the reads over long ranges (streaks, heatmap, progress). `logged` is a bitmap
+# of the days with something logged, `totals` the day totals as little-endian int32s (NULL while
+# they're all 0, e.g. binary habits)
+class HabitYearBits(Base):
+    __tablename__ = "habit_year_bits"
+
+    habit_id      = Column(Integer, ForeignKey("habits.id", ondelete="CASCADE"), primary_key=True)
+    year          = Column(Integer, primary_key=True)
+    user_id       = Column(Integer, nullable=False)
+    logged        = Column(LargeBinary, nullable=False)
+    totals        = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        Index("ix_habit_year_bits_user_year", "user_id", "year"),
+    )
+
+
+# Per-user settings. Users without a row are on UTC
+class UserSettings(Base):
+    __tablename__ = "user_settings"
+
+    user_id       = Column(Integer, primary_key=True)
+    timezone      = Column(String, nullable=False, default="UTC")  # IANA name, e.g. "Europe/Berlin"
+
+
+# Users placed on a shard by hand (python -m app.shards move), only shard 0's is read. Everyone else
+# lives where the hash puts them (app.shards.shard_of)
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    user_id       = Column(Integer, primary_key=True)
+    shard         = Column(Integer, nullable=False)
@@ -0,0 +1,233 @@
+# app/profiling.py
+# Opt-in profiles of single requests, for "the today screen is slow for me" reports we can't
+# reproduce without the user's data. A request is profiled when it carries the admin token
+# (X-Profile-Token: HABITS_PROFILE_TOKEN) or falls into the HABITS_PROFILE_SAMPLE fraction of
+# requests; everything else pays for a header lookup.
+#
+# A profiled request runs under cProfile twice over: on the event loop thread (route handler,
+# pydantic/JSON serialization, middleware, streaming) and on the db_async worker threads its
+# database calls run on (app.db_async asks thread_profile() for that), merged into one call graph.
+# The loop thread is shared, so its half also has whatever other requests ran while this one was
+# waiting, which is why only one request is profiled at a time. The SQL comes from the metrics
+# statement log (app.metrics), with per-statement time.
+#
+# Profiles go to HABITS_PROFILE_DIR as JSON, the newest HABITS_PROFILE_KEEP are kept, and
+# /api/profiles (app/routes/profiles.py) lists / downloads them. The response of a profiled
+# request has the profile's name in X-Profile-Id.
+from typing import Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import asyncio
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import time
+
+from datetime import datetime, timezone
+
+from app import metrics
+from app.logger import logger
+
+
+TOKEN = os.getenv("HABITS_PROFILE_TOKEN", "")  # empty = the header doesn't do anything, and /api/profiles is off
+SAMPLE = float(os.getenv("HABITS_PROFILE_SAMPLE", "0"))  # fraction of requests profiled without asking, 0 = none
+PROFILE_DIR = os.getenv("HABITS_PROFILE_DIR", "profiles")
+KEEP = int(os.getenv("HABITS_PROFILE_KEEP", "50"))  # profiles on disk, the oldest go first
+FUNCTIONS = int(os.getenv("HABITS_PROFILE_FUNCTIONS", "300"))  # call graph entries per profile, by cumulative time
+
+HEADER = "x-profile-token"
+NAME = re.compile(r"^\d+-\d+\.json$")
+
+# shortest way to say where a function lives
+_PREFIXES = sorted({os.path.abspath(path) + os.sep for path in sys.path if path}, key=len, reverse=True)
+
+
+# one profiled request: the per-thread profilers and what the request was
+class Capture:
+    def __init__(self, name: str, method: str, path: str, reason: str):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.profilers: List[cProfile.Profile] = []
+        self.lock = Lock()
+
+    def add(self, profiler: cProfile.Profile):
+        with self.lock:
+            self.profilers.append(profiler)
+
+
+_capture: ContextVar[Optional[Capture]] = ContextVar("profile_capture", default=None)
+_busy = False  # a request is being profiled (event loop only)
+_sequence = 0
+_ring_lock = Lock()
+
+
+def token_ok(token: Optional[str]) -> bool:
+    return bool(TOKEN) and token is not None and hmac.compare_digest(token.encode(), TOKEN.encode())
+
+
+# for app.db_async: profiles the database call on its worker thread when the request is profiled
+@contextmanager
+def thread_profile() -> Iterator[None]:
+    capture = _capture.get()
+    if capture is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        capture.add(profiler)
+
+
+def _reason(scope) -> Optional[str]:
+    if scope["path"].startswith("/api/profiles"):
+        return None  # looking at profiles would push the real ones out of the ring
+    for key, value in scope["headers"]:
+        if key == HEADER.encode():
+            return "header" if token_ok(value.decode("latin-1")) else None
+    if SAMPLE and random.random() < SAMPLE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    # inside MetricsMiddleware (it needs the request's metrics for the SQL), plain ASGI like it
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _busy, _sequence
+        if scope["type"] != "http" or _busy or (reason := _reason(scope)) is None:
+            await self.app(scope, receive, send)
+            return
+
+        _busy = True
+        _sequence += 1
+        capture = Capture(f"{time.time_ns() // 1_000_000}-{_sequence}.json", scope["method"], scope["path"], reason)
+        statements = metrics.keep_statements()
+        token = _capture.set(capture)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", capture.name.encode())]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            _capture.reset(token)
+            _busy = False
+            capture.add(profiler)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            meta = {
+                "name": capture.name,
+                "created": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                "method": capture.method,
+                "path": capture.path,
+                "route": route,
+                "status": status,
+                "reason": capture.reason,
+                "ms": round(elapsed * 1000, 3),
+            }
+            try:
+                # turning the profilers into a call graph takes a while, not on the loop
+                await asyncio.get_running_loop().run_in_executor(None, _save, capture, meta, list(statements or ()))
+            except Exception:
+                logger.exception("saving profile %s failed", capture.name)
+
+
+def _where(filename: str) -> str:
+    for prefix in _PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def _function(key) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name  # builtins: "<method 'execute' of 'sqlite3.Cursor' objects>"
+    return f"{_where(filename)}:{line}({name})"
+
+
+# the merged call graph: the FUNCTIONS most expensive functions (cumulative), each with who called it
+def _call_graph(capture: Capture) -> List[Dict[str, object]]:
+    stats = pstats.Stats(*capture.profilers)
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:FUNCTIONS]
+    return [{
+        "function": _function(key),
+        "calls": calls,
+        "primitive_calls": primitive,
+        "own_ms": round(own * 1000, 3),
+        "total_ms": round(total * 1000, 3),
+        "callers": {
+            _function(caller): [caller_stats[1], round(caller_stats[3] * 1000, 3)]  # [calls, total_ms] from there
+            for caller, caller_stats in callers.items()
+        },
+    } for key, (primitive, calls, own, total, callers) in ranked]
+
+
+def _save(capture: Capture, meta: dict, statements: list):
+    meta["statements"] = len(statements)
+    meta["sql_ms"] = round(sum(seconds for seconds, _ in statements) * 1000, 3)
+    profile = {
+        **meta,
+        "sql": [{"ms": round(seconds * 1000, 3), "statement": " ".join(statement.split())} for seconds, statement in statements],
+        "functions": _call_graph(capture),
+    }
+    with _ring_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, capture.name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        for name in saved()[KEEP:]:
+            os.remove(os.path.join(PROFILE_DIR, name))
+    logger.info("saved profile %s (%s %s, %.1fms)", capture.name, meta["method"], meta["route"], meta["ms"])
+
+
+# profile file names, newest first
+def saved() -> List[str]:
+    try:
+        names = [name for name in os.listdir(PROFILE_DIR) if NAME.match(name)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda name: tuple(map(int, name[:-5].split("-"))), reverse=True)
+
+
+# what /api/profiles lists: everything in a profile except the SQL and the call graph
+def summaries() -> List[dict]:
+    found = []
+    for name in saved():
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            continue  # dropped from the ring meanwhile
+        found.append({key: value for key, value in profile.items() if key not in ("sql", "functions")})
+    return found
+
+
+def path_of(name: str) -> Optional[str]:
+    if not NAME.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,111 @@
+# app/purge.py
+# Deleting habits. Everything hanging off a habit (completions, bitmaps, streak) is deleted
+# by SQLite itself through ON DELETE CASCADE (foreign keys are on, app.database), set-based, nothing
+# loaded into the session. That still holds the one writer for as long as the cascade takes, so a
+# habit with more than INLINE_ROWS completions is only tombstoned (deleted_at, gone for every read
+# right away) and the purger deletes its rows PURGE_CHUNK at a time, one short writer transaction
+# each, so other users' writes get in between. Tombstones a restart left behind are picked up at startup.
+from sqlalchemy import delete, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from app import models, shards
+from app.db_async import run_read, run_write
+from app.logger import logger
+
+from typing import List, Optional
+import asyncio
+import os
+
+from datetime import datetime, timezone
+
+
+INLINE_ROWS = int(os.getenv("HABITS_INLINE_DELETE_ROWS", "2000"))  # more completions than this: tombstone + purge
+PURGE_CHUNK = int(os.getenv("HABITS_PURGE_CHUNK", "1000"))  # rows per purge transaction
+RETRY_SECONDS = 30
+
+ROWID = literal_column("rowid")
+
+PURGED = (models.HabitCompletion.__table__,)
+
+
+# Deletes the habit, or tombstones it for the purger. True if it was tombstoned. Doesn't commit
+def delete_habit(db: Session, habit: models.Habit) -> bool:
+    rows = db.execute(select(func.count()).select_from(
+        select(models.HabitCompletion.id).where(
+            models.HabitCompletion.habit_id == habit.id
+        ).limit(INLINE_ROWS + 1).subquery()
+    )).scalar()
+
+    if rows <= INLINE_ROWS:
+        db.execute(delete(models.Habit).where(models.Habit.id == habit.id))
+        return False
+
+    habit.deleted_at = datetime.now(timezone.utc)
+    habit.tracked = False  # out of the reminder scheduler too
+    return True
+
+
+def tombstoned(db: Session) -> List[int]:
+    return db.execute(select(models.Habit.id).where(models.Habit.deleted_at.isnot(None))).scalars().all()
+
+
+# One chunk of a tombstoned habit's rows, or the habit itself once they're gone (its streak and
+# bitmaps cascade, a few rows). True when the habit is gone
+def purge_chunk(db: Session, habit_id: int) -> bool:
+    for table in PURGED:
+        chunk = select(ROWID).select_from(table).where(table.c.habit_id == habit_id).limit(PURGE_CHUNK)
+        if db.execute(delete(table).where(ROWID.in_(chunk))).rowcount:
+            db.commit()
+            return False
+
+    db.execute(delete(models.Habit).where(models.Habit.id == habit_id, models.Habit.deleted_at.isnot(None)))
+    db.commit()
+    return True
+
+
+class Purger:
+    # only ever touched from the event loop, the chunks go to the db writer thread
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self.purged = 0  # habits fully deleted since startup
+
+    def wake(self):
+        self._wake.set()
+
+    async def purge(self, habit_id: int):
+        chunks = 0
+        while not await run_write(purge_chunk, habit_id):
+            chunks += 1
+        self.purged += 1
+        logger.info("purged habit %s (%d chunk(s))", habit_id, chunks)
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                for shard in shards.shards:
+                    with shards.using(shard.index):
+                        for habit_id in await run_read(tombstoned):
+                            await self.purge(habit_id)
+            except Exception:
+                logger.exception("habit purge failed, retrying in %ds", RETRY_SECONDS)
+                await asyncio.sleep(RETRY_SECONDS)
+                self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()  # bound to this loop (the benchmarks start the app more than once)
+            self._wake.set()  # whatever the last run left tombstoned
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # a chunk that's already on the writer still finishes (and commits), the rest waits for the next start
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+purger = Purger()
@@ -0,0 +1,146 @@
+# app/recurrence.py
+# "Is habit X due on day D?" lives here and only here. A habit's schedule gets compiled once
+# into a small Rule, which answers due / previous due / next due / due days in a range
+# with date arithmetic instead of walking day by day.
+from app.schemas import RepeatType
+
+from typing import List, Optional
+from functools import lru_cache
+
+from datetime import date, timedelta
+from calendar import monthrange
+
+
+ALL_WEEKDAYS = 0b1111111  # bit 0 = monday ... bit 6 = sunday (same as date.weekday())
+
+_PERIODS = {
+    RepeatType.DAILY: 1,
+    RepeatType.WEEKLY: 7,
+    RepeatType.BIWEEKLY: 14,
+}
+
+
+# monthly habits are due on their start day, or the last day of shorter months
+def _month_due_day(year: int, month: int, day_of_month: int) -> date:
+    return date(year, month, min(day_of_month, monthrange(year, month)[1]))
+
+
+def _shift_month(year: int, month: int, by: int):
+    index = year * 12 + (month - 1) + by
+    return index // 12, index % 12 + 1
+
+
+class Rule:
+    __slots__ = ("kind", "start", "step", "mask", "_back", "_ahead")
+
+    def __init__(self, kind: RepeatType, start: date, step: int = 0, mask: int = 0):
+        self.kind = kind
+        self.start = start
+        self.step = step
+        self.mask = mask
+        # custom: for each weekday, how many days back to the previous due weekday / ahead to the next one
+        self._back = [self._gap(weekday, -1) for weekday in range(7)]
+        self._ahead = [self._gap(weekday, 1) for weekday in range(7)]
+
+    def _gap(self, weekday: int, direction: int) -> Optional[int]:
+        for distance in range(1, 8):
+            if self.mask >> ((weekday + direction * distance) % 7) & 1:
+                return distance
+        return None
+
+    def is_due(self, day: date) -> bool:
+        if day < self.start:
+            return False
+        if self.step:
+            return (day - self.start).days % self.step == 0
+        if self.kind == RepeatType.MONTHLY:
+            return day == _month_due_day(day.year, day.month, self.start.day)
+        return bool(self.mask >> day.weekday() & 1)
+
+    # the last due day strictly before `day` (None if there isn't one)
+    def previous_due(self, day: date) -> Optional[date]:
+        if day <= self.start:
+            return None
+
+        if self.step:
+            return self.start + timedelta(days=((day - self.start).days - 1) // self.step * self.step)
+
+        if self.kind == RepeatType.MONTHLY:
+            candidate = _month_due_day(day.year, day.month, self.start.day)
+            if candidate >= day:
+                candidate = _month_due_day(*_shift_month(day.year, day.month, -1), self.start.day)
+            return candidate if candidate >= self.start else None
+
+        gap = self._back[day.weekday()]
+        if gap is None:
+            return None
+        candidate = day - timedelta(days=gap)
+        return candidate if candidate >= self.start else None
+
+    # the first due day on or after `day` (None if it never comes)
+    def next_due(self, day: date) -> Optional[date]:
+        if day < self.start:
+            day = self.start
+
+        if self.step:
+            return day + timedelta(days=-(day - self.start).days % self.step)
+
+        if self.kind == RepeatType.MONTHLY:
+            candidate = _month_due_day(day.year, day.month, self.start.day)
+            if candidate < day:
+                candidate = _month_due_day(*_shift_month(day.year, day.month, 1), self.start.day)
+            return candidate
+
+        if self.mask >> day.weekday() & 1:
+            return day
+        gap = self._ahead[day.weekday()]
+        return day + timedelta(days=gap) if gap is not None else None
+
+    # every due day in [start, end], in order
+    def due_days(self, start: date, end: date) -> List[date]:
+        first = self.next_due(start)
+        if first is None or first > end:
+            return []
+
+        if self.step:
+            return [date.fromordinal(o) for o in range(first.toordinal(), end.toordinal() + 1, self.step)]
+
+        if self.kind == RepeatType.MONTHLY:
+            days = []
+            year, month = first.year, first.month
+            while True:
+                due = _month_due_day(year, month, self.start.day)
+                if due > end:
+                    return days
+                days.append(due)
+                year, month = _shift_month(year, month, 1)
+
+        # custom: one arithmetic progression (step 7) per weekday in the mask
+        ordinals = []
+        for weekday in range(7):
+            if self.mask >> weekday & 1:
+                weekday_first = first + timedelta(days=(weekday - first.weekday()) % 7)
+                ordinals.extend(range(weekday_first.toordinal(), end.toordinal() + 1, 7))
+        return [date.fromordinal(o) for o in sorted(ordinals)]
+
+    def count_due(self, start: date, end: date) -> int:
+        first = self.next_due(start)
+        if first is None or first > end:
+            return 0
+        if self.step:
+            return (end - first).days // self.step + 1
+        return len(self.due_days(first, end))
+
+
+@lru_cache(maxsize=4096)
+def _compile(repeat_type: RepeatType, start: date, weekdays: Optional[int]) -> Rule:
+    repeat_type = RepeatType(repeat_type)
+    if repeat_type in _PERIODS:
+        return Rule(repeat_type, start, step=_PERIODS[repeat_type])
+    if repeat_type == RepeatType.MONTHLY:
+        return Rule(repeat_type, start)
+    return Rule(repeat_type, start, mask=(weekdays or 0) & ALL_WEEKDAYS)
+
+
+def compile_rule(habit) -> Rule:
+    return _compile(habit.repeat_type, habit.start_date, habit.weekdays)
@@ -0,0 +1,388 @@
+# app/reminders.py
+# Habit reminders through the Telegram Bot API (set HABITS_BOT_TOKEN to turn them on,
+# HABITS_BOT_API points them at another Bot API server, e.g. a local stand-in).
+#
+# Every habit with a reminder_time sits in one min-heap keyed by its next fire time (its next due
+# day by app.recurrence, at reminder_time in the user's timezone), so the scheduler sleeps until the earliest one instead
+# of polling every user every minute. When a moment comes, everything due then is checked against
+# the day's completions in one query (habits already done that day are skipped), grouped into one
+# message per user and queued for the sender, which stays under Telegram's limits with token
+# buckets: 30 messages/s overall and 1 message/s per chat.
+# user_id is the Telegram user id, which is also the private chat id.
+import httpx
+from sqlalchemy.orm import Session
+
+from app import models, shards
+from app.db_async import run_read
+from app.localtime import UTC
+from app.logger import logger
+from app.recurrence import compile_rule
+from app.schemas import HabitType
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+import asyncio
+import heapq
+import itertools
+import os
+import time as clock
+from zoneinfo import ZoneInfo
+
+from datetime import date, datetime, timedelta, timezone, tzinfo
+
+
+BOT_TOKEN = os.getenv("HABITS_BOT_TOKEN", "")
+BOT_API = os.getenv("HABITS_BOT_API", "https://api.telegram.org")
+
+GLOBAL_RATE = 30.0  # messages per second, all chats together
+CHAT_RATE = 1.0  # messages per second to one chat
+SENDERS = 8  # concurrent sendMessage calls
+CHECK_CHUNK = 500  # habits per "already done?" query
+MAX_SEND_ATTEMPTS = 5
+
+
+def next_fire(habit: models.Habit, after: datetime, zone: tzinfo) -> Optional[datetime]:
+    if not habit.tracked or habit.reminder_time is None:
+        return None
+    day = after.astimezone(zone).date()
+    if datetime.combine(day, habit.reminder_time, tzinfo=zone) <= after:
+        day += timedelta(days=1)
+    due = compile_rule(habit).next_due(day)
+    if due is None:
+        return None
+    return datetime.combine(due, habit.reminder_time, tzinfo=zone)
+
+
+# user_id -> zone for every user with a setting, loaded with the habits (load()) and kept in step by
+# timezone_changed(). Not app.localtime's cache: that one forgets zones after a while, this one
+# has to have them all when a reminder is due
+_zones: Dict[int, tzinfo] = {}
+
+
+def _zone(user_id: int) -> tzinfo:
+    return _zones.get(user_id, UTC)
+
+
+# is a reminder still worth sending for a day with this much logged (None = nothing logged)?
+def needs_reminder(habit: models.Habit, total_value: Optional[int]) -> bool:
+    if total_value is None:
+        return True
+    if habit.type == HabitType.COUNTABLE:
+        return total_value < (habit.target or 1)
+    return False  # binary: done, limit: already being tracked today
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    # takes a token and returns 0, or returns how long until there is one (and takes nothing)
+    def take(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Fire times for every habit with a reminder. Entries are never removed from the middle of the
+# heap: rescheduling bumps the habit's version and the stale entry is skipped when it comes up
+class ReminderHeap:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int]] = []  # (fire timestamp, habit_id, version)
+        self._live: Dict[int, Tuple[int, int]] = {}  # habit_id -> (version, user_id)
+        self._versions = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def schedule(self, habit_id: int, user_id: int, fire_at: datetime):
+        version = next(self._versions)
+        self._live[habit_id] = (version, user_id)
+        heapq.heappush(self._heap, (fire_at.timestamp(), habit_id, version))
+        if len(self._heap) > 2 * len(self._live) + 1024:
+            self._compact()
+
+    def cancel(self, habit_id: int):
+        self._live.pop(habit_id, None)
+
+    def next_at(self) -> Optional[float]:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    # (habit_id, user_id) of everything due at or before `now`; they're off the heap until rescheduled
+    def pop_due(self, now: float) -> List[Tuple[int, int]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                due.append((entry[1], self._live.pop(entry[1])[1]))
+        return due
+
+    def _is_live(self, entry: Tuple[float, int, int]) -> bool:
+        live = self._live.get(entry[1])
+        return live is not None and live[0] == entry[2]
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._is_live(entry)]
+        heapq.heapify(self._heap)
+
+
+# What the sender queue carries: who, what, and how many times it was tried
+Message = Tuple[int, str, int]
+
+
+class Sender:
+    def __init__(self, client: httpx.AsyncClient, rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, workers: int = SENDERS):
+        self.client = client
+        self.queue: "asyncio.Queue[Message]" = asyncio.Queue()
+        # no burst allowance: a full bucket of 30 plus the refill would be 60 in one second
+        self._global = TokenBucket(rate, 1, clock.monotonic())
+        self._chats: Dict[int, TokenBucket] = {}
+        self.chat_rate = chat_rate
+        self.workers = workers
+        self._paused_until = 0.0  # Telegram said 429 with retry_after
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+
+    def put(self, chat_id: int, text: str, attempt: int = 0):
+        self.queue.put_nowait((chat_id, text, attempt))
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_global(self):
+        while True:
+            now = clock.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            wait = self._global.take(now)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _chat_wait(self, chat_id: int, now: float) -> float:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                self._chats = {chat: b for chat, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1, now)
+        return bucket.take(now)
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id, text, attempt = await self.queue.get()
+            try:
+                wait = self._chat_wait(chat_id, clock.monotonic())
+                if wait:
+                    # this chat had one just now, come back to it later and keep the worker busy
+                    loop.call_later(wait, self.put, chat_id, text, attempt)
+                    continue
+                await self._wait_global()
+                await self._send(chat_id, text, attempt)
+            except Exception:
+                logger.exception("reminder to chat %s failed", chat_id)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, chat_id: int, text: str, attempt: int):
+        response = await self.client.post("sendMessage", json={"chat_id": chat_id, "text": text})
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get("parameters", {}).get("retry_after", 1))
+            except (ValueError, AttributeError, TypeError):
+                retry_after = 1.0  # not the JSON Telegram sends (a proxy in between?), still back off
+            self._paused_until = max(self._paused_until, clock.monotonic() + retry_after)
+            if attempt + 1 < MAX_SEND_ATTEMPTS:
+                self.put(chat_id, text, attempt + 1)
+            return
+        if response.status_code >= 500 and attempt + 1 < MAX_SEND_ATTEMPTS:
+            asyncio.get_running_loop().call_later(2 ** attempt, self.put, chat_id, text, attempt + 1)
+            return
+        if response.status_code != 200:
+            # 403 = the user blocked the bot, 400 = no such chat; nothing to retry
+            logger.warning("sendMessage to %s: %s %s", chat_id, response.status_code, response.text[:200])
+            return
+        self.sent += 1
+
+
+def _habits_with_reminders(db: Session) -> Iterable[models.Habit]:
+    return db.query(models.Habit).filter(
+        models.Habit.tracked == True,
+        models.Habit.reminder_time.isnot(None)
+    ).yield_per(5000)
+
+
+# the habits that just came up, and how much is logged for each on its day
+def _fired(db: Session, fired: List[Tuple[int, date]]) -> List[Tuple[models.Habit, date, Optional[int]]]:
+    habit_ids = [habit_id for habit_id, _ in fired]
+    habits = {habit.id: habit for habit in db.query(models.Habit).filter(models.Habit.id.in_(habit_ids))}
+    days = {day for _, day in fired}
+    # one row per habit per day, its value is the day's total (binary: 0)
+    totals = {
+        (habit_id, day): value or 0
+        for habit_id, day, value in db.query(
+            models.HabitCompletion.habit_id,
+            models.HabitCompletion.local_day,
+            models.HabitCompletion.value,
+        ).filter(
+            models.HabitCompletion.habit_id.in_(habit_ids),
+            models.HabitCompletion.user_id.in_({habit.user_id for habit in habits.values()}),
+            models.HabitCompletion.local_day.in_(days)
+        )
+    }
+    return [(habits[habit_id], day, totals.get((habit_id, day))) for habit_id, day in fired if habit_id in habits]
+
+
+def reminder_text(names: List[str]) -> str:
+    if len(names) == 1:
+        return f"Reminder: {names[0]}"
+    return "Reminders for today:\n" + "\n".join(f"• {name}" for name in names)
+
+
+class ReminderScheduler:
+    def __init__(self, sender: Sender):
+        self.sender = sender
+        self.heap = ReminderHeap()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, habit: models.Habit, after: Optional[datetime] = None):
+        fire_at = next_fire(habit, after or datetime.now(timezone.utc), _zone(habit.user_id))
+        if fire_at is None:
+            self.heap.cancel(habit.id)
+            return
+        current = self.heap.next_at()
+        self.heap.schedule(habit.id, habit.user_id, fire_at)
+        if current is None or fire_at.timestamp() < current:
+            self._wake.set()  # the loop is sleeping towards something later
+
+    def cancel(self, habit_id: int):
+        self.heap.cancel(habit_id)
+
+    async def load(self):
+        def load_all(db: Session) -> Tuple[List[models.Habit], list]:
+            return list(_habits_with_reminders(db)), db.query(models.UserSettings.user_id, models.UserSettings.timezone).all()
+
+        habits, settings = [], []
+        for shard in shards.shards:
+            with shards.using(shard.index):
+                shard_habits, shard_settings = await run_read(load_all)
+            habits += shard_habits
+            settings += shard_settings
+        for user_id, name in settings:
+            _zones[user_id] = ZoneInfo(name)
+        now = datetime.now(timezone.utc)
+        for habit in habits:
+            self.schedule(habit, now)
+        logger.info("scheduled %d habit reminders", len(self.heap))
+
+    async def _run(self):
+        while True:
+            next_at = self.heap.next_at()
+            timeout = None if next_at is None else max(0.0, next_at - clock.time())
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+                continue  # something earlier got scheduled, look again
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.fire(clock.time())
+            except Exception:
+                logger.exception("firing reminders failed")
+
+    async def fire(self, now: float):
+        due = self.heap.pop_due(now)
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        for start in range(0, len(due), CHECK_CHUNK):
+            by_shard: Dict[int, List[Tuple[int, date]]] = defaultdict(list)
+            for habit_id, user_id in due[start:start + CHECK_CHUNK]:
+                by_shard[shards.shard_of(user_id)].append((habit_id, moment.astimezone(_zone(user_id)).date()))
+            fired = []
+            for index, chunk in by_shard.items():
+                with shards.using(index):
+                    fired += await run_read(_fired, chunk)
+
+            by_user: Dict[int, List[str]] = defaultdict(list)
+            for habit, day, total in fired:
+                if needs_reminder(habit, total):
+                    by_user[habit.user_id].append(habit.name)
+                self.schedule(habit, moment)  # and the next one
+            for user_id, names in by_user.items():
+                self.sender.put(user_id, reminder_text(names))
+
+    def start(self):
+        self.sender.start()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.sender.stop()
+
+
+scheduler: Optional[ReminderScheduler] = None
+
+
+async def start(client: Optional[httpx.AsyncClient] = None):
+    global scheduler
+    if not BOT_TOKEN and client is None:
+        return
+    client = client or httpx.AsyncClient(base_url=f"{BOT_API}/bot{BOT_TOKEN}/", timeout=10)
+    scheduler = ReminderScheduler(Sender(client))
+    await scheduler.load()
+    scheduler.start()
+
+
+async def stop():
+    global scheduler
+    if scheduler is not None:
+        await scheduler.stop()
+        await scheduler.sender.client.aclose()
+        scheduler = None
+
+
+# hooks for the habit routes (no-ops when reminders are off)
+def habit_changed(habit: models.Habit):
+    if scheduler is not None:
+        scheduler.schedule(habit)
+
+
+def habit_removed(habit_id: int):
+    if scheduler is not None:
+        scheduler.cancel(habit_id)
+
+
+# the user's reminders move with their timezone
+async def timezone_changed(user_id: int, zone: tzinfo):
+    if scheduler is None:
+        return
+    _zones[user_id] = zone
+
+    def user_habits(db: Session) -> List[models.Habit]:
+        return list(_habits_with_reminders(db).filter(models.Habit.user_id == user_id))
+
+    for habit in await run_read(user_habits):
+        scheduler.schedule(habit)
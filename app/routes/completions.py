@@ -1,163 +1,346 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from app.database import get_db
-from app import models, schemas
+from app.db_async import run_read, run_write
+from app.shards import user_shard
+from app.localtime import as_utc, local_day, today_in, write_zone
+from app.events import user_data_changed
+from app import heatmap, history, models, schemas, stats
 from app.models import Habit, HabitCompletion
+from app.recurrence import compile_rule
+from app.daybits import clear_day, set_day
+from app.streaks import update_streak
+from app.write_buffer import apply_to_day, read_your_taps, tap_buffer
 
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timedelta, timezone
 
-from typing import List, Optional
-from collections import defaultdict
-import logging
+from typing import List, Literal, Optional, Tuple
 
+from app.logger import logger
 
-router = APIRouter()
 
-def create_completion(user_id: int, habit_id: int, db: Session, completed_at: Optional[datetime] = None, value: Optional[int] = None):
-    new_completion = models.HabitCompletion(
-        habit_id=habit_id,
-        completed_at=completed_at,
-        user_id=user_id,
-        value=value
-    )
+router = APIRouter(dependencies=[Depends(user_shard), Depends(read_your_taps)])
 
-    db.add(new_completion)
-    db.commit()
-    db.refresh(new_completion)
-    return new_completion
+MAX_HEATMAP_RANGE = timedelta(days=366 * 2)
 
+# Writes go through the (habit_id, user_id, day) unique key, so each one is a single statement
+# that returns the row, and two fast taps can't end up as two rows for the same day.
+# Neither of these commits, the caller does (the day bitmaps + streak are updated in the same transaction).
 
-@router.post("/api/habits/{habit_id}/complete", response_model=schemas.CompletionRead)
-def toggle_completion(
-    habit_id: int,
-    completion: schemas.CompletionCreate,
-    db: Session = Depends(get_db),
-):
-    user_id = completion.user_id
+# binary: delete today's row if there is one, otherwise insert it. None means it got untoggled
+def toggle_binary(db: Session, habit: Habit, day: date, completed_at: Optional[datetime] = None) -> Optional[HabitCompletion]:
+    removed = db.execute(
+        delete(HabitCompletion).where(
+            HabitCompletion.habit_id == habit.id,
+            HabitCompletion.user_id == habit.user_id,
+            HabitCompletion.local_day == day
+        ).returning(HabitCompletion.id)
+    ).first()
+
+    if removed:
+        clear_day(db, habit.id, habit.user_id, day)
+        update_streak(db, habit, day, totals=(0, 0))
+        return None
 
+    completion = db.scalars(
+        sqlite_insert(HabitCompletion).values(
+            habit_id=habit.id,
+            user_id=habit.user_id,
+            local_day=day,
+            completed_at=as_utc(completed_at) or datetime.now(timezone.utc),
+        ).on_conflict_do_nothing(
+            index_elements=[HabitCompletion.habit_id, HabitCompletion.user_id, HabitCompletion.local_day]
+        ).returning(HabitCompletion)
+    ).first()
+
+    if completion is None:  # somebody else checked it in between, theirs counts
+        completion = db.query(HabitCompletion).filter_by(habit_id=habit.id, user_id=habit.user_id, local_day=day).one()
+
+    set_day(db, habit.id, habit.user_id, day, total_value=completion.value or 0)
+    update_streak(db, habit, day, totals=(1, completion.value or 0))
+    return completion
+
+
+# countable / limit: add `value` to that day's row, clamped at zero.
+# A negative value with nothing logged yet is a no-op (None), same as it always was
+def add_to_day(db: Session, habit: Habit, day: date, value: int, completed_at: Optional[datetime] = None) -> Optional[HabitCompletion]:
+    return apply_to_day(db, habit, day, 0, value, value if value >= 0 else None, completed_at)
+
+
+# the whole completion write (lookup, row, bitmaps, streak, commit), on the db writer
+def complete(db: Session, habit_id: int, completion: schemas.CompletionCreate) -> Tuple[date, Optional[HabitCompletion]]:
     habit = db.query(models.Habit).filter(
         models.Habit.id == habit_id,
-        models.Habit.user_id == user_id
+        models.Habit.user_id == completion.user_id,
+        models.Habit.deleted_at.is_(None)
     ).first()
 
     if habit is None:
         raise HTTPException(404, "Habit not found")
 
-    today = datetime.now(timezone.utc).date()
+    zone = write_zone(db, habit.user_id)
 
     # for binary it literally is toggle (upon toggling it either adds or deletes completion)
     if habit.type == "binary":
-        existing = db.query(models.HabitCompletion).filter(
-            models.HabitCompletion.habit_id == habit_id,
-            models.HabitCompletion.user_id == user_id,
-            func.date(models.HabitCompletion.completed_at) == today
-        ).first()
-
-        if existing:
-            db.delete(existing)
-            db.commit()
-            return schemas.CompletionRead(
-                id=0,
-                habit_id=habit_id,
-                user_id=user_id,
-                completed_at=None
-            )
-        else:
-            return create_completion(user_id=user_id, habit_id=habit_id, db=db)
+        day = today_in(zone)
+        result = toggle_binary(db, habit, day)
 
-    # countable / limit types 
-    if completion.value is None:
-        raise HTTPException(400, "Completion value is required for countable/limit habits")
+    # countable / limit types
+    else:
+        if completion.value is None:
+            raise HTTPException(400, "Completion value is required for countable/limit habits")
 
-    existing = db.query(models.HabitCompletion).filter(
-        models.HabitCompletion.habit_id == habit_id,
-        models.HabitCompletion.user_id == user_id,
-        func.date(models.HabitCompletion.completed_at) == today
-    ).first()
+        completed_at = as_utc(completion.completed_at)
+        day = local_day(completed_at, zone)
+        result = add_to_day(db, habit, day, completion.value, completed_at=completed_at)
 
-    if existing:
-        new_value = (existing.value or 0) + completion.value
-        if habit.type in ["limit", "countable"]:
-            new_value = max(0, new_value)
+    db.commit()
+    return day, result
 
-        existing.value = new_value
-        db.commit()
-        db.refresh(existing)
-        return existing
-    else:
-        if habit.type in ["limit", "countable"] and completion.value < 0:
-            return schemas.CompletionRead(
-                id=0,
-                habit_id=habit_id,
-                user_id=user_id,
-                completed_at=None  # notice the dummy return (and its not even me)
-            )
-
-        return create_completion(
-            user_id=user_id,
+
+# for a buffered tap: the habit, the user's day the tap is for and that day's row as it is in the database right now
+def tap_target(db: Session, habit_id: int, user_id: int, completed_at: Optional[datetime]) -> Tuple[Optional[Habit], Optional[date], Optional[HabitCompletion]]:
+    habit = db.query(Habit).filter(Habit.id == habit_id, Habit.user_id == user_id, Habit.deleted_at.is_(None)).first()
+    if habit is None or habit.type == "binary":
+        return habit, None, None
+    day = local_day(completed_at, write_zone(db, user_id))
+    row = db.query(HabitCompletion).filter_by(habit_id=habit_id, user_id=user_id, local_day=day).first()
+    return habit, day, row
+
+
+# write-behind mode (app/write_buffer.py): the tap is only checked and answered here,
+# None means it's not a countable/limit tap and takes the normal path
+async def buffer_tap(habit_id: int, completion: schemas.CompletionCreate) -> Optional[schemas.CompletionRead]:
+    user_id = completion.user_id
+    completed_at = as_utc(completion.completed_at)
+
+    # the row has to be read with no flush in between, or taps written meanwhile would be missing from the answer
+    for _ in range(3):
+        flushes = await tap_buffer.settled()
+        habit, day, row = await run_read(tap_target, habit_id, user_id, completed_at)
+        if tap_buffer.flushes == flushes:
+            break
+    if habit is None:
+        raise HTTPException(404, "Habit not found")
+    if habit.type == "binary":
+        return None
+
+    tap_buffer.add(user_id, habit_id, day, completion.value, completed_at)
+    value = tap_buffer.pending(user_id, habit_id, day).value_after(None if row is None else (row.value or 0))
+    if value is None:
+        return schemas.CompletionRead(id=0, habit_id=habit_id, user_id=user_id, completed_at=None)
+
+    completed_at = row.completed_at if row is not None else (completed_at or datetime.now(timezone.utc))
+    return schemas.CompletionRead(
+        id=row.id if row is not None else 0,  # not inserted yet
+        habit_id=habit_id,
+        user_id=user_id,
+        completed_at=completed_at,
+        value=value,
+    )
+
+
+@router.post("/api/habits/{habit_id}/complete", response_model=schemas.CompletionRead)
+async def toggle_completion(habit_id: int, completion: schemas.CompletionCreate):
+    user_id = completion.user_id
+
+    if tap_buffer.enabled and completion.value is not None:
+        buffered = await buffer_tap(habit_id, completion)
+        if buffered is not None:
+            return buffered
+
+    day, result = await run_write(complete, habit_id, completion)
+    user_data_changed(user_id, day, [habit_id])
+
+    if result is None:
+        return schemas.CompletionRead(
+            id=0,
             habit_id=habit_id,
-            db=db,
-            completed_at=completion.completed_at,
-            value=completion.value
+            user_id=user_id,
+            completed_at=None  # notice the dummy return (and its not even me)
         )
+    return result
+
+
+# All items in one writer transaction: one query checks every habit belongs to the user, then each
+# item goes through toggle_binary / add_to_day in order. Bad items are reported, the rest still apply
+def complete_batch(db: Session, batch: schemas.CompletionBatch) -> Tuple[List[dict], set]:
+    habit_ids = {item.habit_id for item in batch.items}
+    habits = {
+        habit.id: habit
+        for habit in db.query(Habit).filter(Habit.id.in_(habit_ids), Habit.user_id == batch.user_id, Habit.deleted_at.is_(None)).all()
+    }
+
+    zone = write_zone(db, batch.user_id)
+    results, days = [], set()
+    for item in batch.items:
+        habit = habits.get(item.habit_id)
+        if habit is None:
+            results.append({"habit_id": item.habit_id, "ok": False, "error": "Habit not found"})
+            continue
+
+        completed_at = as_utc(item.completed_at)  # backfills from another timezone are stored (and echoed) as UTC
+        day = local_day(completed_at, zone)
+        if habit.type == "binary":
+            result = toggle_binary(db, habit, day, completed_at=completed_at)
+        elif item.value is None:
+            results.append({"habit_id": item.habit_id, "ok": False, "error": "Completion value is required for countable/limit habits"})
+            continue
+        else:
+            result = add_to_day(db, habit, day, item.value, completed_at=completed_at)
+
+        # snapshot it now, a later item on the same day updates the same row
+        completion = schemas.CompletionRead.model_validate(result) if result is not None else None
+        results.append({"habit_id": item.habit_id, "ok": True, "completion": completion})
+        days.add(day)
+
+    db.commit()
+    return results, days
+
+
+# offline sync / checking off a whole routine in one request
+@router.post("/api/completions/batch", response_model=schemas.CompletionBatchResponse)
+async def batch_completions(batch: schemas.CompletionBatch):
+    # buffered taps happened before these, they go first
+    await tap_buffer.flush_user(batch.user_id)
+
+    results, days = await run_write(complete_batch, batch)
+    habit_ids = {result["habit_id"] for result in results if result["ok"]}
+    for day in days:
+        user_data_changed(batch.user_id, day, habit_ids)
+    return {"results": results}
 
 
 @router.get("/api/habits/{habit_id}/completions", response_model=List[schemas.CompletionRead])
-def get_completions_for_habit(user_id: int, habit_id: int, db: Session = Depends(get_db)):
-    completions = db.query(models.HabitCompletion).filter(
-        models.HabitCompletion.habit_id == habit_id, 
-        models.HabitCompletion.user_id == user_id
-    ).all()
+async def get_completions_for_habit(
+    user_id: int,
+    habit_id: int,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+):
+    def completions_for_habit(db: Session) -> List[HabitCompletion]:
+        completions = db.query(models.HabitCompletion).join(
+            models.Habit, models.Habit.id == models.HabitCompletion.habit_id
+        ).filter(
+            models.HabitCompletion.habit_id == habit_id,
+            models.HabitCompletion.user_id == user_id,
+            models.Habit.deleted_at.is_(None)
+        )
+        if since is not None:
+            completions = completions.filter(models.HabitCompletion.local_day >= since)
+        if until is not None:
+            completions = completions.filter(models.HabitCompletion.local_day <= until)
 
-    return completions
+        return completions.order_by(models.HabitCompletion.completed_at, models.HabitCompletion.id).all()
+
+    return await run_read(completions_for_habit)
+
+
+# Paginated history: follow next_cursor until it's null. since/until are days (inclusive)
+@router.get("/api/habits/{habit_id}/history", response_model=schemas.CompletionPage)
+async def get_completion_history(
+    user_id: int,
+    habit_id: int,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    order: Literal["asc", "desc"] = "desc",
+):
+    try:
+        items, next_cursor = await run_read(
+            history.completions_page, user_id, habit_id,
+            since=since, until=until, cursor=cursor, limit=limit,
+            newest_first=(order == "desc"),
+        )
+    except history.InvalidCursor:
+        raise HTTPException(400, "Invalid cursor")
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# Everything the user ever logged, streamed (memory stays flat no matter how long the history is)
+@router.get("/api/completions/export")
+async def export_completions(user_id: int, format: Literal["ndjson", "csv"] = "ndjson"):
+    if format == "csv":
+        return StreamingResponse(
+            history.export_csv(user_id),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="habits-{user_id}.csv"'},
+        )
+    return StreamingResponse(
+        history.export_ndjson(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="habits-{user_id}.ndjson"'},
+    )
 
 
 # This WILL be used for a heatmap, but is not used now
 @router.get("/habits/completion_calendar") 
-def completion_calendar(user_id: int, db: Session = Depends(get_db)):
-    print(f"[DEBUG] Received raw user_id: {user_id}")
+async def completion_calendar(user_id: int):
+    logger.debug("completion calendar for user %s", user_id)
+    return await run_read(build_calendar, user_id)
+
+
+def build_calendar(db: Session, user_id: int) -> dict:
     habits = db.query(Habit).filter(
         Habit.user_id == user_id,
-        Habit.tracked == True
+        Habit.tracked == True,
+        Habit.deleted_at.is_(None)
     ).all()
 
-    completions = db.query(HabitCompletion).filter(
+    # date -> number of habits with something logged that day (completions are one row per habit per day)
+    completions_by_day = dict(db.query(
+        HabitCompletion.local_day,
+        func.count(HabitCompletion.habit_id)
+    ).filter(
         HabitCompletion.user_id == user_id
-    ).all()
+    ).group_by(HabitCompletion.local_day).all())
 
-    # completions are grouped by date
-    completions_by_day = defaultdict(set)  # date -> set of habit_ids completed
-    for c in completions:
-        completions_by_day[c.completed_at.date()].add(c.habit_id)
+    rules = [compile_rule(habit) for habit in habits]
 
     # compare set of completions for that day vs EXPECTED (so the thats where the 'heat' part comes from)
     calendar = {}
 
     for day in completions_by_day:
-        total = 0
-        for habit in habits:
-            if habit.start_date > day:
-                continue
-            if habit.repeat_type == "daily":
-                total += 1
-            elif habit.repeat_type == "weekly" and day.weekday() == habit.start_date.weekday():
-                total += 1
-            elif habit.repeat_type == "biweekly":
-                delta = (day - habit.start_date).days
-                if delta % 14 == 0:
-                    total += 1
-            elif habit.repeat_type == "monthly" and day.day == habit.start_date.day:
-                total += 1
-            elif habit.repeat_type == "custom":
-                total += 1  # a 'pass' is better? (is it?)
+        total = sum(1 for rule in rules if rule.is_due(day))
 
         calendar[day.isoformat()] = {
-            "completed": len(completions_by_day[day]),
+            "completed": completions_by_day[day],
             "total": total or 1
         }
-    print(f"[LOG] heatmap for {len(calendar)} days")
+    logger.debug("completion calendar has %d days", len(calendar))
+
+    return calendar
+
 
-    return calendar
\ No newline at end of file
+# heatmap grid for [from, to]: {"days": [...], "completed": [...], "total": [...]}
+@router.get("/api/heatmap")
+async def get_heatmap(
+    user_id: int,
+    start: date = Query(..., alias="from"),
+    end: date = Query(..., alias="to"),
+):
+    if end < start:
+        raise HTTPException(400, "'to' is before 'from'")
+    if end - start > MAX_HEATMAP_RANGE:
+        raise HTTPException(400, f"Range can be at most {MAX_HEATMAP_RANGE.days} days")
+
+    return await run_read(heatmap.build_heatmap, user_id, start, end)
+
+
+# completion rate, streaks, totals and averages of every habit (or just the habit_id ones) over
+# [from, to] (default: the last year), and per week / month. Columnar, see app/stats.py
+@router.get("/api/stats")
+async def get_stats(
+    user_id: int,
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    bucket: Literal["week", "month"] = "week",
+    habit_id: Optional[List[int]] = Query(None),
+):
+    return await run_read(stats.build_stats, user_id, start, end, bucket, habit_id)
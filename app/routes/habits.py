@@ -1,302 +1,280 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
-from app import models, schemas
-from app.database import get_db
+from app import daybits, models, schemas
+from app.cache import read_cache
+from app.db_async import read_json, run_read, run_write
+from app.shards import next_habit_id, user_shard
+from app import purge, reminders
+from app.events import user_data_changed
+from app.localtime import local_today, user_today
 from app.schemas import HabitUpdate, RepeatType
-from app.routes.completions import get_completions_for_habit
+from app.recurrence import ALL_WEEKDAYS, compile_rule
+from app.streaks import load_streaks, new_streak, rebuild_streak, streak_from_record
+from app.summary import build_bootstrap, build_today_summary, habit_payload
+from app.write_buffer import read_your_taps
 
 from typing import Dict, List
 
-from datetime import date, datetime, timedelta, timezone
-from dateutil.relativedelta import relativedelta
-from calendar import monthrange
-
 from app.logger import logger
 
+schedule_log = logger.getChild("schedule")
+
+
+router = APIRouter(dependencies=[Depends(user_shard), Depends(read_your_taps)])
+
+STREAK_FIELDS = {"type", "target", "repeat_type", "start_date", "weekdays"}
+NOT_NULL_FIELDS = {"name", "repeat_type", "start_date", "tracked", "type"}  # HabitUpdate lets them be null, the habit can't
 
-router = APIRouter()
 
+# what response_model=schemas.Habit would have sent, for the cached endpoints
+def habits_out(habits: List[models.Habit]) -> List[dict]:
+    return [habit_payload(habit) for habit in habits]
+
+
+# Every handler is async and does its database work in a plain function handed to
+# app.db_async (run_read / run_write), which runs it on a db worker thread with its own session
 
 # Create a new habit
 @router.post("/api/habits")
-def create_habit(habit: schemas.HabitCreate, db: Session = Depends(get_db)):
-    db_habit = models.Habit(
-        name=habit.name,
-        repeat_type=habit.repeat_type,
-        tracked=habit.tracked,
-        user_id=habit.user_id,
-        type=habit.type,
-        target=habit.target,
-        start_date=habit.start_date or date.today()
-    )
-    db.add(db_habit)
-    db.commit()
-    db.refresh(db_habit)
+async def create_habit(habit: schemas.HabitCreate):
+    if habit.repeat_type == RepeatType.CUSTOM and not habit.weekdays:
+        raise HTTPException(status_code=400, detail="Custom habits need at least one weekday")
+    # a bit past sunday (or a negative number) would be masked away and the habit never due
+    if habit.weekdays and habit.weekdays & ~ALL_WEEKDAYS:
+        raise HTTPException(status_code=400, detail="weekdays is a bitmask of the 7 days (1-127)")
+
+    def create(db: Session) -> models.Habit:
+        db_habit = models.Habit(
+            id=next_habit_id(db),
+            name=habit.name,
+            repeat_type=habit.repeat_type,
+            tracked=habit.tracked,
+            user_id=habit.user_id,
+            type=habit.type,
+            target=habit.target,
+            weekdays=habit.weekdays,
+            reminder_time=habit.reminder_time,
+            start_date=habit.start_date or local_today(db, habit.user_id)
+        )
+        db.add(db_habit)
+        db.flush()
+        db.add(new_streak(db_habit))  # so reads never have to build it
+        db.commit()
+        db.refresh(db_habit)
+        return db_habit
+
+    db_habit = await run_write(create)
+    user_data_changed(db_habit.user_id, habit_ids=[db_habit.id])
+    reminders.habit_changed(db_habit)
     return db_habit
 
 
+def list_habits(db: Session, user_id: int, tracked_only: bool = False) -> List[dict]:
+    query = db.query(models.Habit).filter(models.Habit.user_id == user_id, models.Habit.deleted_at.is_(None))
+    if tracked_only:
+        query = query.filter(models.Habit.tracked == True)
+    return habits_out(query.all())
+
+
 # Get all the habits
 @router.get("/api/habits", response_model=List[schemas.Habit])
-def get_habits(user_id: int, db: Session = Depends(get_db)):
-    habits = db.query(models.Habit).filter(
-        models.Habit.user_id == user_id
-    ).all()
-    return habits
+async def get_habits(user_id: int, request: Request):
+    return await read_cache.respond(request, user_id, "habits", lambda: read_json(list_habits, user_id))
 
 
 # Get tracked habits only
 @router.get("/api/habits/tracked", response_model=List[schemas.Habit])
-def get_tracked_habits(user_id: int, db: Session = Depends(get_db)):
-    habits = db.query(models.Habit).filter(
-        models.Habit.tracked == True, 
-        models.Habit.user_id == user_id
-    ).all()
-    return habits
+async def get_tracked_habits(user_id: int, request: Request):
+    return await read_cache.respond(
+        request, user_id, "tracked",
+        lambda: read_json(list_habits, user_id, tracked_only=True)
+    )
 
 
-# Delete a habit (hard and permanent)
-@router.delete("/api/habits/{habit_id}", status_code=204)
-def delete_habit(user_id: int, habit_id: int, db: Session = Depends(get_db)):
+def find_habit(db: Session, habit_id: int, user_id: int) -> models.Habit:
     habit = db.query(models.Habit).filter(
-        models.Habit.id == habit_id, 
-        models.Habit.user_id == user_id
+        models.Habit.id == habit_id,
+        models.Habit.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
     ).first()
 
     if habit is None:
         raise HTTPException(status_code=404, detail="Habit Not Found")
-    
-    db.delete(habit)
-    db.commit()
+    return habit
+
+
+# Delete a habit (hard and permanent). Long histories are tombstoned and purged in the background (app.purge)
+@router.delete("/api/habits/{habit_id}", status_code=204)
+async def delete_habit(user_id: int, habit_id: int):
+    def delete(db: Session) -> bool:
+        habit = find_habit(db, habit_id, user_id)
+        tombstoned = purge.delete_habit(db, habit)
+        db.commit()
+        return tombstoned
+
+    if await run_write(delete):
+        purge.purger.wake()
+    user_data_changed(user_id, habit_ids=[habit_id])
+    reminders.habit_removed(habit_id)
     return
 
 
+def set_tracked(db: Session, habit_id: int, user_id: int, tracked: bool) -> models.Habit:
+    habit = find_habit(db, habit_id, user_id)
+    habit.tracked = tracked
+    db.commit()
+    return habit
+
+
 # Untrack a habit, so, a soft delete (won't showup in todays page, tough still exists)
 @router.patch("/api/habits/{habit_id}/untrack")
-def untrack_habit(user_id: int, habit_id: int, db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter(
-        models.Habit.id == habit_id, 
-        models.Habit.user_id == user_id
-    ).first()
-
-    if habit is None:
-        raise HTTPException(status_code=404, detail="Habit Not Found")
-    
-    habit.tracked = False
-    db.commit()
-    db.refresh(habit)
+async def untrack_habit(user_id: int, habit_id: int):
+    habit = await run_write(set_tracked, habit_id, user_id, False)
+    user_data_changed(user_id, habit_ids=[habit_id])
+    reminders.habit_changed(habit)  # untracked habits drop out of the reminder heap
     return
 
 
 # Track a habit, bring back from the soft delete
 @router.patch("/api/habits/{habit_id}/track")
-def track_habit(user_id: int, habit_id: int, db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter(
-        models.Habit.id == habit_id, 
-        models.Habit.user_id == user_id
-    ).first()
-
-    if habit is None:
-        raise HTTPException(status_code=404, detail="Habit Not Found")
-    
-    habit.tracked = True
-    db.commit()
-    db.refresh(habit)
+async def track_habit(user_id: int, habit_id: int):
+    habit = await run_write(set_tracked, habit_id, user_id, True)
+    user_data_changed(user_id, habit_ids=[habit_id])
+    reminders.habit_changed(habit)
     return
 
 
 # well, a streak-getter...
 @router.get("/api/habits/{habit_id}/streak")
-def get_streak(user_id: int, habit_id: int, db: Session = Depends(get_db)):
-    habit = get_habit(habit_id=habit_id, user_id=user_id, db=db)
-    completions = get_completions_for_habit(user_id=user_id, habit_id=habit_id, db=db)
-
-    if not completions:
-        return 0
-
-    # Extract dates where habit was completed
-    completed_days = sorted({c.completed_at.date() for c in completions}, reverse=True)
-
-    current_date = datetime.now(timezone.utc).date()
-    streak = 0
-
-    for date in completed_days:
-        if habit.type in ("countable", "limit"):
-            # completion on this day summed up
-            day_completions = [c for c in completions if c.completed_at.date() == date]
-            total_value = sum(c.value or 0 for c in day_completions)
-
-            if habit.type == "countable":
-                if total_value < (habit.target or 1):
-                    break # days not completed
-            elif habit.type == "limit":
-                if total_value >= (habit.target or 0):
-                    break
-        # binary 
-        if date == current_date:
-            streak += 1
-        else:
-            expected = get_expected_date(date=current_date, repeat_type=habit.repeat_type)
-            if date != expected:
-                break
-            streak += 1
-            current_date = expected
-
-    return streak
-
-
-# This thing counts the expected day to get us our STREAKSSS (2 DAYS NO LEETCODE)
-def get_expected_date(date: date, repeat_type: str) -> date:
-    if repeat_type == RepeatType.DAILY:
-        return date - timedelta(days=1)
-    elif repeat_type == RepeatType.WEEKLY:
-        return date - timedelta(days=7)
-    elif repeat_type == RepeatType.BIWEEKLY:
-        return date - timedelta(days=14)
-    elif repeat_type == RepeatType.MONTHLY:
-        return date - relativedelta(months=1)
-    else:
-        raise NotImplementedError("Custom is not yet supported :(")
+async def get_streak(user_id: int, habit_id: int):
+    def streak(db: Session) -> int:
+        habit = find_habit(db, habit_id, user_id)
+        record = load_streaks(db, [habit])[habit.id]
+        return streak_from_record(habit, record, local_today(db, user_id))
+
+    return await run_read(streak)
 
 
 # Gets todays habits
 @router.get("/api/habits/today", response_model=List[schemas.Habit])
-def get_habits_for_today(user_id: int, db: Session = Depends(get_db)):
-    today = datetime.now(timezone.utc).date()
+async def get_habits_for_today(user_id: int, request: Request):
+    today = await user_today(user_id)
+    return await read_cache.respond(
+        request, user_id, ("today", today),
+        lambda: read_json(lambda db: habits_out(habits_for_today(user_id=user_id, db=db)))
+    )
 
-    habits = db.query(models.Habit).filter(
-        models.Habit.tracked == True, 
-        models.Habit.user_id == user_id
-    ).all()
 
-    today = datetime.now(timezone.utc).date()
+def habits_for_today(user_id: int, db: Session) -> List[models.Habit]:
+    today = local_today(db, user_id)
+
     habits = db.query(models.Habit).filter(
         models.Habit.tracked == True,
-        models.Habit.user_id == user_id
+        models.Habit.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
     ).all()
 
     habits_today = []
     for habit in habits:
-        logger.debug(f"Habit {habit.name} — start: {habit.start_date}, today: {today}, repeat_type: {habit.repeat_type}")
-        if habit.start_date > today:
-            continue
-
-        if habit.repeat_type == "daily":
+        schedule_log.debug("Habit %s — start: %s, today: %s, repeat_type: %s", habit.name, habit.start_date, today, habit.repeat_type)
+        if compile_rule(habit).is_due(today):
             habits_today.append(habit)
 
-        elif habit.repeat_type == "weekly":
-            if (today - habit.start_date).days % 7 == 0:
-                habits_today.append(habit)
-        
-        elif habit.repeat_type == "biweekly":
-            if (today - habit.start_date).days % 14 == 0:
-                habits_today.append(habit)
-        
-        elif habit.repeat_type == "monthly":
-            start_day = habit.start_date.day
-            last_day_current_month = monthrange(today.year, today.month)[1]
-            # i.e. today is april 30th, 2025, but the habits start day is march 31st 2025
-            # in order to nt skip it, we'll just append todays habits with this *almost* missed out habit
-            if start_day >= 28:
-                if today.day == last_day_current_month:
-                    habits_today.append(habit)
-            else:
-                if today.day == start_day:
-                    habits_today.append(habit)
-
-        elif habit.repeat_type == "custom":
-            pass
-    
     return habits_today
 
 
 # to allow editing of habits
 @router.put("/api/habits/{habit_id}")
-def update_habit(habit_id: int, habit_data: HabitUpdate, db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter(
-        models.Habit.user_id == habit_data.user_id,
-        models.Habit.id == habit_id
-    ).first()
-
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
-    
-    for field, value in habit_data.model_dump(exclude_unset=True).items():
-        setattr(habit, field, value)
-
-    db.commit()
-    db.refresh(habit)
+async def update_habit(habit_id: int, habit_data: HabitUpdate):
+    changes = habit_data.model_dump(exclude_unset=True)
+    nulls = sorted(field for field in NOT_NULL_FIELDS & changes.keys() if changes[field] is None)
+    if nulls:
+        raise HTTPException(status_code=400, detail=f"{', '.join(nulls)} can't be null")
+    # same bitmask check as create_habit
+    if changes.get("weekdays") and changes["weekdays"] & ~ALL_WEEKDAYS:
+        raise HTTPException(status_code=400, detail="weekdays is a bitmask of the 7 days (1-127)")
+
+    def update(db: Session) -> models.Habit:
+        habit = db.query(models.Habit).filter(
+            models.Habit.user_id == habit_data.user_id,
+            models.Habit.id == habit_id,
+            models.Habit.deleted_at.is_(None)
+        ).first()
+
+        if not habit:
+            raise HTTPException(status_code=404, detail="Habit not found")
+
+        # same rule as create_habit, for the habit as it would be after the update
+        repeat_type = changes.get("repeat_type", habit.repeat_type)
+        if repeat_type == RepeatType.CUSTOM and not changes.get("weekdays", habit.weekdays):
+            raise HTTPException(status_code=400, detail="Custom habits need at least one weekday")
+
+        for field, value in changes.items():
+            setattr(habit, field, value)
+
+        # what counts as a streak depends on these, so recount it
+        if STREAK_FIELDS & changes.keys():
+            rebuild_streak(db, habit)
+
+        db.commit()
+        db.refresh(habit)
+        return habit
+
+    habit = await run_write(update)
+    user_data_changed(habit.user_id, habit_ids=[habit.id])
+    reminders.habit_changed(habit)
     return habit
 
 
 # Get one (user_id specific) habit
 @router.get("/api/habits/{habit_id}", response_model=schemas.Habit)
-def get_habit(habit_id: int, user_id: int, db: Session = Depends(get_db)):
-    habit = db.query(models.Habit).filter_by(id=habit_id, user_id=user_id).first()
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
-    return habit
+async def get_habit(habit_id: int, user_id: int):
+    def get(db: Session) -> models.Habit:
+        habit = db.query(models.Habit).filter_by(id=habit_id, user_id=user_id, deleted_at=None).first()
+        if not habit:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        return habit
+
+    return await run_read(get)
 
 
 # Get ttodays progress (for da frontend wheel mostly)
 @router.get("/api/progress/today", response_model=Dict[str, float])
-def get_todays_progress(user_id: int, db: Session = Depends(get_db)):
-    habits = get_habits_for_today(user_id=user_id, db=db)
-    completions_count = 0
+async def get_todays_progress(user_id: int, request: Request):
+    today = await user_today(user_id)
+    return await read_cache.respond(
+        request, user_id, ("progress", today),
+        lambda: read_json(lambda db: todays_progress(user_id=user_id, db=db))
+    )
+
+
+def todays_progress(user_id: int, db: Session) -> Dict[str, float]:
+    habits = habits_for_today(user_id=user_id, db=db)
     total_count = len(habits)
-    today = datetime.now().date()
+    today = local_today(db, user_id)
 
-    for habit in habits:
-        completions = get_completions_for_habit(user_id=user_id, habit_id=habit.id, db=db)
-        if any(c.completed_at.date() == today for c in completions):
-            completions_count += 1
-    
-    return {"progress": completions_count / total_count * 100 if total_count > 0 else 0}
+    completions_count = len(daybits.logged_on(db, [habit.id for habit in habits], today))
+
+    return {"progress": completions_count / total_count * 100 if total_count > 0 else 0.0}
 
 
 # Gets todays summary to lessen load from the frontend i guess
 # and make it... *snappy*-ish... -er, whatever...
 @router.get("/api/habits/today/summary")
-def get_today_summary(user_id: int, db: Session = Depends(get_db)):
-    habits = get_habits_for_today(user_id=user_id, db=db)
-    start_of_day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_day = start_of_day + timedelta(days=1)
-
-    summary = []
-
-    for habit in habits:  # some of the habits didn't work properly since utc and local time was diff
-        completions = db.query(models.HabitCompletion).filter(
-            models.HabitCompletion.habit_id == habit.id,
-            models.HabitCompletion.user_id == user_id,
-            models.HabitCompletion.completed_at >= start_of_day,
-            models.HabitCompletion.completed_at < end_of_day
-        ).all()
-
-        completed_today = False
-
-        if habit.type == "binary":
-            total_value = 1
-            completed_today = bool(completions)
-
-        elif habit.type == "countable":
-            total_value = sum(c.value or 0 for c in completions)
-            completed_today = total_value >= (habit.target or 1)
-
-        elif habit.type == "limit":
-            total_value = sum(c.value or 0 for c in completions)
-            completed_today = total_value < (habit.target or 0)
-
-        streak = get_streak(user_id, habit.id, db)
-
-        summary.append({
-            "id": habit.id,
-            "name": habit.name,
-            "repeat_type": habit.repeat_type,
-            "type": habit.type,
-            "current_value": total_value,
-            "target": habit.target,
-            "completed_today": completed_today,
-            "streak": streak,
-        })
-
-    return summary
\ No newline at end of file
+async def get_today_summary(user_id: int, request: Request):
+    today = await user_today(user_id)
+    return await read_cache.respond(
+        request, user_id, ("summary", today),
+        lambda: read_json(lambda db: build_today_summary(user_id=user_id, db=db))
+    )
+
+
+# One round trip for the whole today screen, serialized straight to JSON (no response_model)
+@router.get("/api/bootstrap")
+async def get_bootstrap(user_id: int, request: Request):
+    today = await user_today(user_id)
+    return await read_cache.respond(
+        request, user_id, ("bootstrap", today),
+        lambda: read_json(lambda db: build_bootstrap(user_id=user_id, db=db))
+    )
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, WebSocket
+
+from app.live import hub
+from app.shards import use_user
+
+
+router = APIRouter()
+
+
+# Live today-screen updates (app/live.py). Connect before fetching the summary/bootstrap, then
+# apply the messages on top of it:
+#   {"type": "today", "day": ..., "habits": [summary rows], "removed": [habit ids off today's list]}
+#   {"type": "resync"}: too much to send one by one, fetch everything again
+# Nothing is read from the client, the loop is only there to notice it's gone
+@router.websocket("/api/live")
+async def live_updates(websocket: WebSocket, user_id: int):
+    use_user(user_id)
+    await websocket.accept()
+    subscriber = hub.subscribe(websocket, user_id)
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        hub.unsubscribe(subscriber)
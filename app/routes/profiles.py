@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+
+from app import profiling
+
+from typing import Optional
+
+
+router = APIRouter()
+
+
+# the same token that turns profiling on for a request, and no token configured = no such endpoints
+def _check(token: Optional[str]):
+    if not profiling.TOKEN:
+        raise HTTPException(404, "Not Found")
+    if not profiling.token_ok(token):
+        raise HTTPException(403, "Bad profile token")
+
+
+# saved request profiles (app/profiling.py), newest first
+@router.get("/api/profiles", include_in_schema=False)
+def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    _check(x_profile_token)
+    return profiling.summaries()
+
+
+@router.get("/api/profiles/{name}", include_in_schema=False)
+def download_profile(name: str, x_profile_token: Optional[str] = Header(None)):
+    _check(x_profile_token)
+    path = profiling.path_of(name)
+    if path is None:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
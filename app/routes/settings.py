@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app import localtime, reminders, schemas
+from app.db_async import run_read, run_write
+from app.events import user_data_changed
+from app.shards import user_shard
+from app.write_buffer import tap_buffer
+
+
+router = APIRouter(dependencies=[Depends(user_shard)])
+
+
+@router.get("/api/settings", response_model=schemas.UserSettings)
+async def get_settings(user_id: int):
+    def get(db: Session) -> dict:
+        return {"user_id": user_id, "timezone": str(localtime.user_zone(db, user_id))}
+
+    return await run_read(get)
+
+
+# Changing the timezone re-buckets the user's whole history into the new days (app.localtime)
+@router.put("/api/settings", response_model=schemas.UserSettings)
+async def update_settings(settings: schemas.UserSettings):
+    try:
+        zone = localtime.parse_zone(settings.timezone)
+    except localtime.UnknownTimezone:
+        raise HTTPException(status_code=400, detail="Unknown timezone")
+
+    # buffered taps got their day in the old timezone, they go in first and get moved with the rest
+    await tap_buffer.flush_user(settings.user_id)
+
+    def update(db: Session):
+        if str(localtime.write_zone(db, settings.user_id)) == str(zone):
+            return
+        localtime.set_timezone(db, settings.user_id, zone)
+        db.commit()
+        localtime.remember(settings.user_id, zone)
+
+    await run_write(update)
+    user_data_changed(settings.user_id)
+    await reminders.timezone_changed(settings.user_id, zone)
+    return {"user_id": settings.user_id, "timezone": str(zone)}
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from datetime import date, datetime
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import date, datetime, time
+from typing import List, Optional
 from enum import Enum
 
 
@@ -9,7 +9,7 @@ class RepeatType(str, Enum):
     WEEKLY = "weekly"
     BIWEEKLY = "biweekly"
     MONTHLY = "monthly"
-    CUSTOM = "custom"  # Not yet supported but l8r (in a week) will allow custom weekdays  
+    CUSTOM = "custom"  # custom weekdays, see `weekdays` (bitmask, bit 0 = monday ... bit 6 = sunday)
 
 
 class HabitType(str, Enum):
@@ -26,6 +26,8 @@ class HabitCreate(BaseModel):
     user_id: int
     type: HabitType
     target: Optional[int] = None
+    weekdays: Optional[int] = None
+    reminder_time: Optional[time] = None  # user's local time, the bot sends a reminder then on due days
 
 
 class Habit(BaseModel):
@@ -37,6 +39,8 @@ class Habit(BaseModel):
     tracked: bool
     type: HabitType
     target: Optional[int] = None
+    weekdays: Optional[int] = None
+    reminder_time: Optional[time] = None
 
     model_config = {
         "from_attributes": True
@@ -46,11 +50,13 @@ class HabitUpdate(BaseModel):
     user_id: int
     id: int
     name: Optional[str]
-    repeat_type: Optional[str]
+    repeat_type: Optional[RepeatType]
     start_date: Optional[date]
     tracked: Optional[bool]
     target: Optional[int]
     type: Optional[HabitType]
+    weekdays: Optional[int] = None
+    reminder_time: Optional[time] = None
 
     
     model_config = {
@@ -74,4 +80,39 @@ class CompletionRead(CompletionBase):
 
     model_config = {
         "from_attributes": True
-    }
\ No newline at end of file
+    }
+
+
+class CompletionPage(BaseModel):
+    items: List[CompletionRead]
+    next_cursor: Optional[str] = None  # pass it back as ?cursor= for the next page, None = that was the last one
+
+
+# one entry of POST /api/completions/batch, same meaning as a /complete call for that habit
+# (completed_at picks the day, for binary habits too, so offline taps land on the day they happened)
+class CompletionBatchItem(BaseModel):
+    habit_id: int
+    completed_at: Optional[datetime] = None
+    value: Optional[int] = None
+
+
+class CompletionBatch(BaseModel):
+    user_id: int
+    items: List[CompletionBatchItem] = Field(..., max_length=500)
+
+
+# completion is None when the item un-toggled a binary habit or was a minus on nothing
+class CompletionBatchResult(BaseModel):
+    habit_id: int
+    ok: bool
+    completion: Optional[CompletionRead] = None
+    error: Optional[str] = None
+
+
+class CompletionBatchResponse(BaseModel):
+    results: List[CompletionBatchResult]
+
+
+class UserSettings(BaseModel):
+    user_id: int
+    timezone: str = "UTC"  # IANA name, e.g. "Europe/Berlin" (the webview has it from Intl.DateTimeFormat)
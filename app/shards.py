@@ -0,0 +1,239 @@
+# app/shards.py
+# Users never share data, so with HABITS_SHARDS > 1 each user's rows live in one of N SQLite files
+# (app.database.shards), every file with its own writer: taps of users on different shards don't
+# queue behind each other's write lock. That's more taps/s only with a core per writer to run
+# them; on one CPU the app is CPU-bound and 1 and 4 shards write the same (~113 taps/s at
+# concurrency 16). What it always gives is smaller files and a write lock per group of users.
+#
+# Where a user lives: pinned in shard 0's user_shards table (`move`), otherwise jump consistent
+# hashing of the user id, so going from N to N + 1 shards only moves ~1/(N + 1) of the users.
+# After changing HABITS_SHARDS run `python -m app.shards rebalance` with the app stopped, it moves
+# everyone who isn't where the router now expects them.
+#
+# Database calls (app.db_async) go to the shard of the user the request is for: the router
+# dependency here picks it from the user_id in the query string or the JSON body, background work
+# picks one with using(). Habit ids stay unique across shards (every shard hands them out from its
+# own range, next_habit_id), so a habit keeps its id when its user moves. Completion ids don't
+# leave the user (cursors), a moved user's completions are renumbered in the same order.
+#
+#   python -m app.shards status|rebalance|move USER SHARD
+from fastapi import Request
+from sqlalchemy import delete, func, insert, select, union
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import Shard, shard_of_session, shards
+from app.logger import logger
+
+from typing import Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+import argparse
+import sys
+
+
+ID_RANGE = 1 << 40  # habit ids per shard (shard i: i * ID_RANGE + 1 ...), well inside JS's 2^53
+BATCH = 5000  # rows per insert when moving a user
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+_current: ContextVar[Optional[int]] = ContextVar("db_shard", default=None)
+_pinned: Dict[int, int] = {}  # user_id -> shard, from user_shards (load_directory)
+
+
+# Lamping & Veach, "A Fast, Minimal Memory, Consistent Hash Algorithm"
+def jump_hash(key: int, buckets: int) -> int:
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(user_id: int) -> int:
+    if len(shards) == 1:
+        return 0
+    return _pinned.get(user_id, jump_hash(user_id, len(shards)))
+
+
+def load_directory():
+    global _pinned
+    with shards[0].SessionLocal() as db:
+        _pinned = dict(db.query(models.UserShard.user_id, models.UserShard.shard).all())
+
+
+def use_user(user_id: int):
+    _current.set(shard_of(user_id))
+
+
+@contextmanager
+def using(index: int) -> Iterator[Shard]:
+    token = _current.set(index)
+    try:
+        yield shards[index]
+    finally:
+        _current.reset(token)
+
+
+# the shard this request / task talks to
+def current() -> Shard:
+    index = _current.get()
+    if index is None:
+        if len(shards) == 1:
+            return shards[0]
+        raise RuntimeError("database call with no shard chosen (no user_id on the request, or background work outside shards.using())")
+    return shards[index]
+
+
+# router dependency: the rest of the request runs against the user's shard
+async def user_shard(request: Request):
+    user_id = request.query_params.get("user_id")
+    if user_id is None and request.method in BODY_METHODS and len(shards) > 1:
+        try:
+            body = await request.json()  # starlette keeps the body, the endpoint still gets it
+        except ValueError:
+            body = None
+        user_id = body.get("user_id") if isinstance(body, dict) else None
+    if user_id is not None and str(user_id).isdigit():
+        use_user(int(user_id))
+
+
+# the next habit id from the session's shard's range, on its writer
+def next_habit_id(db: Session) -> int:
+    low = shard_of_session(db) * ID_RANGE
+    highest = db.execute(select(func.max(models.Habit.id)).where(
+        models.Habit.id > low,
+        models.Habit.id <= low + ID_RANGE
+    )).scalar()
+    return (highest or low) + 1
+
+
+# Moving users, offline (the app has to be stopped)
+Completion = models.HabitCompletion.__table__
+# parents first, the copies go in with foreign keys on
+USER_TABLES = [
+    models.Habit.__table__,
+    Completion,
+    models.HabitYearBits.__table__,
+    models.HabitStreak.__table__,
+    models.UserSettings.__table__,
+]
+
+
+def users_on(db: Session) -> List[int]:
+    return sorted(db.execute(union(
+        select(models.Habit.user_id),
+        select(models.UserSettings.user_id),
+    )).scalars())
+
+
+def _delete_user(db: Session, user_id: int):
+    db.execute(delete(models.Habit).where(models.Habit.user_id == user_id))  # the rest of their rows cascade
+    db.execute(delete(models.HabitCompletion).where(models.HabitCompletion.user_id == user_id))  # without a habit
+    db.execute(delete(models.UserSettings).where(models.UserSettings.user_id == user_id))
+
+
+def _copy_user(source: Session, target: Session, user_id: int) -> int:
+    copied = 0
+    for table in USER_TABLES:
+        query = select(table).where(table.c.user_id == user_id)
+        if table is Completion:
+            query = query.order_by(Completion.c.completed_at, Completion.c.id)
+        rows = []
+        for row in source.execute(query.execution_options(yield_per=BATCH)).mappings():
+            row = dict(row)
+            if table is Completion:
+                del row["id"]  # the target numbers them, in the same order
+            rows.append(row)
+            if len(rows) >= BATCH:
+                target.execute(insert(table), rows)
+                copied += len(rows)
+                rows = []
+        if rows:
+            target.execute(insert(table), rows)
+            copied += len(rows)
+    return copied
+
+
+# Moves a user's rows from one shard to another: copied and committed on the target first, then
+# deleted from the source, so an interrupted move leaves the source complete (a rerun starts over)
+def move_user(user_id: int, source: int, target: int) -> int:
+    with shards[source].SessionLocal() as source_db, shards[target].SessionLocal() as target_db:
+        _delete_user(target_db, user_id)  # whatever an interrupted move left there
+        copied = _copy_user(source_db, target_db, user_id)
+        target_db.commit()
+        _delete_user(source_db, user_id)
+        source_db.commit()
+    logger.info("moved user %s from shard %d to %d (%d rows)", user_id, source, target, copied)
+    return copied
+
+
+def misplaced() -> List[tuple]:
+    found = []
+    for shard in shards:
+        with shard.ReadSessionLocal() as db:
+            found += [(user_id, shard.index, shard_of(user_id)) for user_id in users_on(db) if shard_of(user_id) != shard.index]
+    return found
+
+
+def rebalance() -> int:
+    moves = misplaced()
+    for user_id, source, target in moves:
+        move_user(user_id, source, target)
+    return len(moves)
+
+
+def pin(user_id: int, index: int):
+    with shards[0].SessionLocal() as db:
+        if index == jump_hash(user_id, len(shards)):
+            db.execute(delete(models.UserShard).where(models.UserShard.user_id == user_id))
+        else:
+            db.execute(sqlite_insert(models.UserShard).values(user_id=user_id, shard=index).on_conflict_do_update(
+                index_elements=[models.UserShard.user_id],
+                set_={"shard": index},
+            ))
+        db.commit()
+    load_directory()
+
+
+def main(argv=None) -> int:
+    from app.migrations import migrate
+
+    parser = argparse.ArgumentParser(description="Show or fix which shard every user's data is on (run with the app stopped)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="users/rows per shard and who is on the wrong one")
+    commands.add_parser("rebalance", help="move everyone who is on the wrong shard")
+    move = commands.add_parser("move", help="pin a user to a shard and move their data there")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    args = parser.parse_args(argv)
+
+    for shard in shards:
+        migrate(shard.engine)
+    load_directory()
+
+    if args.command == "rebalance":
+        print(f"moved {rebalance()} user(s)")
+    elif args.command == "move":
+        if not 0 <= args.shard < len(shards):
+            print(f"there are {len(shards)} shard(s)")
+            return 2
+        pin(args.user_id, args.shard)
+        for user_id, source, target in misplaced():
+            if user_id == args.user_id:
+                move_user(user_id, source, target)
+
+    for shard in shards:
+        with shard.ReadSessionLocal() as db:
+            users = len(users_on(db))
+            completions = db.query(func.count(models.HabitCompletion.id)).scalar()
+        print(f"shard {shard.index}: {users} user(s), {completions} completion(s)  {shard.url}")
+    wrong = misplaced()
+    print(f"{len(_pinned)} pinned user(s), {len(wrong)} on the wrong shard")
+    return 1 if wrong else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
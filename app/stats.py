@@ -0,0 +1,161 @@
+# app/stats.py
+# The stats screen: completion rate, streaks and totals / averages for every habit of a user at
+# once, plus the same per week or month. The days are summed in SQLite (GROUP BY habit and bucket
+# over habit_completions, one row per habit per day, so a year of a habit comes back as ~52 rows
+# instead of ~365), how many days each bucket expected comes from the habit's schedule
+# (app.recurrence.count_due).
+#
+# Columnar like the heatmap: one list per metric, index i is the i-th habit in "id" (and the i-th
+# bucket in "start"), so a long range doesn't repeat the key names in every cell.
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.localtime import local_today
+from app.recurrence import compile_rule
+from app.schemas import HabitType
+from app.streaks import load_streaks, streak_from_record
+
+from typing import Dict, List, Optional
+
+from datetime import date, timedelta
+
+
+MAX_RANGE = timedelta(days=366 * 2)
+DAYS_PER_MONTH = 365.25 / 12
+
+Completion = models.HabitCompletion
+Habit = models.Habit
+
+_VALUE = func.coalesce(Completion.value, 0)
+
+# a day counts like streaks.day_qualifies / daybits.qualifying says, as SQL
+_QUALIFIES = case(
+    (Habit.type == HabitType.COUNTABLE, case((_VALUE >= func.coalesce(Habit.target, 1), 1), else_=0)),
+    (Habit.type == HabitType.LIMIT, case((_VALUE < func.coalesce(Habit.target, 0), 1), else_=0)),
+    else_=1,
+)
+
+
+# first day of the week (monday) / month each day is in, as SQLite computes it from the ISO date
+def _bucket_sql(bucket: str):
+    if bucket == "week":
+        return func.date(Completion.local_day, "weekday 0", "-6 days")
+    return func.strftime("%Y-%m-01", Completion.local_day)
+
+
+def _bucket_starts(bucket: str, start: date, end: date) -> List[date]:
+    if bucket == "week":
+        first = start - timedelta(days=start.weekday())
+        return [first + timedelta(weeks=week) for week in range((end - first).days // 7 + 1)]
+
+    starts = []
+    year, month = start.year, start.month
+    while date(year, month, 1) <= end:
+        starts.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+
+def build_stats(
+    db: Session,
+    user_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    bucket: str = "week",
+    habit_ids: Optional[List[int]] = None,
+) -> Dict[str, object]:
+    today = local_today(db, user_id)
+    end = end or today
+    start = start or end - timedelta(days=364)
+    if end < start:
+        raise HTTPException(400, "'to' is before 'from'")
+    if end - start > MAX_RANGE:
+        raise HTTPException(400, f"Range can be at most {MAX_RANGE.days} days")
+
+    habits = db.query(Habit).filter(Habit.user_id == user_id, Habit.deleted_at.is_(None))
+    if habit_ids:
+        habits = habits.filter(Habit.id.in_(habit_ids))
+    habits = habits.order_by(Habit.id).all()
+    if habit_ids and len(habits) != len(set(habit_ids)):
+        raise HTTPException(404, "Habit not found")
+
+    starts = _bucket_starts(bucket, start, end)
+    column_of = {bucket_start: column for column, bucket_start in enumerate(starts)}
+    row_of = {habit.id: row for row, habit in enumerate(habits)}
+    shape = (len(habits), len(starts))
+    totals = np.zeros(shape, dtype=np.int64)
+    logged = np.zeros(shape, dtype=np.int64)
+    completed = np.zeros(shape, dtype=np.int64)
+    expected = np.zeros(shape, dtype=np.int64)
+
+    if habits:
+        bucket_start = _bucket_sql(bucket)
+        rows = db.execute(
+            select(
+                Completion.habit_id,
+                bucket_start,
+                func.sum(_VALUE),
+                func.count(),
+                func.sum(_QUALIFIES),
+            ).join(Habit, Habit.id == Completion.habit_id).where(
+                Completion.habit_id.in_(row_of),
+                Completion.user_id == user_id,
+                Completion.local_day >= start,
+                Completion.local_day <= end
+            ).group_by(Completion.habit_id, bucket_start)
+        )
+        for habit_id, day, total_value, days_logged, days_completed in rows:
+            at = row_of[habit_id], column_of[date.fromisoformat(day)]
+            totals[at], logged[at], completed[at] = total_value, days_logged, days_completed
+
+    # nothing is expected of days that haven't happened yet
+    last_due = min(end, today)
+    for row, habit in enumerate(habits):
+        rule = compile_rule(habit)
+        for column, bucket_start in enumerate(starts):
+            bucket_end = starts[column + 1] - timedelta(days=1) if column + 1 < len(starts) else end
+            lo, hi = max(bucket_start, start), min(bucket_end, last_due)
+            if lo <= hi:
+                expected[row, column] = rule.count_due(lo, hi)
+
+    # binary habits have no values, their total is the days they were done
+    binary = np.array([habit.type == HabitType.BINARY for habit in habits], dtype=bool)
+    totals[binary] = logged[binary]
+
+    days = (end - start).days + 1
+    habit_expected = expected.sum(axis=1)
+    habit_completed = completed.sum(axis=1)
+    habit_totals = totals.sum(axis=1)
+    records = load_streaks(db, habits)
+    rates = [
+        round(min(1.0, done / due), 4) if due else None  # off-schedule days can count too, hence the cap
+        for done, due in zip(habit_completed.tolist(), habit_expected.tolist())
+    ]
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "bucket": bucket,
+        "habits": {
+            "id": [habit.id for habit in habits],
+            "name": [habit.name for habit in habits],
+            "type": [habit.type.value for habit in habits],
+            "expected": habit_expected.tolist(),
+            "completed": habit_completed.tolist(),
+            "completion_rate": rates,
+            "total": habit_totals.tolist(),
+            "weekly_average": np.round(habit_totals * 7 / days, 2).tolist(),
+            "monthly_average": np.round(habit_totals * DAYS_PER_MONTH / days, 2).tolist(),
+            "current_streak": [streak_from_record(habit, records[habit.id], today) for habit in habits],
+            "best_streak": [records[habit.id].longest_streak for habit in habits],
+        },
+        "buckets": {
+            "start": [bucket_start.isoformat() for bucket_start in starts],
+            "expected": expected.tolist(),
+            "completed": completed.tolist(),
+            "total": totals.tolist(),
+        },
+    }
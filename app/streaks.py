@@ -0,0 +1,304 @@
+# app/streaks.py
+# streak math lives here so the streak endpoint and the today summary count the same way
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import daybits, models
+from app.database import is_read_only
+from app.recurrence import compile_rule
+from app.schemas import HabitType
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import sys
+
+from datetime import date
+
+
+# This thing counts the expected day to get us our STREAKSSS (2 DAYS NO LEETCODE)
+# = the habit's previous due day by its own schedule, None if it has none before `day`
+def get_expected_date(habit: models.Habit, day: date) -> Optional[date]:
+    return compile_rule(habit).previous_due(day)
+
+
+# does a day with this summed value count towards the streak?
+def day_qualifies(habit: models.Habit, total_value: int) -> bool:
+    if habit.type == HabitType.COUNTABLE:
+        return total_value >= (habit.target or 1)
+    elif habit.type == HabitType.LIMIT:
+        return total_value < (habit.target or 0)
+    return True  # binary: any completion is a completion
+
+
+# (day, summed value) pairs per habit, newest day first, one range scan over habit_completions
+# (one row per habit per day) on its (habit, user, day) key
+def daily_totals(db: Session, user_id: int, habit_ids: Iterable[int]) -> Dict[int, List[Tuple[date, int]]]:
+    habit_ids = list(habit_ids)
+    totals: Dict[int, List[Tuple[date, int]]] = {habit_id: [] for habit_id in habit_ids}
+    if not habit_ids:
+        return totals
+
+    rows = db.query(
+        models.HabitCompletion.habit_id,
+        models.HabitCompletion.local_day,
+        models.HabitCompletion.value,
+    ).filter(
+        models.HabitCompletion.habit_id.in_(habit_ids),
+        models.HabitCompletion.user_id == user_id
+    ).order_by(
+        models.HabitCompletion.habit_id, models.HabitCompletion.local_day.desc()
+    ).all()
+
+    for habit_id, day, value in rows:
+        totals[habit_id].append((day, value or 0))
+    return totals
+
+
+# walks back from today over the per-day totals (newest first) and counts the unbroken run
+def compute_streak(habit: models.Habit, day_totals: List[Tuple[date, int]], today: date) -> int:
+    current_date = today
+    streak = 0
+
+    for day, total_value in day_totals:
+        if habit.type in ("countable", "limit") and not day_qualifies(habit, total_value):
+            break  # days not completed
+        # binary
+        if day == current_date:
+            streak += 1
+        else:
+            expected = get_expected_date(habit, current_date)
+            if day != expected:
+                break
+            streak += 1
+            current_date = expected
+
+    return streak
+
+
+# --- persisted streak state (models.HabitStreak) ---
+
+# length of the run ending on `day`, given the run ending on the completion day right before it
+def _run_length(habit: models.Habit, day: date, total_value: int, prev_period: Optional[date], prev_streak: int) -> int:
+    if not day_qualifies(habit, total_value):
+        return 0
+    if prev_streak and prev_period == get_expected_date(habit, day):
+        return prev_streak + 1
+    return 1
+
+
+# Recomputes the streak fields from the packed history (app.daybits), _run_length over every
+# logged day at once: a logged day continues the run when it counts, the day before it counted
+# and that day was this one's previous due day
+def _scan(db: Session, habit: models.Habit) -> dict:
+    fields = {
+        "user_id": habit.user_id,
+        "last_period": None,
+        "current_streak": 0,
+        "prev_period": None,
+        "prev_streak": 0,
+        "longest_streak": 0,
+    }
+    history = daybits.habit_history(db, habit.id)
+    if history is None:
+        return fields
+
+    first, logged, values = history
+    offsets = np.flatnonzero(logged)
+    if not len(offsets):
+        return fields
+    days = offsets + first.toordinal()  # ordinals of the logged days, oldest first
+    counts = daybits.qualifying(habit, logged, values)[offsets]
+
+    # previous due day of every logged day: the last due day before it (-1 = none)
+    rule = compile_rule(habit)
+    due = np.array([day.toordinal() for day in rule.due_days(rule.start, date.fromordinal(int(days[-1])))], dtype=np.int64)
+    before = np.searchsorted(due, days, side="left") - 1
+    previous_due = np.where(before >= 0, due[np.maximum(before, 0)] if len(due) else -1, -1)
+
+    continues = np.zeros(len(days), dtype=bool)
+    continues[1:] = counts[1:] & counts[:-1] & (days[:-1] == previous_due[1:])
+    positions = np.arange(len(days))
+    run_start = np.maximum.accumulate(np.where(counts & ~continues, positions, 0))
+    runs = np.where(counts, positions - run_start + 1, 0)
+
+    fields["last_period"] = date.fromordinal(int(days[-1]))
+    fields["current_streak"] = int(runs[-1])
+    if len(days) > 1:
+        fields["prev_period"] = date.fromordinal(int(days[-2]))
+        fields["prev_streak"] = int(runs[-2])
+    fields["longest_streak"] = int(runs.max())
+    return fields
+
+
+def rebuild_streak(db: Session, habit: models.Habit) -> models.HabitStreak:
+    fields = _scan(db, habit)
+    record = db.get(models.HabitStreak, habit.id)
+    if record is None:
+        record = models.HabitStreak(habit_id=habit.id)
+        db.add(record)
+
+    for key, value in fields.items():
+        setattr(record, key, value)
+    return record
+
+
+# the record a brand new habit starts with (nothing logged yet)
+def new_streak(habit: models.Habit) -> models.HabitStreak:
+    return models.HabitStreak(
+        habit_id=habit.id,
+        user_id=habit.user_id,
+        last_period=None,
+        current_streak=0,
+        prev_period=None,
+        prev_streak=0,
+        longest_streak=0,
+    )
+
+
+# Called by every completion write (before commit) with the day that changed.
+# Writes on the latest day (or a newer one) are O(1), anything older falls back to a rebuild.
+# `totals` is the day's (row count, summed value) when the caller already knows it.
+def update_streak(db: Session, habit: models.Habit, day: date, totals: Optional[Tuple[int, int]] = None) -> models.HabitStreak:
+    record = db.get(models.HabitStreak, habit.id)
+    if record is None:
+        return rebuild_streak(db, habit)
+
+    count, total_value = totals if totals is not None else daybits.day_totals(db, habit.id, habit.user_id, day)
+    old_streak = record.current_streak
+
+    if record.last_period is None or day > record.last_period:
+        if count == 0:
+            return record  # nothing there, nothing changes
+        run = _run_length(habit, day, total_value, record.last_period, record.current_streak)
+        record.prev_period, record.prev_streak = record.last_period, record.current_streak
+        record.last_period, record.current_streak = day, run
+
+    elif day == record.last_period:
+        if record.prev_streak is None:
+            return rebuild_streak(db, habit)  # we forgot what came before, so start over
+        if count == 0:
+            # latest day got wiped (binary untoggle), step back to the day before it
+            record.last_period, record.current_streak = record.prev_period, record.prev_streak
+            record.prev_period, record.prev_streak = None, None
+        else:
+            record.current_streak = _run_length(habit, day, total_value, record.prev_period, record.prev_streak)
+
+    else:
+        return rebuild_streak(db, habit)  # backfill somewhere in the past
+
+    # the longest run might have just been undone, only a rebuild knows what's left
+    if record.current_streak < old_streak and old_streak >= record.longest_streak:
+        return rebuild_streak(db, habit)
+
+    record.longest_streak = max(record.longest_streak, record.current_streak)
+    return record
+
+
+# The lazy fix-up for period rollovers: the record keeps the run as of its last period
+# and it's only alive if that period is today or the one right before today
+def streak_from_record(habit: models.Habit, record: Optional[models.HabitStreak], today: date) -> int:
+    if record is None or not record.current_streak:
+        return 0
+    if record.last_period == today:
+        return record.current_streak
+    if record.last_period == get_expected_date(habit, today):
+        return record.current_streak
+    return 0
+
+
+# streak records for a bunch of habits in one query, missing ones are built on the spot
+# (and stored, unless this is a read-only session)
+def load_streaks(db: Session, habits: List[models.Habit]) -> Dict[int, models.HabitStreak]:
+    if not habits:
+        return {}
+
+    records = db.query(models.HabitStreak).filter(
+        models.HabitStreak.habit_id.in_([habit.id for habit in habits])
+    ).all()
+    records = {record.habit_id: record for record in records}
+
+    missing = [habit for habit in habits if habit.id not in records]
+    if missing and is_read_only(db):
+        # can't store them from a read session, the next completion write will
+        for habit in missing:
+            records[habit.id] = models.HabitStreak(habit_id=habit.id, **_scan(db, habit))
+        return records
+
+    for habit in missing:
+        records[habit.id] = rebuild_streak(db, habit)
+    if missing:
+        db.commit()
+
+    return records
+
+
+# python -m app.streaks rebuild [--verify]
+def main(argv=None) -> int:
+    from app.database import shards
+    from app.localtime import local_today
+    from app.migrations import migrate
+
+    parser = argparse.ArgumentParser(description="Rebuild (or verify) the stored habit streaks from raw completions")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--verify", action="store_true", help="only compare, don't write anything")
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    mismatches = missing = 0
+    for shard in shards:
+        migrate(shard.engine)
+        db = shard.SessionLocal()
+        try:
+            query = db.query(models.Habit).filter(models.Habit.deleted_at.is_(None))
+            if args.user_id is not None:
+                query = query.filter(models.Habit.user_id == args.user_id)
+
+            for habit in query.all():
+                today = local_today(db, habit.user_id)
+                stored = db.get(models.HabitStreak, habit.id)
+                if stored is None and args.verify:
+                    missing += 1  # never read or written yet, it gets built lazily
+                    continue
+                before = _record_values(stored)
+                stored_streak = streak_from_record(habit, stored, today)
+                fresh = rebuild_streak(db, habit)
+                history = daily_totals(db, habit.user_id, [habit.id])[habit.id]
+
+                problems = []
+                if args.verify and not _same_record(before, _record_values(fresh)):
+                    problems.append(f"stored {before} != rebuilt {_record_values(fresh)}")
+                scratch = compute_streak(habit, history, today)
+                record_streak = stored_streak if args.verify else streak_from_record(habit, fresh, today)
+                if record_streak != scratch:
+                    problems.append(f"record says {record_streak}, from scratch {scratch}")
+
+                if problems:
+                    mismatches += 1
+                    print(f"habit {habit.id} (user {habit.user_id}): " + "; ".join(problems))
+
+            if args.verify:
+                db.rollback()
+            else:
+                db.commit()
+        finally:
+            db.close()
+
+    print(f"{'verified' if args.verify else 'rebuilt'} streaks, {mismatches} mismatch(es), {missing} not built yet")
+    return 1 if mismatches else 0
+
+
+def _record_values(record: Optional[models.HabitStreak]):
+    if record is None:
+        return None
+    return (record.last_period, record.current_streak, record.longest_streak, record.prev_period, record.prev_streak)
+
+
+# prev_* only has to match when the stored record still knows it (prev_streak NULL = unknown)
+def _same_record(stored, rebuilt) -> bool:
+    if stored[4] is None:
+        return stored[:3] == rebuilt[:3]
+    return stored == rebuilt
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# app/summary.py
+# Builds the today summary with a fixed number of grouped queries (4: the user's timezone, habits,
+# today's completions and the stored streaks), no matter how many habits the user has
+from sqlalchemy.orm import Session
+
+from app import models
+from app.localtime import local_today
+from app.recurrence import compile_rule
+from app.schemas import HabitType
+from app.streaks import load_streaks, streak_from_record
+
+from typing import Dict, List, Tuple
+
+from datetime import date
+
+
+def habits_due_on(habits: List[models.Habit], day: date) -> List[models.Habit]:
+    return [habit for habit in habits if compile_rule(habit).is_due(day)]
+
+
+# one query: row count + summed value per habit for the user's today. Completions are one row per
+# habit per day, so that's today's row, a lookup on the (habit, user, day) key per habit
+def _today_totals(db: Session, user_id: int, habit_ids: List[int], today: date) -> Dict[int, tuple]:
+    rows = db.query(
+        models.HabitCompletion.habit_id,
+        models.HabitCompletion.value,
+    ).filter(
+        models.HabitCompletion.habit_id.in_(habit_ids),
+        models.HabitCompletion.user_id == user_id,
+        models.HabitCompletion.local_day == today
+    ).all()
+
+    return {habit_id: (1, value or 0) for habit_id, value in rows}
+
+
+# same fields (and order) as schemas.Habit, without running pydantic per item
+def habit_payload(habit: models.Habit) -> dict:
+    return {
+        "id": habit.id,
+        "user_id": habit.user_id,
+        "name": habit.name,
+        "repeat_type": habit.repeat_type,
+        "start_date": habit.start_date,
+        "tracked": habit.tracked,
+        "type": habit.type,
+        "target": habit.target,
+        "weekdays": habit.weekdays,
+        "reminder_time": habit.reminder_time,
+    }
+
+
+def _summary_rows(due: List[models.Habit], today_totals: Dict[int, tuple], streaks: Dict[int, models.HabitStreak], today: date) -> List[dict]:
+    summary = []
+    for habit in due:
+        count, total_value = today_totals.get(habit.id, (0, 0))
+        completed_today = False
+
+        if habit.type == HabitType.BINARY:
+            total_value = 1
+            completed_today = count > 0
+
+        elif habit.type == HabitType.COUNTABLE:
+            completed_today = total_value >= (habit.target or 1)
+
+        elif habit.type == HabitType.LIMIT:
+            completed_today = total_value < (habit.target or 0)
+
+        summary.append({
+            "id": habit.id,
+            "name": habit.name,
+            "repeat_type": habit.repeat_type,
+            "type": habit.type,
+            "current_value": total_value,
+            "target": habit.target,
+            "completed_today": completed_today,
+            "streak": streak_from_record(habit, streaks[habit.id], today),
+        })
+
+    return summary
+
+
+def build_today_summary(user_id: int, db: Session) -> List[dict]:
+    today = local_today(db, user_id)
+
+    habits = db.query(models.Habit).filter(
+        models.Habit.tracked == True,
+        models.Habit.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
+    ).all()
+    habits = habits_due_on(habits, today)
+    if not habits:
+        return []
+
+    today_totals = _today_totals(db, user_id, [habit.id for habit in habits], today)
+    streaks = load_streaks(db, habits)
+    return _summary_rows(habits, today_totals, streaks, today)
+
+
+# Everything the today screen needs for first paint (habit list, today list, progress wheel, summary)
+# out of the same four queries the summary alone uses
+def build_bootstrap(user_id: int, db: Session) -> dict:
+    today = local_today(db, user_id)
+
+    habits = db.query(models.Habit).filter(
+        models.Habit.user_id == user_id,
+        models.Habit.deleted_at.is_(None)
+    ).all()
+    due = habits_due_on([habit for habit in habits if habit.tracked], today)
+
+    today_totals = _today_totals(db, user_id, [habit.id for habit in due], today) if due else {}
+    streaks = load_streaks(db, due)
+
+    logged = sum(1 for habit in due if today_totals.get(habit.id, (0, 0))[0] > 0)
+    return {
+        "habits": [habit_payload(habit) for habit in habits],
+        "today": [habit_payload(habit) for habit in due],
+        "progress": {"progress": logged / len(due) * 100 if due else 0.0},
+        "summary": _summary_rows(due, today_totals, streaks, today),
+    }
+
+
+# The summary rows of some of the user's habits, for the live updates (app.live): (today, rows of
+# the ones on today's list, ids of the ones that aren't (not due, untracked, deleted))
+def build_today_rows(user_id: int, habit_ids: List[int], db: Session) -> Tuple[date, List[dict], List[int]]:
+    today = local_today(db, user_id)
+
+    habits = db.query(models.Habit).filter(
+        models.Habit.id.in_(habit_ids),
+        models.Habit.user_id == user_id,
+        models.Habit.tracked == True,
+        models.Habit.deleted_at.is_(None)
+    ).all()
+    due = habits_due_on(habits, today)
+
+    today_totals = _today_totals(db, user_id, [habit.id for habit in due], today) if due else {}
+    rows = _summary_rows(due, today_totals, load_streaks(db, due), today)
+    on_list = {habit.id for habit in due}
+    return today, rows, sorted(habit_id for habit_id in habit_ids if habit_id not in on_list)
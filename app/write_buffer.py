@@ -0,0 +1,292 @@
+# app/write_buffer.py
+# Optional write-behind for countable/limit taps (HABITS_WRITE_BEHIND_MS > 0 turns it on).
+# The +/- buttons get tapped in bursts, so instead of a writer transaction per tap the taps for a
+# (user, habit, day) are folded together in memory and written every HABITS_WRITE_BEHIND_MS,
+# all pending days in one transaction.
+#
+# Folding is exact: a tap is value -> max(0, value + v), and any chain of those is still
+# value -> max(low, value + shift), so the whole burst is one UPDATE/upsert with the same
+# clamp-at-zero result the taps would have had one by one.
+# Any GET for a user flushes that user's pending taps first (read_your_taps), so reads never see
+# stale values, and the app's shutdown flushes everything that's left.
+# Once taps leave _pending they're written (or put back) by a task of their own, so cancelling
+# whoever waits for them (a request that went away, the timer at shutdown) can't drop them.
+from fastapi import Request
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import models, shards
+from app.db_async import run_write
+from app.events import user_data_changed
+from app.localtime import as_utc
+from app.logger import logger
+from app.daybits import set_day
+from app.streaks import update_streak
+
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import os
+
+from datetime import date, datetime, timezone
+
+
+FLUSH_INTERVAL_MS = int(os.getenv("HABITS_WRITE_BEHIND_MS", "0"))  # 0 = every tap is written right away
+SHUTDOWN_ATTEMPTS = 3  # final flushes tried before the leftover taps are logged as lost
+
+Key = Tuple[int, int, date]  # (user_id, habit_id, day)
+Completion = models.HabitCompletion
+
+
+# The day's row goes value -> max(low, coalesce(value, 0) + shift). With `insert_value` a missing
+# row is created with that value, without it a missing row stays missing (a minus tap on nothing).
+# Doesn't commit, updates the day's bitmap and the streak like every completion write
+def apply_to_day(
+    db: Session,
+    habit: models.Habit,
+    day: date,
+    low: int,
+    shift: int,
+    insert_value: Optional[int],
+    completed_at: Optional[datetime] = None,
+) -> Optional[models.HabitCompletion]:
+    new_value = func.max(low, func.coalesce(Completion.value, 0) + shift)
+
+    if insert_value is None:
+        stmt = update(Completion).where(
+            Completion.habit_id == habit.id,
+            Completion.user_id == habit.user_id,
+            Completion.local_day == day
+        ).values(value=new_value).returning(Completion)
+    else:
+        stmt = sqlite_insert(Completion).values(
+            habit_id=habit.id,
+            user_id=habit.user_id,
+            local_day=day,
+            completed_at=as_utc(completed_at) or datetime.now(timezone.utc),
+            value=insert_value,
+        ).on_conflict_do_update(
+            index_elements=[Completion.habit_id, Completion.user_id, Completion.local_day],
+            set_={"value": new_value},
+        ).returning(Completion)
+
+    completion = db.scalars(stmt.execution_options(populate_existing=True)).first()
+    if completion is None:
+        return None
+
+    set_day(db, habit.id, habit.user_id, day, total_value=completion.value)
+    update_streak(db, habit, day, totals=(1, completion.value))
+    return completion
+
+
+# a burst of taps on one day, folded
+class Taps:
+    __slots__ = ("low", "shift", "create_low", "create_shift", "completed_at")
+
+    def __init__(self):
+        # for a row that exists: value -> max(low, value + shift)
+        self.low, self.shift = 0, 0
+        # for a missing row: taps < 0 do nothing until the first one >= 0 creates it at 0 + value,
+        # from there on it's max(create_low, 0 + create_shift). None = no such tap yet
+        self.create_low: Optional[int] = None
+        self.create_shift: Optional[int] = None
+        self.completed_at: Optional[datetime] = None
+
+    def add(self, value: int, completed_at: Optional[datetime]):
+        self.low, self.shift = max(0, self.low + value), self.shift + value
+        if self.create_shift is not None:
+            self.create_low, self.create_shift = max(0, self.create_low + value), self.create_shift + value
+        elif value >= 0:
+            self.create_low, self.create_shift = 0, value
+            self.completed_at = completed_at
+
+    # these taps followed by `later` (used to put a failed flush back in front of newer taps)
+    def then(self, later: "Taps") -> "Taps":
+        combined = Taps()
+        combined.low, combined.shift = max(later.low, self.low + later.shift), self.shift + later.shift
+        if self.create_shift is not None:
+            combined.create_low = max(later.low, self.create_low + later.shift)
+            combined.create_shift = self.create_shift + later.shift
+            combined.completed_at = self.completed_at
+        else:
+            combined.create_low, combined.create_shift = later.create_low, later.create_shift
+            combined.completed_at = later.completed_at
+        return combined
+
+    # what the taps make of a row with `value` (None = no row)
+    def value_after(self, value: Optional[int]) -> Optional[int]:
+        if value is not None:
+            return max(self.low, value + self.shift)
+        if self.create_shift is None:
+            return None
+        return max(self.create_low, self.create_shift)
+
+    def write(self, db: Session, habit: models.Habit, day: date) -> Optional[models.HabitCompletion]:
+        insert_value = None if self.create_shift is None else max(self.create_low, self.create_shift)
+        return apply_to_day(db, habit, day, self.low, self.shift, insert_value, self.completed_at)
+
+
+def _write_batch(db: Session, batch: Dict[Key, Taps]) -> List[Key]:
+    habit_ids = {habit_id for _, habit_id, _ in batch}
+    habits = {
+        habit.id: habit
+        for habit in db.query(models.Habit).filter(models.Habit.id.in_(habit_ids)).all()
+    }
+
+    changed = []
+    for (user_id, habit_id, day), taps in batch.items():
+        habit = habits.get(habit_id)
+        if habit is None or habit.user_id != user_id or habit.deleted_at is not None:
+            continue  # deleted since, the taps go with it
+        taps.write(db, habit, day)
+        changed.append((user_id, habit_id, day))
+    db.commit()
+    return changed
+
+
+class WriteBuffer:
+    # only ever touched from the event loop, the writes themselves go to the db writer thread
+    def __init__(self, interval_ms: int = FLUSH_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._pending: Dict[Key, Taps] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None  # created in start(), on the loop it runs on
+        self._writes: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()  # one flush at a time (FIFO), so taps for a key land in order
+        self._flushing = 0  # batches taken out of _pending and not written yet
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.flushes = 0  # bumped whenever taps leave the buffer for the database
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def pending(self, user_id: int, habit_id: int, day: date) -> Optional[Taps]:
+        return self._pending.get((user_id, habit_id, day))
+
+    def add(self, user_id: int, habit_id: int, day: date, value: int, completed_at: Optional[datetime]):
+        taps = self._pending.get((user_id, habit_id, day))
+        if taps is None:
+            taps = self._pending[(user_id, habit_id, day)] = Taps()
+        taps.add(value, completed_at)
+
+    # Waits until every taken batch is written. For reading the rows the buffer's taps apply to:
+    # if self.flushes is still the same after the read, the read and the buffer agree
+    async def settled(self) -> int:
+        await self._idle.wait()
+        return self.flushes
+
+    def _put_back(self, part: Dict[Key, Taps]):
+        for key, taps in part.items():
+            newer = self._pending.get(key)
+            self._pending[key] = taps.then(newer) if newer is not None else taps
+
+    async def _flush(self, batch: Dict[Key, Taps]):
+        self.flushes += 1
+        self._flushing += 1
+        self._idle.clear()
+        write = asyncio.get_running_loop().create_task(self._write(batch))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        await asyncio.shield(write)
+
+    async def _write(self, batch: Dict[Key, Taps]):
+        try:
+            async with self._lock:
+                # one transaction per shard (app.shards), a shard that fails doesn't hold up the others
+                by_shard: Dict[int, Dict[Key, Taps]] = {}
+                for key, taps in batch.items():
+                    by_shard.setdefault(shards.shard_of(key[0]), {})[key] = taps
+
+                changed, error = [], None
+                parts = list(by_shard.items())
+                for number, (index, part) in enumerate(parts):
+                    try:
+                        with shards.using(index):
+                            changed += await run_write(_write_batch, part)
+                    except asyncio.CancelledError:
+                        # the loop is going away: whatever wasn't started yet goes back
+                        for _, rest in parts[number + 1:]:
+                            self._put_back(rest)
+                        raise
+                    except Exception as e:
+                        logger.exception("write-behind flush of %d days failed, retrying with the next one", len(part))
+                        self._put_back(part)
+                        error = e
+
+                touched: Dict[Tuple[int, date], List[int]] = {}
+                for user_id, habit_id, day in changed:
+                    touched.setdefault((user_id, day), []).append(habit_id)
+                for (user_id, day), habit_ids in touched.items():
+                    user_data_changed(user_id, day, habit_ids)
+                if error is not None:
+                    raise error
+        finally:
+            self._flushing -= 1
+            if not self._flushing:
+                self._idle.set()
+
+    async def flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            await self._flush(batch)
+        else:
+            await self._idle.wait()
+
+    async def flush_user(self, user_id: int):
+        batch = {key: taps for key, taps in self._pending.items() if key[0] == user_id}
+        for key in batch:
+            del self._pending[key]
+        if batch:
+            await self._flush(batch)
+        else:
+            await self._idle.wait()  # could be this user's taps on their way in
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                pass  # logged in _write, the taps are back in the buffer
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._stop = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # the timer finishes the flush it's in (and does one more) instead of being cancelled mid-batch,
+    # then whatever is left gets a few tries
+    async def stop(self):
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+        for attempt in range(SHUTDOWN_ATTEMPTS):
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(0.1 * (attempt + 1))
+            if not self._pending:
+                return
+        for (user_id, habit_id, day), taps in self._pending.items():
+            logger.error(
+                "write-behind taps lost at shutdown: user %s habit %s day %s (low %s, shift %s, create %s/%s)",
+                user_id, habit_id, day, taps.low, taps.shift, taps.create_low, taps.create_shift,
+            )
+
+
+tap_buffer = WriteBuffer()
+
+
+# router dependency: a GET for a user sees their buffered taps (they're written first)
+async def read_your_taps(request: Request):
+    if not tap_buffer.enabled or request.method != "GET":
+        return
+    user_id = request.query_params.get("user_id")
+    if user_id is not None and user_id.isdigit():
+        await tap_buffer.flush_user(int(user_id))  # also waits out a flush that already took them
@@ -0,0 +1,2 @@
+# benchmarks: synthetic data + an in-process load driver for every API route
+# usage: python -m benchmarks run --output result.json, then python -m benchmarks compare old.json new.json
@@ -0,0 +1,186 @@
+# python -m benchmarks {generate,run,compare,plans,live} --help
+#
+# HABITS_DATABASE_URL has to be set before anything under app/ is imported (app.database reads it
+# at import), so every app import in here happens inside the commands.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from datetime import datetime, timezone
+
+
+def _point_app_at(args):
+    os.environ["HABITS_DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    os.environ["HABITS_SHARDS"] = str(args.shards)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _generate(args) -> dict:
+    _point_app_at(args)
+    from app.database import shards
+    from benchmarks.datagen import generate
+
+    return generate([shard.engine for shard in shards], users=args.users, habits_per_user=args.habits, years=args.years, hit_rate=args.hit_rate, seed=args.seed)
+
+
+def cmd_generate(args) -> int:
+    print(json.dumps(_generate(args), indent=2))
+    return 0
+
+
+def cmd_run(args) -> int:
+    dataset = _generate(args) if not args.reuse else {"reused": args.db}
+    _point_app_at(args)
+    from benchmarks.runner import run_sync
+
+    result = run_sync(iterations=args.iterations, only=args.only, cold=args.cold, seed=args.seed, concurrency=args.concurrency, skip=args.skip)
+    result["meta"] = {
+        "commit": _git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "cold": args.cold,
+        "dataset": dataset,
+    }
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+# exit code 1 if any route got slower (p95) or chattier (sql/request) than the threshold allows
+def cmd_compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["routes"]
+    with open(args.candidate) as f:
+        candidate = json.load(f)["routes"]
+
+    regressions = 0
+    print(f"{'route':<45} {'p95 ms':>18} {'sql/req':>14} {'peak KiB':>20}")
+    for route in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[route], candidate[route]
+        slower = new["p95_ms"] > old["p95_ms"] * (1 + args.threshold)
+        chattier = new["sql_per_request"] > old["sql_per_request"]
+        regressions += slower or chattier
+        flag = "  <-- regression" if slower or chattier else ""
+        print(
+            f"{route:<45} {old['p95_ms']:>8.2f} -> {new['p95_ms']:<8.2f}"
+            f"{old['sql_per_request']:>6.1f} -> {new['sql_per_request']:<6.1f}"
+            f"{old['peak_memory_kib']:>9.0f} -> {new['peak_memory_kib']:<9.0f}{flag}"
+        )
+    for route in sorted(baseline.keys() ^ candidate.keys()):
+        print(f"{route:<45} only in {'baseline' if route in baseline else 'candidate'}")
+
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+# exit code 1 if any statement a route runs reads a whole table (EXPLAIN QUERY PLAN)
+def cmd_plans(args) -> int:
+    if not args.reuse:
+        _generate(args)
+    _point_app_at(args)
+    import asyncio
+    from benchmarks.plans import collect
+
+    report = asyncio.run(collect(seed=args.seed, only=args.only))
+    failures = 0
+    for route, statements in sorted(report.items()):
+        scans = [(statement, plan) for statement, plan, full in statements if full]
+        print(f"{route:<45} {len(statements):>3} statement(s){'  <-- full scan' if scans else ''}")
+        for statement, plan in scans if not args.verbose else [(s, p) for s, p, _ in statements]:
+            print(f"    {' '.join(statement.split())}")
+            for line in plan:
+                print(f"      {line}")
+        failures += len(scans)
+
+    print(f"{failures} statement(s) with a full table scan")
+    return 1 if failures else 0
+
+
+# live updates under load: idle WebSockets per worker, fan-out latency, slow clients dropped
+def cmd_live(args) -> int:
+    if not args.reuse:
+        _generate(args)
+    _point_app_at(args)
+    os.environ.setdefault("HABITS_LIVE_SEND_TIMEOUT", str(args.send_timeout))
+    from benchmarks.live import run_sync
+
+    result = run_sync(connections=args.connections, rounds=args.rounds, stuck=args.stuck, seed=args.seed)
+    print(json.dumps(result, indent=2))
+    backpressure = result["backpressure"]
+    return 0 if backpressure["dropped"] == backpressure["stuck"] and not result["left_connected"] else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def dataset_args(p):
+        p.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "habits-bench.db"))
+        p.add_argument("--users", type=int, default=50)
+        p.add_argument("--habits", type=int, default=15, help="habits per user, cycling through every type x repeat combination")
+        p.add_argument("--years", type=float, default=1.0)
+        p.add_argument("--hit-rate", type=float, default=0.8, help="chance a due day gets a completion")
+        p.add_argument("--seed", type=int, default=42)
+        p.add_argument("--shards", type=int, default=1, help="HABITS_SHARDS: database files the users are spread over")
+
+    generate = commands.add_parser("generate", help="only build the synthetic database")
+    dataset_args(generate)
+    generate.set_defaults(func=cmd_generate)
+
+    run = commands.add_parser("run", help="build the database (unless --reuse) and benchmark every route")
+    dataset_args(run)
+    run.add_argument("--reuse", action="store_true", help="benchmark the existing --db as is")
+    run.add_argument("--iterations", type=int, default=200, help="requests per route")
+    run.add_argument("--only", nargs="*", help="only routes containing one of these strings")
+    run.add_argument("--skip", nargs="*", help="leave out routes containing one of these strings")
+    run.add_argument("--concurrency", type=int, default=1, help="clients sending requests to a route at the same time")
+    run.add_argument("--cold", action="store_true", help="clear the in-process caches before every request")
+    run.add_argument("--output", help="write the JSON here instead of stdout")
+    run.set_defaults(func=cmd_run)
+
+    compare = commands.add_parser("compare", help="diff two run outputs")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed p95 slowdown (0.10 = 10%%)")
+    compare.set_defaults(func=cmd_compare)
+
+    plans = commands.add_parser("plans", help="fail if a route's SQL does a full table scan (EXPLAIN QUERY PLAN)")
+    dataset_args(plans)
+    plans.add_argument("--reuse", action="store_true", help="check against the existing --db as is")
+    plans.add_argument("--only", nargs="*", help="only routes containing one of these strings")
+    plans.add_argument("--verbose", action="store_true", help="print every statement's plan, not just the failing ones")
+    plans.set_defaults(func=cmd_plans)
+
+    live = commands.add_parser("live", help="hold many idle /api/live connections, time fan-out, check slow clients get dropped")
+    dataset_args(live)
+    live.add_argument("--reuse", action="store_true", help="use the existing --db as is")
+    live.add_argument("--connections", type=int, default=20_000)
+    live.add_argument("--rounds", type=int, default=50, help="completions timed from write to every connection of the user")
+    live.add_argument("--stuck", type=int, default=10, help="connections that never finish a send")
+    live.add_argument("--send-timeout", type=float, default=1.0, help="HABITS_LIVE_SEND_TIMEOUT for the run (seconds)")
+    live.set_defaults(func=cmd_live)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
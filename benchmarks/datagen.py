@@ -0,0 +1,119 @@
+# benchmarks/datagen.py
+# Synthetic habits.db for the benchmarks: N users, every HabitType x RepeatType combination,
+# years of completions on (mostly) the habit's due days. Same seed -> same database. With more than
+# one engine (HABITS_SHARDS) every user goes to their shard, habit ids from that shard's range.
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.migrations import migrate
+from app.recurrence import compile_rule
+from app.daybits import rebuild
+from app.schemas import HabitType, RepeatType
+from app.shards import ID_RANGE, jump_hash
+from app.streaks import rebuild_streak
+
+from typing import List, Tuple
+import itertools
+import random
+
+from datetime import date, datetime, time, timedelta, timezone
+
+
+COMBINATIONS: List[Tuple[HabitType, RepeatType]] = list(itertools.product(HabitType, RepeatType))
+BATCH = 5_000
+
+
+def _habit_rows(rnd: random.Random, user_id: int, habits_per_user: int, first_day: date) -> List[dict]:
+    rows = []
+    for index in range(habits_per_user):
+        habit_type, repeat_type = COMBINATIONS[index % len(COMBINATIONS)]
+        rows.append({
+            "user_id": user_id,
+            "name": f"{habit_type.value} {repeat_type.value} #{index}",
+            "tracked": rnd.random() > 0.1,
+            "repeat_type": repeat_type,
+            "start_date": first_day + timedelta(days=rnd.randint(0, 30)),
+            "type": habit_type,
+            "target": None if habit_type == HabitType.BINARY else rnd.randint(1, 8),
+            "weekdays": rnd.randint(1, 127) if repeat_type == RepeatType.CUSTOM else None,
+        })
+    return rows
+
+
+def _completion_rows(rnd: random.Random, habit: models.Habit, today: date, hit_rate: float):
+    for day in compile_rule(habit).due_days(habit.start_date, today):
+        if rnd.random() > hit_rate:
+            continue
+        completed_at = datetime.combine(day, time(rnd.randint(6, 22), rnd.randint(0, 59)), tzinfo=timezone.utc)
+        value = None
+        if habit.type != HabitType.BINARY:
+            value = rnd.randint(0, int((habit.target or 1) * 1.5) + 1)
+        yield {
+            "user_id": habit.user_id,
+            "habit_id": habit.id,
+            "completed_at": completed_at,
+            "local_day": day,
+            "value": value,
+        }
+
+
+def generate(
+    engines: list,
+    users: int = 50,
+    habits_per_user: int = len(COMBINATIONS),
+    years: float = 1.0,
+    hit_rate: float = 0.8,
+    seed: int = 42,
+) -> dict:
+    rnd = random.Random(seed)
+    today = datetime.now(timezone.utc).date()
+    first_day = today - timedelta(days=int(years * 365))
+
+    habit_rows = [[] for _ in engines]
+    for user_id in range(1, users + 1):
+        index = jump_hash(user_id, len(engines))
+        habit_rows[index] += _habit_rows(rnd, user_id, habits_per_user, first_day)
+
+    habits_total = completions = 0
+    for index, engine in enumerate(engines):
+        models.Base.metadata.drop_all(bind=engine)
+        migrate(engine)
+
+        with Session(engine) as db:
+            for number, row in enumerate(habit_rows[index], start=1):
+                row["id"] = index * ID_RANGE + number
+            if habit_rows[index]:
+                db.execute(insert(models.Habit), habit_rows[index])
+                db.commit()
+
+            habits = db.query(models.Habit).order_by(models.Habit.id).all()
+            habits_total += len(habits)
+            batch = []
+            for habit in habits:
+                for row in _completion_rows(rnd, habit, today, hit_rate):
+                    batch.append(row)
+                    if len(batch) >= BATCH:
+                        db.execute(insert(models.HabitCompletion), batch)
+                        completions += len(batch)
+                        batch = []
+            if batch:
+                db.execute(insert(models.HabitCompletion), batch)
+                completions += len(batch)
+
+            # the app keeps these current on every write, so start from a steady state
+            rebuild(db)
+            for habit in habits:
+                rebuild_streak(db, habit)
+            db.commit()
+
+    return {
+        "users": users,
+        "habits_per_user": habits_per_user,
+        "years": years,
+        "hit_rate": hit_rate,
+        "seed": seed,
+        "shards": len(engines),
+        "habits": habits_total,
+        "completions": completions,
+    }
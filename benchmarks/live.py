@@ -0,0 +1,159 @@
+# benchmarks/live.py
+# Load check for the live updates (app/live.py): opens `connections` WebSockets to /api/live on the
+# app in-process (plain ASGI messages, no sockets, so what's measured is the app's side of a
+# connection: route coroutine, Starlette WebSocket, hub subscriber), spread over the dataset's
+# users, then
+#   - memory per idle connection (tracemalloc) and how long connecting them all took
+#   - fan-out: a completion for a user, until every one of that user's connections has the row
+#   - backpressure: some connections never finish a send; they have to be dropped after
+#     SEND_TIMEOUT without holding up anyone else
+import httpx
+
+from typing import Dict, List, Optional
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from benchmarks.runner import _load_habits, percentile
+
+
+class Connection:
+    # a client as the app sees it: the ASGI receive/send pair of one websocket
+    __slots__ = ("inbox", "messages", "received", "accepted", "closed", "stuck", "task")
+
+    def __init__(self, stuck: bool = False):
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.messages = 0
+        self.received = asyncio.Event()
+        self.accepted = asyncio.Event()
+        self.closed = False
+        self.stuck = stuck  # never finishes a send (a client that stopped reading)
+        self.task: Optional[asyncio.Task] = None
+
+    async def receive(self) -> dict:
+        return await self.inbox.get()
+
+    async def send(self, message: dict):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.send":
+            if self.stuck:
+                await asyncio.Event().wait()
+            self.messages += 1
+            self.received.set()
+        elif message["type"] == "websocket.close":
+            self.closed = True
+
+    def open(self, app, user_id: int):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/api/live",
+            "raw_path": b"/api/live",
+            "root_path": "",
+            "query_string": f"user_id={user_id}".encode(),
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.get_running_loop().create_task(app(scope, self.receive, self.send))
+
+    def disconnect(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+
+async def run(connections: int = 20_000, rounds: int = 50, stuck: int = 10, seed: int = 42) -> dict:
+    from app import live
+    from app.main import app
+
+    rnd = random.Random(seed)
+    async with app.router.lifespan_context(app):
+        habits_by_user = _load_habits()
+        users = sorted(habits_by_user)
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        by_user: Dict[int, List[Connection]] = {}
+        for number in range(connections):
+            user_id = users[number % len(users)]
+            connection = Connection()
+            connection.open(app, user_id)
+            by_user.setdefault(user_id, []).append(connection)
+        everyone = [connection for each in by_user.values() for connection in each]
+        await asyncio.gather(*(connection.accepted.wait() for connection in everyone))
+        connect_s = time.perf_counter() - started
+        gc.collect()
+        per_connection = (tracemalloc.get_traced_memory()[0] - before) / connections
+        tracemalloc.stop()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def complete(user_id: int) -> httpx.Response:
+                habit = rnd.choice(habits_by_user[user_id])
+                return await client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": user_id, "value": 1})
+
+            # fan-out: from sending the write to the last of the user's connections having it
+            fan_out = []
+            for _ in range(rounds):
+                user_id = rnd.choice(users)
+                for connection in by_user[user_id]:
+                    connection.received.clear()
+                started = time.perf_counter()
+                await complete(user_id)
+                await asyncio.gather(*(connection.received.wait() for connection in by_user[user_id]))
+                fan_out.append((time.perf_counter() - started) * 1000)
+            fan_out.sort()
+
+            # backpressure: stuck connections next to healthy ones of the same user
+            user_id = users[0]
+            stuck_connections = [Connection(stuck=True) for _ in range(stuck)]
+            for connection in stuck_connections:
+                connection.open(app, user_id)
+            await asyncio.gather(*(connection.accepted.wait() for connection in stuck_connections))
+            dropped_before = live.hub.dropped
+            started = time.perf_counter()
+            for connection in by_user[user_id]:
+                connection.received.clear()
+            await complete(user_id)
+            await asyncio.gather(*(connection.received.wait() for connection in by_user[user_id]))
+            healthy_ms = (time.perf_counter() - started) * 1000
+            for _ in range(5):
+                await complete(user_id)  # piles up behind the stuck sends, conflated
+            while live.hub.dropped - dropped_before < stuck and time.perf_counter() - started < live.SEND_TIMEOUT * 3:
+                await asyncio.sleep(0.05)
+            dropped_s = time.perf_counter() - started
+
+        for connection in everyone + stuck_connections:
+            connection.disconnect()
+        await asyncio.gather(*(connection.task for connection in everyone + stuck_connections), return_exceptions=True)
+
+    return {
+        "connections": connections,
+        "users": len(by_user),
+        "connect_s": round(connect_s, 2),
+        "memory_per_connection_kib": round(per_connection / 1024, 2),
+        "fan_out": {
+            "connections_per_user": round(connections / len(by_user), 1),
+            "p50_ms": round(percentile(fan_out, 50), 2),
+            "p95_ms": round(percentile(fan_out, 95), 2),
+        },
+        "backpressure": {
+            "stuck": stuck,
+            "dropped": live.hub.dropped - dropped_before,
+            "healthy_delivered_ms": round(healthy_ms, 2),
+            "dropped_after_s": round(dropped_s, 2),
+            "send_timeout_s": live.SEND_TIMEOUT,
+        },
+        "left_connected": live.hub.connections,
+    }
+
+
+def run_sync(**kwargs) -> dict:
+    return asyncio.run(run(**kwargs))
@@ -0,0 +1,93 @@
+# benchmarks/plans.py
+# Query plan check: sends every route scenario a few times, records each distinct SQL statement the
+# app runs for it and asks SQLite for its EXPLAIN QUERY PLAN. A statement that reads a whole table
+# ("SCAN <table>", with or without an index to walk it in order) fails the check, so a query that
+# stops matching its index shows up here before it shows up in production latency.
+import httpx
+from sqlalchemy import event
+
+from typing import Dict, List, Optional, Tuple
+from contextvars import ContextVar
+import random
+import re
+
+from benchmarks.runner import Context, _load_habits, _scenarios
+
+
+SAMPLES = 5  # requests per route, some routes take different queries depending on the data
+PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# "SCAN habits", "SCAN habit_completions USING INDEX ix_...": the whole table, one way or another.
+# SCAN over a subquery / CTE / constant row is only as big as what's in it
+_FULL_SCAN = re.compile(r"^SCAN (?!\(|CONSTANT ROW)(\w+)")
+# named subqueries ("SELECT count(*) FROM (...) AS anon_1") show up as a CO-ROUTINE / MATERIALIZE first
+_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+# a request's own temp table (localtime.set_timezone) is gone by the time the plans are asked for,
+# and only ever holds that request's rows
+_TEMP_TABLE = re.compile(r"\btemp\.\w+", re.IGNORECASE)
+NOT_EXPLAINED = ["(uses a temp table of the request, not explained)"]
+
+# what the request that's running has executed so far: sql -> parameters of its first run
+_captured: ContextVar[Optional[Dict[str, tuple]]] = ContextVar("plan_statements", default=None)
+
+
+def _capture(conn, cursor, statement, parameters, context, executemany):
+    statements = _captured.get()
+    if statements is None or not statement.lstrip().upper().startswith(PLANNED):
+        return
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    statements.setdefault(statement, parameters)
+
+
+def explain(conn, statement: str, parameters) -> List[str]:
+    return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    subqueries = {match.group(1) for match in map(_SUBQUERY.match, plan) if match}
+    return [line for line in plan if (match := _FULL_SCAN.match(line)) and match.group(1) not in subqueries]
+
+
+# {route: [(sql, plan, full scans)]} for every scenario
+async def collect(seed: int = 42, only: Optional[List[str]] = None) -> Dict[str, List[Tuple[str, List[str], List[str]]]]:
+    from app.database import shards
+    from app.main import app
+
+    scenarios = _scenarios()
+    if only:
+        scenarios = {name: prepare for name, prepare in scenarios.items() if any(part in name for part in only)}
+
+    engines = {each for shard in shards for each in (shard.engine, shard.read_engine)}
+    statements_by_route: Dict[str, Dict[str, tuple]] = {}
+    async with app.router.lifespan_context(app):
+        ctx = Context(random.Random(seed), _load_habits())
+        for each in engines:
+            event.listen(each, "before_cursor_execute", _capture)
+        try:
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://plans") as client:
+                for name, prepare in scenarios.items():
+                    statements = statements_by_route[name] = {}
+                    for _ in range(SAMPLES):
+                        request = await prepare(client, ctx)  # untimed setup requests aren't captured
+                        token = _captured.set(statements)
+                        try:
+                            await client.request(**request)
+                        finally:
+                            _captured.reset(token)
+        finally:
+            for each in engines:
+                event.remove(each, "before_cursor_execute", _capture)
+
+    report = {}
+    with shards[0].engine.connect() as conn:  # same schema on every shard
+        for name, statements in statements_by_route.items():
+            report[name] = []
+            for statement, parameters in statements.items():
+                if _TEMP_TABLE.search(statement):
+                    report[name].append((statement, NOT_EXPLAINED, []))
+                    continue
+                plan = explain(conn, statement, parameters)
+                report[name].append((statement, plan, full_scans(plan)))
+    return report
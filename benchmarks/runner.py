@@ -0,0 +1,301 @@
+# benchmarks/runner.py
+# Drives every route in app/routes/habits.py and app/routes/completions.py through an in-process
+# ASGI client and reports latency percentiles, throughput, SQL statements per request and peak
+# memory per route, as JSON (so two commits can be diffed with `python -m benchmarks compare`).
+# With concurrency > 1 that many clients hammer each route at once.
+import httpx
+from sqlalchemy import event
+
+from typing import Awaitable, Callable, Dict, List, Optional
+from contextvars import ContextVar
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta, timezone
+
+
+# what one scenario needs to know about the synthetic data
+class Context:
+    def __init__(self, rnd: random.Random, habits_by_user: Dict[int, List[dict]]):
+        self.rnd = rnd
+        self.habits_by_user = habits_by_user
+        self.users = sorted(habits_by_user)
+
+    def user(self) -> int:
+        return self.rnd.choice(self.users)
+
+    def habit(self, user_id: Optional[int] = None) -> dict:
+        user_id = user_id if user_id is not None else self.user()
+        return self.rnd.choice(self.habits_by_user[user_id])
+
+
+Request = dict  # {"method", "url", "params"?, "json"?}
+Prepare = Callable[[httpx.AsyncClient, Context], Awaitable[Request]]
+
+
+def _get(url: str, **params) -> Request:
+    return {"method": "GET", "url": url, "params": params}
+
+
+def _habit_body(habit: dict) -> dict:
+    return {key: habit[key] for key in ("user_id", "name", "repeat_type", "start_date", "tracked", "type", "target", "weekdays")}
+
+
+async def _delete_prepare(client: httpx.AsyncClient, ctx: Context) -> Request:
+    # deleting eats habits, so every delete gets its own fresh one (not timed)
+    user_id = ctx.user()
+    body = _habit_body(ctx.habit(user_id))
+    body["name"] = "to be deleted"
+    created = (await client.post("/api/habits", json=body)).json()
+    return {"method": "DELETE", "url": f"/api/habits/{created['id']}", "params": {"user_id": user_id}}
+
+
+def _scenarios() -> Dict[str, Prepare]:
+    today = datetime.now(timezone.utc).date()
+
+    def simple(build: Callable[[Context], Request]) -> Prepare:
+        async def prepare(client, ctx):
+            return build(ctx)
+        return prepare
+
+    def habit_request(method: str, suffix: str = "", **extra) -> Prepare:
+        def build(ctx):
+            habit = ctx.habit()
+            return {"method": method, "url": f"/api/habits/{habit['id']}{suffix}", "params": {"user_id": habit["user_id"], **extra}}
+        return simple(build)
+
+    def complete(ctx):
+        habit = ctx.habit()
+        value = None if habit["type"] == "binary" else ctx.rnd.choice([1, 1, 2, -1])
+        return {"method": "POST", "url": f"/api/habits/{habit['id']}/complete", "json": {"user_id": habit["user_id"], "value": value}}
+
+    # a morning routine: a few of one user's habits at once
+    def batch(ctx):
+        user_id = ctx.user()
+        items = []
+        for habit in ctx.rnd.sample(ctx.habits_by_user[user_id], min(5, len(ctx.habits_by_user[user_id]))):
+            items.append({"habit_id": habit["id"], "value": None if habit["type"] == "binary" else ctx.rnd.choice([1, 2])})
+        return {"method": "POST", "url": "/api/completions/batch", "json": {"user_id": user_id, "items": items}}
+
+    def update(ctx):
+        habit = ctx.habit()
+        body = {"id": habit["id"], **_habit_body(habit)}
+        if body["target"] is not None:
+            body["target"] = max(1, body["target"] + ctx.rnd.choice([-1, 1]))
+        return {"method": "PUT", "url": f"/api/habits/{habit['id']}", "json": body}
+
+    # moves the user's whole history to the new zone's days
+    def set_timezone(ctx):
+        zone = ctx.rnd.choice(["UTC", "Europe/Berlin", "Asia/Tokyo", "America/New_York"])
+        return {"method": "PUT", "url": "/api/settings", "json": {"user_id": ctx.user(), "timezone": zone}}
+
+    def create(ctx):
+        body = _habit_body(ctx.habit())
+        body["name"] = "benchmark habit"
+        return {"method": "POST", "url": "/api/habits", "json": body}
+
+    return {
+        # app/routes/habits.py
+        "POST /api/habits": simple(create),
+        "GET /api/habits": simple(lambda ctx: _get("/api/habits", user_id=ctx.user())),
+        "GET /api/habits/tracked": simple(lambda ctx: _get("/api/habits/tracked", user_id=ctx.user())),
+        "DELETE /api/habits/{habit_id}": _delete_prepare,
+        "PATCH /api/habits/{habit_id}/untrack": habit_request("PATCH", "/untrack"),
+        "PATCH /api/habits/{habit_id}/track": habit_request("PATCH", "/track"),
+        "GET /api/habits/{habit_id}/streak": habit_request("GET", "/streak"),
+        "GET /api/habits/today": simple(lambda ctx: _get("/api/habits/today", user_id=ctx.user())),
+        "PUT /api/habits/{habit_id}": simple(update),
+        "GET /api/habits/{habit_id}": habit_request("GET"),
+        "GET /api/progress/today": simple(lambda ctx: _get("/api/progress/today", user_id=ctx.user())),
+        "GET /api/habits/today/summary": simple(lambda ctx: _get("/api/habits/today/summary", user_id=ctx.user())),
+        "GET /api/bootstrap": simple(lambda ctx: _get("/api/bootstrap", user_id=ctx.user())),
+        # app/routes/completions.py
+        "POST /api/habits/{habit_id}/complete": simple(complete),
+        "POST /api/completions/batch": simple(batch),
+        "GET /api/habits/{habit_id}/completions": habit_request("GET", "/completions"),
+        "GET /api/habits/{habit_id}/history": habit_request("GET", "/history", limit=50),
+        "GET /api/completions/export": simple(lambda ctx: _get("/api/completions/export", user_id=ctx.user())),
+        "GET /habits/completion_calendar": simple(lambda ctx: _get("/habits/completion_calendar", user_id=ctx.user())),
+        "GET /api/heatmap": simple(lambda ctx: _get(
+            "/api/heatmap", user_id=ctx.user(),
+            **{"from": (today - timedelta(days=364)).isoformat(), "to": today.isoformat()}
+        )),
+        "GET /api/stats": simple(lambda ctx: _get("/api/stats", user_id=ctx.user(), bucket=ctx.rnd.choice(["week", "month"]))),
+        # app/routes/settings.py
+        "GET /api/settings": simple(lambda ctx: _get("/api/settings", user_id=ctx.user())),
+        "PUT /api/settings": simple(set_timezone),
+    }
+
+
+def uncovered_routes(scenarios: Dict[str, Prepare]) -> List[str]:
+    from app.routes import completions, habits, settings
+
+    routes = []
+    for router in (habits.router, completions.router, settings.router):
+        for route in router.routes:
+            for method in sorted(route.methods):
+                routes.append(f"{method} {route.path}")
+    return [route for route in routes if route not in scenarios]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+# Statements are charged to the request that ran them through a contextvar (the app carries the
+# context into its db threads), so concurrent requests and untimed prepare steps don't mix
+_statements: ContextVar[Optional[List[int]]] = ContextVar("bench_statements", default=None)
+
+
+def statement_counter(*args, **kwargs):
+    box = _statements.get()
+    if box is not None:
+        box[0] += 1
+
+
+async def _timed(client, request: Request):
+    box = [0]
+    token = _statements.set(box)
+    started = time.perf_counter()
+    try:
+        response = await client.request(**request)
+    finally:
+        _statements.reset(token)
+    return response, time.perf_counter() - started, box[0]
+
+
+def _clear_caches():
+    from app import heatmap, localtime
+    from app.cache import read_cache
+
+    read_cache.clear()
+    localtime._zones.clear()
+    with heatmap._lock:
+        heatmap._tiles.clear()
+
+
+async def _run_scenario(client, ctx, prepare: Prepare, iterations: int, concurrency: int, cold: bool, memory_iterations: int) -> dict:
+    latencies: List[float] = []
+    totals = {"statements": 0, "errors": 0, "busy": 0.0}
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            request = await prepare(client, ctx)
+            if cold:
+                _clear_caches()
+            response, elapsed, statements = await _timed(client, request)
+            totals["statements"] += statements
+            totals["busy"] += elapsed
+            latencies.append(elapsed * 1000)
+            if response.status_code >= 400:
+                totals["errors"] += 1
+
+    # sequential runs report throughput over the time spent in requests (prepare steps excluded),
+    # concurrent ones over the wall clock
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started if concurrency > 1 else totals["busy"]
+
+    # memory is a separate (shorter) pass, tracemalloc slows everything down
+    gc.collect()
+    tracemalloc.start()
+    peak = 0
+    for _ in range(memory_iterations):
+        request = await prepare(client, ctx)
+        if cold:
+            _clear_caches()
+        tracemalloc.reset_peak()
+        await client.request(**request)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": iterations,
+        "concurrency": concurrency,
+        "errors": totals["errors"],
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "throughput_rps": round(iterations / wall, 1) if wall else 0.0,
+        "sql_per_request": round(totals["statements"] / iterations, 2) if iterations else 0.0,
+        "peak_memory_kib": round(peak / 1024, 1),
+    }
+
+
+def _load_habits() -> Dict[int, List[dict]]:
+    from app import models
+    from app.database import shards
+
+    habits_by_user: Dict[int, List[dict]] = {}
+    for shard in shards:
+        with shard.ReadSessionLocal() as db:
+            for habit in db.query(models.Habit).filter(models.Habit.deleted_at.is_(None)).all():
+                habits_by_user.setdefault(habit.user_id, []).append({
+                "id": habit.id,
+                "user_id": habit.user_id,
+                "name": habit.name,
+                "repeat_type": habit.repeat_type.value,
+                "start_date": habit.start_date.isoformat(),
+                "tracked": habit.tracked,
+                "type": habit.type.value,
+                "target": habit.target,
+                "weekdays": habit.weekdays,
+            })
+    return habits_by_user
+
+
+async def run(
+    iterations: int = 200,
+    only: Optional[List[str]] = None,
+    cold: bool = False,
+    seed: int = 42,
+    memory_iterations: int = 20,
+    concurrency: int = 1,
+    skip: Optional[List[str]] = None,
+) -> dict:
+    from app.database import shards
+    from app.main import app
+
+    scenarios = _scenarios()
+    if only:
+        scenarios = {name: prepare for name, prepare in scenarios.items() if any(part in name for part in only)}
+    if skip:
+        scenarios = {name: prepare for name, prepare in scenarios.items() if not any(part in name for part in skip)}
+
+    engines = {each for shard in shards for each in (shard.engine, shard.read_engine)}
+    results = {}
+    # the app's startup (migrations, background workers) runs like it does under uvicorn
+    async with app.router.lifespan_context(app):
+        ctx = Context(random.Random(seed), _load_habits())
+        for each in engines:
+            event.listen(each, "before_cursor_execute", statement_counter)
+        try:
+            # a crashing route is an error in the results, not the end of the run
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name, prepare in scenarios.items():
+                    results[name] = await _run_scenario(
+                        client, ctx, prepare, iterations, concurrency, cold, min(memory_iterations, iterations)
+                    )
+        finally:
+            for each in engines:
+                event.remove(each, "before_cursor_execute", statement_counter)
+
+    return {"routes": results, "uncovered": uncovered_routes(_scenarios())}
+
+
+def run_sync(**kwargs) -> dict:
+    return asyncio.run(run(**kwargs))
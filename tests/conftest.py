@@ -0,0 +1,20 @@
+# app.database reads HABITS_DATABASE_URL at import, so the scratch databases (and log file) are
+# set up here, before any test module imports the app
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="habits-tests-")
+os.environ["HABITS_DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'habits.db')}"
+os.environ["HABITS_LOG_FILE"] = os.path.join(_scratch, "debug.log")
+os.environ["HABITS_SHARDS"] = "2"  # so every test also goes through the shard routing
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,33 @@
+import json
+
+USER = 9001
+
+
+def _habit(client, **fields) -> dict:
+    body = {"user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary", **fields}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_backfills_with_an_offset_are_stored_as_utc(client):
+    walk = _habit(client)
+    water = _habit(client, name="water", type="countable", target=3)
+    response = client.put("/api/settings", json={"user_id": USER, "timezone": "Asia/Kolkata"})
+    assert response.status_code == 200, response.text
+
+    response = client.post("/api/completions/batch", json={"user_id": USER, "items": [
+        {"habit_id": walk["id"], "completed_at": "2024-05-01T23:30:00+05:30"},
+        {"habit_id": water["id"], "completed_at": "2024-05-02T02:00:00+05:30", "value": 2},  # still the 1st in UTC
+    ]})
+    assert response.status_code == 200, response.text
+    walked, drank = response.json()["results"]
+    assert walked["ok"] and drank["ok"]
+    assert walked["completion"]["completed_at"] == "2024-05-01T18:00:00"  # the same instant a client sent
+    assert drank["completion"]["completed_at"] == "2024-05-01T20:30:00"
+
+    exported = [json.loads(line) for line in client.get("/api/completions/export", params={"user_id": USER}).text.splitlines()]
+    assert sorted((row["habit_id"], row["completed_at"], row["day"]) for row in exported) == [
+        (walk["id"], "2024-05-01T18:00:00", "2024-05-01"),
+        (water["id"], "2024-05-01T20:30:00", "2024-05-02"),  # the user's day, in Kolkata
+    ]
@@ -0,0 +1,46 @@
+from app.cache import read_cache
+
+USER = 11001
+
+
+def _habit(client, user_id: int) -> dict:
+    body = {"user_id": user_id, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary"}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _complete(client, habit: dict):
+    response = client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": habit["user_id"], "value": None})
+    assert response.status_code == 200, response.text
+
+
+def _summary(client, etag: str = None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get("/api/habits/today/summary", params={"user_id": USER}, headers=headers)
+
+
+# a client that already has the body gets a bodyless 304 until one of its own writes changes it
+def test_etags_follow_the_users_own_writes(client):
+    mine, theirs = _habit(client, USER), _habit(client, USER + 1)
+
+    first = _summary(client)
+    assert first.status_code == 200, first.text
+    etag = first.headers["ETag"]
+    assert first.json()[0]["completed_today"] is False
+
+    again = _summary(client, etag)
+    assert (again.status_code, again.content, again.headers["ETag"]) == (304, b"", etag)
+
+    # someone else's write leaves this user's entries alone (served from the cache, not rebuilt)
+    generation = read_cache.generation(USER)
+    _complete(client, theirs)
+    assert read_cache.generation(USER) == generation
+    assert _summary(client, etag).status_code == 304
+
+    _complete(client, mine)
+    fresh = _summary(client, etag)
+    assert fresh.status_code == 200, fresh.text
+    assert fresh.headers["ETag"] != etag
+    assert fresh.json()[0]["completed_today"] is True
+    assert _summary(client, fresh.headers["ETag"]).status_code == 304
@@ -0,0 +1,43 @@
+from app import daybits, shards
+from app.database import shards as databases
+
+USER = 7001
+
+
+def _habit(client, **fields) -> dict:
+    body = {"user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary", **fields}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+# the year bitmaps are the only derived copy of habit_completions, every write path keeps them in step
+def test_the_bitmaps_follow_every_write_path(client):
+    walk = _habit(client)
+    water = _habit(client, name="water", type="countable", target=3)
+    sugar = _habit(client, name="sugar", type="limit", target=2)
+
+    def complete(habit, value=None):
+        response = client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": USER, "value": value})
+        assert response.status_code == 200, response.text
+
+    complete(walk)
+    complete(water, 2)
+    complete(water, 1)
+    complete(sugar, 1)
+    complete(sugar, -1)  # back to nothing
+    response = client.post("/api/completions/batch", json={"user_id": USER, "items": [
+        {"habit_id": walk["id"], "completed_at": "2024-03-01T08:00:00Z"},
+        {"habit_id": water["id"], "completed_at": "2024-12-31T20:00:00Z", "value": 4},
+        {"habit_id": water["id"], "completed_at": "2025-01-01T09:00:00Z", "value": 1},
+    ]})
+    assert response.status_code == 200, response.text
+    complete(walk)  # toggled off again
+
+    summary = {row["id"]: row for row in client.get("/api/habits/today/summary", params={"user_id": USER}).json()}
+    assert summary[walk["id"]]["completed_today"] is False
+    assert (summary[water["id"]]["current_value"], summary[water["id"]]["completed_today"]) == (3, True)
+    assert summary[sugar["id"]]["current_value"] == 0
+
+    with databases[shards.shard_of(USER)].SessionLocal() as db:
+        assert daybits.verify(db, USER) == []
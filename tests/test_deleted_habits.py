@@ -0,0 +1,23 @@
+from app import purge
+
+USER = 6001
+
+
+# a habit with a long history is only tombstoned on delete, its completions stay until the purger runs
+def test_a_tombstoned_habits_completions_are_gone_right_away(client, monkeypatch):
+    monkeypatch.setattr(purge, "INLINE_ROWS", 0)
+    monkeypatch.setattr(purge.purger, "wake", lambda: None)
+
+    habit = client.post("/api/habits", json={
+        "user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary",
+    }).json()
+    response = client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": USER, "value": None})
+    assert response.status_code == 200, response.text
+
+    params = {"user_id": USER}
+    assert len(client.get(f"/api/habits/{habit['id']}/completions", params=params).json()) == 1
+    assert len(client.get(f"/api/habits/{habit['id']}/history", params=params).json()["items"]) == 1
+
+    assert client.delete(f"/api/habits/{habit['id']}", params=params).status_code == 204
+    assert client.get(f"/api/habits/{habit['id']}/completions", params=params).json() == []
+    assert client.get(f"/api/habits/{habit['id']}/history", params=params).json()["items"] == []
@@ -0,0 +1,60 @@
+USER = 4001
+
+
+def _habit(client, **fields) -> dict:
+    body = {"user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary", **fields}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _update(client, habit: dict, **fields):
+    body = {key: habit[key] for key in ("user_id", "id", "name", "repeat_type", "start_date", "tracked", "target", "type")}
+    return client.put(f"/api/habits/{habit['id']}", json={**body, **fields})
+
+
+def test_null_for_a_required_field_is_a_400_and_changes_nothing(client):
+    habit = _habit(client)
+    for field in ("repeat_type", "name", "start_date", "tracked", "type"):
+        response = _update(client, habit, **{field: None})
+        assert response.status_code == 400, (field, response.text)
+        assert field in response.json()["detail"]
+    stored = client.get(f"/api/habits/{habit['id']}", params={"user_id": USER}).json()
+    assert stored == {key: habit[key] for key in stored}
+
+
+def test_unknown_repeat_type_is_rejected(client):
+    habit = _habit(client)
+    assert _update(client, habit, repeat_type="fortnightly").status_code == 422
+
+
+def test_switching_to_custom_needs_weekdays(client):
+    habit = _habit(client)
+    assert _update(client, habit, repeat_type="custom").status_code == 400
+    assert _update(client, habit, repeat_type="custom", weekdays=0).status_code == 400
+    assert _update(client, habit, repeat_type="custom", weekdays=None).status_code == 400
+
+    updated = _update(client, habit, repeat_type="custom", weekdays=0b0000101)
+    assert updated.status_code == 200, updated.text
+    assert updated.json()["weekdays"] == 0b0000101
+    # still custom, keeps its weekdays when they aren't sent, can't drop them
+    assert _update(client, updated.json(), name="walk more").status_code == 200
+    assert _update(client, updated.json(), weekdays=0).status_code == 400
+
+
+def test_nullable_fields_can_still_be_cleared(client):
+    habit = _habit(client, type="countable", target=5, reminder_time="08:00:00")
+    response = _update(client, habit, target=None, reminder_time=None)
+    assert response.status_code == 200, response.text
+    assert response.json()["target"] is None and response.json()["reminder_time"] is None
+
+
+def test_weekdays_outside_the_week_are_rejected(client):
+    habit = _habit(client)
+    for weekdays in (128, 0b10000001, -1):
+        response = client.post("/api/habits", json={
+            "user_id": USER, "name": "gym", "repeat_type": "custom", "start_date": "2024-01-01", "type": "binary", "weekdays": weekdays,
+        })
+        assert response.status_code == 400, (weekdays, response.text)
+        assert _update(client, habit, repeat_type="custom", weekdays=weekdays).status_code == 400
+    assert client.get(f"/api/habits/{habit['id']}", params={"user_id": USER}).json()["repeat_type"] == "daily"
@@ -0,0 +1,51 @@
+from sqlalchemy import insert
+
+from app import models, shards
+from app.database import shards as databases
+
+from typing import List, Tuple
+
+from datetime import date, datetime, timedelta
+
+USER = 12001
+ROWS = 130
+
+
+def _page_through(client, habit_id: int, order: str) -> Tuple[List[int], int]:
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {"user_id": USER, "limit": 7, "order": order, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/habits/{habit_id}/history", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        ids += [item["id"] for item in page["items"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+# pages are cut on (completed_at, id): a run of rows with the same completed_at split over two pages
+# loses or repeats nothing. The API can't log two days of one habit at the same instant, so the rows
+# go in directly, four days to each completed_at
+def test_history_pages_have_no_gaps_or_repeats(client):
+    habit = client.post("/api/habits", json={
+        "user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary",
+    }).json()
+    start = datetime(2024, 1, 1, 8)
+    rows = [
+        {"habit_id": habit["id"], "user_id": USER, "local_day": date(2024, 1, 1) + timedelta(days=number),
+         "completed_at": start + timedelta(hours=number // 4)}
+        for number in range(ROWS)
+    ]
+    with databases[shards.shard_of(USER)].engine.begin() as conn:
+        conn.execute(insert(models.HabitCompletion), rows)
+
+    response = client.get(f"/api/habits/{habit['id']}/completions", params={"user_id": USER})
+    stored = sorted((item["completed_at"], item["id"]) for item in response.json())
+    assert len(stored) == ROWS
+
+    newest_first, pages = _page_through(client, habit["id"], "desc")
+    assert pages == -(-ROWS // 7)
+    assert newest_first == [completion_id for _, completion_id in reversed(stored)]
+    assert _page_through(client, habit["id"], "asc")[0] == [completion_id for _, completion_id in stored]
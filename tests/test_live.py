@@ -0,0 +1,134 @@
+from app import live
+
+import asyncio
+import json
+
+from datetime import date
+
+USER = 5001
+
+
+def _habit(client, **fields) -> dict:
+    body = {"user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary", **fields}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _today(websocket) -> dict:
+    message = websocket.receive_json()
+    assert message["type"] == "today", message
+    return message
+
+
+def test_a_tap_on_one_device_reaches_the_others(client):
+    walk = _habit(client)
+    water = _habit(client, name="water", type="countable", target=3)
+
+    with client.websocket_connect(f"/api/live?user_id={USER}") as phone, \
+            client.websocket_connect(f"/api/live?user_id={USER}") as desktop:
+        response = client.post(f"/api/habits/{walk['id']}/complete", json={"user_id": USER, "value": None})
+        assert response.status_code == 200, response.text
+
+        for websocket in (phone, desktop):
+            message = _today(websocket)
+            assert [row["id"] for row in message["habits"]] == [walk["id"]]
+            assert message["habits"][0]["completed_today"] is True
+            assert message["removed"] == []
+
+        client.post(f"/api/habits/{water['id']}/complete", json={"user_id": USER, "value": 2})
+        row, = _today(desktop)["habits"]
+        assert (row["id"], row["current_value"], row["completed_today"]) == (water["id"], 2, False)
+        assert _today(phone)["habits"] == [row]
+
+
+def test_a_deleted_habit_leaves_the_other_devices_list(client):
+    habit = _habit(client, name="read")
+
+    with client.websocket_connect(f"/api/live?user_id={USER}") as other:
+        response = client.delete(f"/api/habits/{habit['id']}", params={"user_id": USER})
+        assert response.status_code == 204, response.text
+        message = _today(other)
+        assert message["removed"] == [habit["id"]]
+        assert message["habits"] == []
+
+
+def test_other_users_hear_nothing(client):
+    habit = _habit(client, name="stretch")
+
+    with client.websocket_connect(f"/api/live?user_id={USER + 1}") as stranger, \
+            client.websocket_connect(f"/api/live?user_id={USER}") as own:
+        client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": USER, "value": None})
+        assert _today(own)["habits"][0]["id"] == habit["id"]
+        # a change of the stranger's own comes through, and is the first thing they get
+        mine = client.post("/api/habits", json={
+            "user_id": USER + 1, "name": "mine", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary",
+        }).json()
+        assert [row["id"] for row in _today(stranger)["habits"]] == [mine["id"]]
+
+
+class _Socket:
+    # the hub's side of a websocket: stuck ones never finish a send, like a client that stopped reading
+    def __init__(self, stuck: bool = False):
+        self.stuck = stuck
+        self.messages = []
+        self.closed = None
+
+    async def send_text(self, text: str):
+        if self.stuck:
+            await asyncio.Event().wait()
+        self.messages.append(text)
+
+    async def close(self, code: int):
+        self.closed = code
+
+
+# a few hundred connections of one user on the hub itself (no database): every write is read once for all
+# of them, the fast ones end up with the latest rows, the stuck ones stop piling up rows and get dropped
+def test_the_hub_fans_out_and_drops_stuck_connections(monkeypatch):
+    monkeypatch.setattr(live, "SEND_TIMEOUT", 2.0)
+    monkeypatch.setattr(live, "MAX_PENDING", 16)
+    reads = []
+
+    async def run_read(fn):
+        return fn(None)
+
+    def build_today_rows(user_id, habit_ids, db):
+        reads.append(habit_ids)
+        return date(2024, 5, 1), [{"id": habit_id, "current_value": len(reads)} for habit_id in habit_ids], []
+
+    monkeypatch.setattr(live, "run_read", run_read)
+    monkeypatch.setattr(live, "build_today_rows", build_today_rows)
+
+    async def scenario():
+        hub = live.Hub()
+        fast = [_Socket() for _ in range(300)]
+        stuck = [_Socket(stuck=True) for _ in range(5)]
+        subscribers = {socket: hub.subscribe(socket, USER) for socket in fast + stuck}
+        assert hub.connections == 305
+
+        for round_ in range(80):
+            hub.changed(USER, [round_])  # a different habit every time, more than MAX_PENDING of them
+            await asyncio.sleep(0)
+        while hub._refreshing or any(subscribers[socket].sender for socket in fast):
+            await asyncio.sleep(0.01)
+
+        assert len(reads) <= 80  # once per round at most, never per connection
+        for socket in fast:
+            seen = {}
+            for text in socket.messages:
+                seen.update({row["id"]: row for row in json.loads(text)["habits"]})
+            assert sorted(seen) == list(range(80))
+        assert hub.connections == 305
+        for socket in stuck:
+            assert subscribers[socket].pending is None and subscribers[socket].resync  # bounded: one resync
+
+        for _ in range(500):
+            if not hub.connections > 300:
+                break
+            await asyncio.sleep(0.01)
+        assert (hub.dropped, hub.connections) == (5, 300)
+        assert all(socket.closed == 1013 for socket in stuck)
+        assert all(socket.closed is None for socket in fast)
+
+    asyncio.run(scenario())
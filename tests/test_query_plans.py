@@ -0,0 +1,28 @@
+# EXPLAIN QUERY PLAN of every statement the benchmark scenarios send (benchmarks/plans.py) on a
+# small synthetic dataset: none may read a whole table. Runs in its own process, the app reads
+# its database settings at import and this one needs its own database.
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOT_ROUTES = [
+    "GET /api/habits/today/summary",
+    "GET /api/bootstrap",
+    "POST /api/habits/{habit_id}/complete",
+    "GET /api/heatmap",
+    "GET /api/stats",
+]
+
+
+def test_no_full_table_scans(tmp_path):
+    env = {**os.environ, "HABITS_LOG_FILE": str(tmp_path / "debug.log")}
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks", "plans", "--db", str(tmp_path / "plans.db"),
+         "--users", "6", "--years", "0.5", "--shards", "2"],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=600,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    for route in HOT_ROUTES:
+        assert route in result.stdout, f"{route} wasn't checked"
+    assert "0 statement(s) with a full table scan" in result.stdout
@@ -0,0 +1,141 @@
+# Sender / ReminderScheduler against a local stand-in for the Bot API (httpx.MockTransport)
+import httpx
+
+from typing import List, Tuple
+import asyncio
+import json
+import time
+
+from datetime import datetime, time as day_time, timedelta, timezone
+
+from app import models, reminders
+from app.db_async import run_read
+from app.reminders import ReminderScheduler, Sender
+
+
+# records every sendMessage, answers with what `respond` says for the n-th one (default 200)
+class FakeBotApi:
+    def __init__(self, respond=None):
+        self.calls: List[Tuple[float, int, str]] = []
+        self.respond = respond or (lambda number, chat_id: httpx.Response(200, json={"ok": True}))
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path.endswith("/sendMessage")
+        body = json.loads(request.content)
+        self.calls.append((time.monotonic(), body["chat_id"], body["text"]))
+        return self.respond(len(self.calls), body["chat_id"])
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler), base_url="http://bot.test/botTOKEN/")
+
+
+async def _drain(sender: Sender, messages: int, timeout: float = 5.0):
+    started = time.monotonic()
+    while sender.sent < messages and time.monotonic() - started < timeout:
+        await asyncio.sleep(0.01)
+
+
+def _send_all(api: FakeBotApi, messages: List[Tuple[int, str]], expect: int, **rates) -> Sender:
+    async def scenario():
+        sender = Sender(api.client(), **rates)
+        sender.start()
+        for chat_id, text in messages:
+            sender.put(chat_id, text)
+        await _drain(sender, expect)
+        await asyncio.sleep(0.05)  # anything that shouldn't come anymore
+        await sender.stop()
+        return sender
+
+    return asyncio.run(scenario())
+
+
+def test_429_pauses_for_retry_after_then_resends():
+    def respond(number, chat_id):
+        if number == 1:
+            return httpx.Response(429, json={"ok": False, "parameters": {"retry_after": 1}})
+        return httpx.Response(200, json={"ok": True})
+
+    api = FakeBotApi(respond)
+    sender = _send_all(api, [(1, "hello")], expect=1)
+    assert sender.sent == 1
+    assert [chat_id for _, chat_id, _ in api.calls] == [1, 1]
+    assert api.calls[1][0] - api.calls[0][0] >= 0.95
+
+
+def test_429_without_json_body_still_retries():
+    def respond(number, chat_id):
+        if number == 1:
+            return httpx.Response(429, text="<html>Too Many Requests</html>")
+        return httpx.Response(200, json={"ok": True})
+
+    api = FakeBotApi(respond)
+    sender = _send_all(api, [(1, "hello")], expect=1)
+    assert sender.sent == 1 and len(api.calls) == 2
+
+
+def test_403_blocked_chat_is_dropped_not_retried():
+    def respond(number, chat_id):
+        if chat_id == 666:
+            return httpx.Response(403, json={"ok": False, "description": "Forbidden: bot was blocked by the user"})
+        return httpx.Response(200, json={"ok": True})
+
+    api = FakeBotApi(respond)
+    sender = _send_all(api, [(666, "hi"), (2, "hi")], expect=1)
+    assert sender.sent == 1
+    assert [chat_id for _, chat_id, _ in api.calls].count(666) == 1
+
+
+def test_per_chat_bucket_spaces_one_chats_messages():
+    api = FakeBotApi()
+    sender = _send_all(api, [(7, f"message {n}") for n in range(3)], expect=3, rate=1000, chat_rate=10)
+    assert sender.sent == 3
+    times = [at for at, _, _ in api.calls]
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+
+
+def test_global_bucket_caps_all_chats_together():
+    api = FakeBotApi()
+    sender = _send_all(api, [(chat_id, "hi") for chat_id in range(1, 11)], expect=10, rate=20, chat_rate=1)
+    assert sender.sent == 10
+    times = sorted(at for at, _, _ in api.calls)
+    assert times[-1] - times[0] >= 9 / 20 - 0.02  # 10 messages at 20/s, no burst
+
+
+def test_scheduler_reminds_only_about_habits_not_done(client):
+    user_id = 3001
+    made = {}
+    for name, habit_type, target in (("stretch", "binary", None), ("water", "countable", 3), ("read", "binary", None)):
+        made[name] = client.post("/api/habits", json={
+            "user_id": user_id, "name": name, "repeat_type": "daily", "start_date": "2024-01-01",
+            "type": habit_type, "target": target, "reminder_time": "08:00:00",
+        }).json()
+    client.post(f"/api/habits/{made['stretch']['id']}/complete", json={"user_id": user_id})  # done today
+    client.post(f"/api/habits/{made['water']['id']}/complete", json={"user_id": user_id, "value": 1})  # 1 of 3
+
+    def load(db):
+        return db.query(models.Habit).filter(models.Habit.user_id == user_id).all()
+
+    async def scenario():
+        from app import shards
+
+        api = FakeBotApi()
+        scheduler = ReminderScheduler(Sender(api.client()))
+        with shards.using(shards.shard_of(user_id)):
+            habits = await run_read(load)
+        midnight = datetime.combine(datetime.now(timezone.utc).date(), day_time(0), tzinfo=timezone.utc)
+        for habit in habits:
+            scheduler.schedule(habit, midnight)  # today 08:00 UTC
+        await scheduler.fire((midnight + timedelta(hours=8, seconds=1)).timestamp())
+        scheduler.sender.start()
+        await _drain(scheduler.sender, 1)
+        await scheduler.stop()
+        return api, scheduler
+
+    api, scheduler = asyncio.run(scenario())
+    assert [(chat_id, text) for _, chat_id, text in api.calls] == [(user_id, "Reminders for today:\n• water\n• read")]
+    assert len(scheduler.heap) == 3  # and each one is set for its next due day
+
+
+def test_reminders_stay_off_without_a_token():
+    asyncio.run(reminders.start())
+    assert reminders.scheduler is None
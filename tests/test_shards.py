@@ -0,0 +1,86 @@
+from sqlalchemy import func, select
+
+from app import heatmap, localtime, models, shards
+from app.cache import read_cache
+from app.database import shards as databases
+
+import json
+
+from datetime import datetime, timedelta, timezone
+
+USER = 10001  # jump-hashed to shard 0 of the 2
+
+
+def _habit(client, **fields) -> dict:
+    body = {"user_id": USER, "name": "walk", "repeat_type": "daily", "start_date": "2024-01-01", "type": "binary", **fields}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+# everything the user can read back, completion ids left out (a move renumbers them, in the same order)
+def _reads(client, habits: list) -> dict:
+    read_cache.clear()
+    localtime._zones.clear()
+    with heatmap._lock:
+        heatmap._tiles.clear()
+    params = {"user_id": USER}
+
+    def get(url, **extra):
+        response = client.get(url, params={**params, **extra})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def without_ids(rows):
+        return [{key: value for key, value in row.items() if key != "id"} for row in rows]
+
+    export = client.get("/api/completions/export", params=params).text.splitlines()
+    return {
+        "habits": get("/api/habits"),
+        "settings": get("/api/settings"),
+        "summary": get("/api/habits/today/summary"),
+        "stats": get("/api/stats", **{"from": "2024-01-01", "to": "2024-12-31"}),
+        "heatmap": get("/api/heatmap", **{"from": "2024-01-01", "to": "2024-12-31"}),
+        "streaks": [get(f"/api/habits/{habit['id']}/streak") for habit in habits],
+        "history": [without_ids(get(f"/api/habits/{habit['id']}/history")["items"]) for habit in habits],
+        "export": without_ids(json.loads(line) for line in export),
+    }
+
+
+TABLES = [models.Habit, models.HabitCompletion, models.HabitYearBits, models.HabitStreak, models.UserSettings]
+
+
+def _rows(index: int) -> dict:
+    with databases[index].SessionLocal() as db:
+        return {
+            model.__tablename__: db.execute(select(func.count()).select_from(model).where(model.user_id == USER)).scalar()
+            for model in TABLES
+        }
+
+
+def test_moving_a_user_to_another_shard(client):
+    assert shards.shard_of(USER) == 0
+    walk = _habit(client)
+    water = _habit(client, name="water", type="countable", target=3)
+    assert client.put("/api/settings", json={"user_id": USER, "timezone": "Europe/Berlin"}).status_code == 200
+
+    now = datetime.now(timezone.utc)
+    items = [{"habit_id": walk["id"], "completed_at": (now - timedelta(days=days)).isoformat()} for days in range(3)]
+    items += [
+        {"habit_id": water["id"], "completed_at": "2024-03-01T08:00:00Z", "value": 2},
+        {"habit_id": water["id"], "completed_at": "2024-03-01T09:00:00Z", "value": 2},
+        {"habit_id": water["id"], "completed_at": "2024-12-31T12:00:00Z", "value": 1},
+    ]
+    response = client.post("/api/completions/batch", json={"user_id": USER, "items": items})
+    assert response.status_code == 200, response.text
+
+    before = _reads(client, [walk, water])
+    assert before["streaks"][0] == 3 and len(before["export"]) == 5
+    rows = _rows(0)
+    assert all(rows.values()), rows
+
+    assert shards.main(["move", str(USER), "1"]) == 0
+    assert shards.shard_of(USER) == 1
+    assert _rows(0) == dict.fromkeys(rows, 0)
+    assert _rows(1) == rows
+    assert _reads(client, [walk, water]) == before
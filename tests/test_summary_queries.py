@@ -0,0 +1,67 @@
+# The today summary and the bootstrap payload load every habit's rows with a fixed number of
+# queries, however many habits the user has (no per-habit queries)
+import pytest
+from sqlalchemy import event
+
+from datetime import date
+
+from app.database import shards
+
+TYPES = [("binary", None), ("countable", 3), ("limit", 2)]
+REPEATS = ["daily", "weekly", "custom", "monthly"]
+
+
+def _make_user(client, user_id: int, habits: int):
+    for number in range(habits):
+        habit_type, target = TYPES[number % len(TYPES)]
+        repeat = REPEATS[number % len(REPEATS)]
+        created = client.post("/api/habits", json={
+            "user_id": user_id,
+            "name": f"habit {number}",
+            "repeat_type": repeat,
+            "start_date": date(2024, 1, 1).isoformat(),
+            "type": habit_type,
+            "target": target,
+            "weekdays": 0b0010101 if repeat == "custom" else None,
+        })
+        assert created.status_code == 200, created.text
+        if number % 2:
+            value = None if habit_type == "binary" else 1
+            client.post(f"/api/habits/{created.json()['id']}/complete", json={"user_id": user_id, "value": value})
+
+
+def _statements(client, url: str, user_id: int) -> int:
+    from app import heatmap, localtime
+    from app.cache import read_cache
+
+    # cold: nothing answered from the in-process caches
+    read_cache.clear()
+    localtime._zones.clear()
+    with heatmap._lock:
+        heatmap._tiles.clear()
+
+    count = [0]
+
+    def counter(*args):
+        count[0] += 1
+
+    engines = {each for shard in shards for each in (shard.engine, shard.read_engine)}
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", counter)
+    try:
+        response = client.get(url, params={"user_id": user_id})
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", counter)
+    assert response.status_code == 200, response.text
+    return count[0]
+
+
+@pytest.mark.parametrize("url, first_user", [("/api/habits/today/summary", 1001), ("/api/bootstrap", 1011)])
+def test_query_count_does_not_grow_with_habits(client, url, first_user):
+    _make_user(client, first_user, 1)
+    _make_user(client, first_user + 1, 50)
+    one = _statements(client, url, first_user)
+    fifty = _statements(client, url, first_user + 1)
+    assert one == fifty, f"{url}: {one} statements for 1 habit, {fifty} for 50"
+    assert fifty == 4, f"{url}: {fifty} statements"
@@ -0,0 +1,86 @@
+import json
+
+from sqlalchemy import text
+
+from app import localtime, shards
+from app.database import shards as databases
+
+USER = 8001
+
+
+def _habit(client, user_id: int) -> dict:
+    body = {"user_id": user_id, "name": "water", "repeat_type": "daily", "start_date": "2024-01-01", "type": "countable", "target": 8}
+    response = client.post("/api/habits", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _log(client, habit: dict, completed_at: str, value: int):
+    response = client.post(f"/api/habits/{habit['id']}/complete", json={"user_id": habit["user_id"], "completed_at": completed_at, "value": value})
+    assert response.status_code == 200, response.text
+
+
+def _days(client, user_id: int) -> list:
+    response = client.get("/api/completions/export", params={"user_id": user_id})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    return sorted((row["id"], row["day"], row["value"]) for row in rows)
+
+
+def _set_zone(client, user_id: int, name: str):
+    response = client.put("/api/settings", json={"user_id": user_id, "timezone": name})
+    assert response.status_code == 200, response.text
+
+
+def test_changing_the_timezone_moves_and_merges_days(client):
+    habit = _habit(client, USER)
+    _log(client, habit, "2024-05-01T23:30:00Z", 2)
+    _log(client, habit, "2024-05-02T01:00:00Z", 3)
+    _log(client, habit, "2024-05-03T20:00:00Z", 1)
+    days = _days(client, USER)
+    assert [(day, value) for _, day, value in days] == [("2024-05-01", 2), ("2024-05-02", 3), ("2024-05-03", 1)]
+    oldest = days[0][0]
+
+    # +9: the first two are the morning of the 2nd now, merged into the oldest row, the last one moves to the 4th
+    _set_zone(client, USER, "Asia/Tokyo")
+    days = _days(client, USER)
+    assert [(day, value) for _, day, value in days] == [("2024-05-02", 5), ("2024-05-04", 1)]
+    assert days[0][0] == oldest
+
+    # -7 (daylight saving time): both go back a day, the merge stays
+    _set_zone(client, USER, "America/Los_Angeles")
+    assert [(day, value) for _, day, value in _days(client, USER)] == [("2024-05-01", 5), ("2024-05-03", 1)]
+
+
+# another worker changed the timezone: writes see it right away, reads once the cached zone is ZONE_TTL old
+def test_another_workers_timezone_change(client, monkeypatch):
+    user_id = USER + 1
+    habit = _habit(client, user_id)
+    assert client.get("/api/settings", params={"user_id": user_id}).json()["timezone"] == "UTC"
+
+    with databases[shards.shard_of(user_id)].engine.begin() as conn:
+        conn.execute(text("INSERT INTO user_settings (user_id, timezone) VALUES (:user_id, 'Asia/Tokyo')"), {"user_id": user_id})
+
+    assert client.get("/api/settings", params={"user_id": user_id}).json()["timezone"] == "UTC"  # cached
+    _log(client, habit, "2024-05-01T20:00:00Z", 1)
+    assert [day for _, day, _ in _days(client, user_id)] == ["2024-05-02"]  # Tokyo's day, not the cached UTC one
+
+    monkeypatch.setattr(localtime, "ZONE_TTL", 0)
+    assert client.get("/api/settings", params={"user_id": user_id}).json()["timezone"] == "Asia/Tokyo"
+
+
+# a completed_at with an offset is stored as its UTC instant, so re-dating it gives the same day back
+def test_an_offset_carrying_completion_keeps_its_day(client):
+    user_id = USER + 2
+    habit = _habit(client, user_id)
+    _set_zone(client, user_id, "Asia/Kolkata")
+    _log(client, habit, "2024-05-01T23:30:00+05:30", 2)
+
+    def stored():
+        row, = [json.loads(line) for line in client.get("/api/completions/export", params={"user_id": user_id}).text.splitlines()]
+        return row["completed_at"], row["day"]
+
+    assert stored() == ("2024-05-01T18:00:00", "2024-05-01")
+    _set_zone(client, user_id, "UTC")
+    assert stored() == ("2024-05-01T18:00:00", "2024-05-01")
+    _set_zone(client, user_id, "Asia/Kolkata")
+    assert stored() == ("2024-05-01T18:00:00", "2024-05-01")
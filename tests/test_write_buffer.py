@@ -0,0 +1,95 @@
+import asyncio
+
+from datetime import date
+
+from app import shards, write_buffer
+from app.write_buffer import WriteBuffer
+
+
+DAY = date(2025, 1, 1)
+
+
+# run_write stand-in: records what each shard's transaction got, the first one can be held open
+class FakeWriter:
+    def __init__(self):
+        self.written = {}
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, fn, part):
+        index = shards._current.get()
+        self.started.set()
+        await self.release.wait()
+        for key, taps in part.items():
+            self.written[key] = (index, taps.value_after(None))
+        return list(part)
+
+
+def _setup(monkeypatch):
+    writer = FakeWriter()
+    monkeypatch.setattr(write_buffer, "run_write", writer)
+    monkeypatch.setattr(write_buffer, "user_data_changed", lambda *args: None)
+    monkeypatch.setattr(shards, "shard_of", lambda user_id: user_id % 2)  # two shards
+    return writer
+
+
+def test_stop_during_multi_shard_flush_keeps_every_tap(monkeypatch):
+    async def scenario():
+        writer = _setup(monkeypatch)
+        buffer = WriteBuffer(interval_ms=10)
+        buffer.start()
+        buffer.add(1, 10, DAY, 2, None)
+        buffer.add(2, 20, DAY, 3, None)
+        await writer.started.wait()  # the timer's flush is in its first shard's transaction
+
+        stopping = asyncio.get_running_loop().create_task(buffer.stop())
+        await asyncio.sleep(0.05)
+        buffer.add(1, 11, DAY, 1, None)  # came in while shutting down
+        writer.release.set()
+        await stopping
+        return writer, buffer
+
+    writer, buffer = asyncio.run(scenario())
+    assert writer.written == {(1, 10, DAY): (1, 2), (2, 20, DAY): (0, 3), (1, 11, DAY): (1, 1)}
+    assert not buffer._pending
+
+
+def test_cancelled_reader_does_not_drop_taps(monkeypatch):
+    async def scenario():
+        writer = _setup(monkeypatch)
+        buffer = WriteBuffer(interval_ms=10_000)
+        buffer.add(1, 10, DAY, 1, None)
+        buffer.add(2, 20, DAY, 1, None)
+        reader = asyncio.get_running_loop().create_task(buffer.flush())
+        await writer.started.wait()
+        reader.cancel()  # e.g. the request's client went away
+        await asyncio.sleep(0)
+        writer.release.set()
+        await buffer.settled()
+        return writer, buffer
+
+    writer, buffer = asyncio.run(scenario())
+    assert writer.written == {(1, 10, DAY): (1, 1), (2, 20, DAY): (0, 1)}
+    assert not buffer._pending
+
+
+def test_failed_final_flush_is_retried(monkeypatch):
+    async def scenario():
+        calls = []
+
+        async def flaky(fn, part):
+            calls.append(dict(part))
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return list(part)
+
+        monkeypatch.setattr(write_buffer, "run_write", flaky)
+        monkeypatch.setattr(write_buffer, "user_data_changed", lambda *args: None)
+        buffer = WriteBuffer(interval_ms=10_000)
+        buffer.add(1, 10, DAY, 4, None)
+        await buffer.stop()
+        return calls, buffer
+
+    calls, buffer = asyncio.run(scenario())
+    assert len(calls) == 2 and (1, 10, DAY) in calls[1]
+    assert not buffer._pending